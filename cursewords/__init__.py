@@ -1 +1,9 @@
-from .cursewords import *
+import importlib
+
+
+def __getattr__(name):
+    # cursewords.cursewords imports blessed and every mode, so it's only
+    # imported once something from it is used. That keeps submodules like
+    # the prefork launcher, which needs nothing but the standard library,
+    # quick to start.
+    return getattr(importlib.import_module('.cursewords', __name__), name)
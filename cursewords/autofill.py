@@ -0,0 +1,343 @@
+"""cursewords autofill: fill a partly built grid from a word list.
+
+Every across and down entry is a slot whose domain is the set of words
+that could go there, held as a bitset over the word list index (see
+wordlist.py). Filling a square narrows the slots crossing it; arc
+consistency keeps every pair of crossing slots agreeing on the letters
+they share, which is a handful of bitset ANDs per crossing. The search
+always fills the slot with the fewest remaining words next, and backtracks
+when a slot runs out.
+
+The candidates for the first slot are dealt out to worker processes, each
+of which searches its share of the tree with the same memory-mapped index.
+"""
+
+import argparse
+import concurrent.futures
+import multiprocessing
+import os
+import sys
+import time
+
+from . import formats
+from . import puz
+from . import wordlist
+
+stop_event = None
+
+
+class Timeout(Exception):
+    pass
+
+
+class Stopped(Exception):
+    pass
+
+
+def popcount(bits):
+    return bin(bits).count('1')
+
+
+def find_slots(puzzle):
+    """The cells of every entry, as numbered by DefaultClueNumbering."""
+    numbering = puzzle.clue_numbering()
+    return ([tuple(numbering.across_cells(entry)) for entry in numbering.across] +
+            [tuple(numbering.down_cells(entry)) for entry in numbering.down])
+
+
+class Solver:
+    def __init__(self, fill, slots, index, deadline=None):
+        self.fill = fill
+        self.slots = slots
+        self.index = index
+        self.deadline = deadline
+        self.nodes = 0
+        self.bitsets = {}
+
+        # slots whose squares are all filled in already are left as they
+        # are, even if they aren't in the word list
+        self.open_slots = [i for i, cells in enumerate(slots)
+                           if any(fill[cell] == '-' for cell in cells)]
+
+        self.crossings = dict((i, []) for i in self.open_slots)
+        squares = {}
+        for i in self.open_slots:
+            for position, cell in enumerate(slots[i]):
+                for j, other_position in squares.get(cell, []):
+                    self.crossings[i].append((position, j, other_position))
+                    self.crossings[j].append((other_position, i, position))
+                squares.setdefault(cell, []).append((i, position))
+
+        self.by_length = {}
+        for i in self.open_slots:
+            self.by_length.setdefault(len(slots[i]), []).append(i)
+
+    def letter_bitsets(self, length, position):
+        """{letter: bitset} for the letters used at position in words of
+        length, cached since every revision needs them."""
+        key = (length, position)
+        if key not in self.bitsets:
+            self.bitsets[key] = {}
+            if length in self.index.lengths:
+                for c in wordlist.SYMBOLS:
+                    bits = self.index.bitset(length, position, c)
+                    if bits:
+                        self.bitsets[key][c] = bits
+        return self.bitsets[key]
+
+    def initial_domains(self):
+        domains = [0] * len(self.slots)
+        for i in self.open_slots:
+            length = len(self.slots[i])
+            if length not in self.index.lengths:
+                continue
+            bits = (1 << self.index.lengths[length][0]) - 1
+            for position, cell in enumerate(self.slots[i]):
+                if self.fill[cell] != '-':
+                    bits &= self.letter_bitsets(length, position).get(
+                        self.fill[cell], 0)
+            domains[i] = bits
+        return domains
+
+    def revise(self, domains, i, position, j, other_position):
+        """Narrow slot j to words agreeing with some word left in slot i
+        at the square they share. Returns True if j lost any words."""
+        allowed = 0
+        other = self.letter_bitsets(len(self.slots[j]), other_position)
+        for c, bits in self.letter_bitsets(len(self.slots[i]),
+                                           position).items():
+            if c in other and domains[i] & bits:
+                allowed |= other[c]
+        narrowed = domains[j] & allowed
+        changed = narrowed != domains[j]
+        domains[j] = narrowed
+        return changed
+
+    def propagate(self, domains, queue):
+        queue = list(queue)
+        queued = set(queue)
+        while queue:
+            i = queue.pop()
+            queued.discard(i)
+            for position, j, other_position in self.crossings[i]:
+                if self.revise(domains, i, position, j, other_position):
+                    if not domains[j]:
+                        return False
+                    if j not in queued:
+                        queue.append(j)
+                        queued.add(j)
+        return True
+
+    def solve(self, domains, assigned, solutions, max_solutions):
+        unassigned = [i for i in self.open_slots if i not in assigned]
+        if not unassigned:
+            solutions.append(self.result(domains))
+            return len(solutions) >= max_solutions
+
+        slot = min(unassigned, key=lambda i: popcount(domains[i]))
+        candidates = domains[slot]
+        while candidates:
+            bit = candidates & -candidates
+            candidates ^= bit
+            self.nodes += 1
+            self.check()
+
+            trial = list(domains)
+            trial[slot] = bit
+            # a word can only be used once in the grid
+            touched = [slot]
+            for other in self.by_length[len(self.slots[slot])]:
+                if other != slot and other not in assigned and trial[other] & bit:
+                    trial[other] &= ~bit
+                    if not trial[other]:
+                        break
+                    touched.append(other)
+            else:
+                if self.propagate(trial, touched):
+                    assigned.add(slot)
+                    done = self.solve(trial, assigned, solutions,
+                                      max_solutions)
+                    assigned.discard(slot)
+                    if done:
+                        return True
+        return False
+
+    def check(self):
+        if self.deadline and time.time() > self.deadline:
+            raise Timeout()
+        if stop_event is not None and stop_event.is_set():
+            raise Stopped()
+
+    def result(self, domains):
+        fill = list(self.fill)
+        for i in self.open_slots:
+            word = self.index.word(len(self.slots[i]),
+                                   domains[i].bit_length() - 1)
+            for cell, c in zip(self.slots[i], word):
+                fill[cell] = c
+        return ''.join(fill)
+
+    def search(self, first_slot=None, choices=None, max_solutions=1):
+        """
+        Returns (status, solutions), status being 'done' once the whole
+        tree (or this worker's share of it) has been searched, or 'timeout'
+        or 'stopped'. first_slot and choices limit the search to some of
+        first_slot's candidate words.
+        """
+        solutions = []
+        domains = self.initial_domains()
+        if first_slot is not None:
+            domains[first_slot] &= choices
+        if (any(not domains[i] for i in self.open_slots) or
+                not self.propagate(domains, self.open_slots)):
+            return 'done', solutions
+        try:
+            self.solve(domains, set(), solutions, max_solutions)
+        except Timeout:
+            return 'timeout', solutions
+        except Stopped:
+            return 'stopped', solutions
+        return 'done', solutions
+
+
+def init_worker(event):
+    global stop_event
+    stop_event = event
+
+
+def search_share(fill, slots, wordlist_file, first_slot, choices,
+                 max_solutions, deadline):
+    """Worker: search one share of the first slot's candidates."""
+    solver = Solver(fill, slots, wordlist.load(wordlist_file), deadline)
+    status, solutions = solver.search(first_slot, choices, max_solutions)
+    if solutions and len(solutions) >= max_solutions:
+        stop_event.set()
+    return status, solutions, solver.nodes
+
+
+def deal(bits, shares):
+    """Split a bitset round-robin, so every share gets some of the best
+    candidates."""
+    hands = [0] * shares
+    n = 0
+    while bits:
+        bit = bits & -bits
+        bits ^= bit
+        hands[n % shares] |= bit
+        n += 1
+    return [hand for hand in hands if hand]
+
+
+def autofill(puzzle, wordlist_file, jobs=None, budget=None, max_solutions=1):
+    """Returns (status, solutions, nodes)."""
+    deadline = time.time() + budget if budget else None
+    fill = puzzle.fill
+    slots = find_slots(puzzle)
+    solver = Solver(fill, slots, wordlist.load(wordlist_file), deadline)
+    jobs = jobs or os.cpu_count() or 1
+
+    domains = solver.initial_domains()
+    if (any(not domains[i] for i in solver.open_slots) or
+            not solver.propagate(domains, solver.open_slots)):
+        return 'done', [], 0
+    if not solver.open_slots:
+        return 'done', [fill], 0
+
+    first_slot = min(solver.open_slots, key=lambda i: popcount(domains[i]))
+    hands = deal(domains[first_slot], jobs)
+    if len(hands) == 1:
+        status, solutions = solver.search(max_solutions=max_solutions)
+        return status, solutions, solver.nodes
+
+    event = multiprocessing.Event()
+    statuses, solutions, nodes = [], [], 0
+    with concurrent.futures.ProcessPoolExecutor(
+            len(hands), initializer=init_worker, initargs=(event,)) as pool:
+        futures = [pool.submit(search_share, fill, slots, wordlist_file,
+                               first_slot, hand, max_solutions, deadline)
+                   for hand in hands]
+        for future in concurrent.futures.as_completed(futures):
+            status, found, worker_nodes = future.result()
+            statuses.append(status)
+            solutions.extend(found)
+            nodes += worker_nodes
+
+    if len(solutions) >= max_solutions:
+        status = 'done'
+    elif 'timeout' in statuses:
+        status = 'timeout'
+    else:
+        status = 'done'
+    return status, solutions[:max_solutions], nodes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords autofill',
+        description="""Fill the empty squares of a puzzle's grid from a word
+        list, or check whether it can be filled.""")
+    parser.add_argument('filename', metavar='PUZfile',
+                        help="""puzzle whose entered letters and black
+                        squares are to be kept""")
+    parser.add_argument('-w', '--wordlist', metavar='FILE', required=True,
+                        help="""word list, one word per line, optionally
+                        as WORD;SCORE""")
+    parser.add_argument('-o', '--output', metavar='FILE',
+                        help="""write the filled grid to FILE as a .puz,
+                        with the fill as its solution""")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="""number of worker processes
+                        (default: one per CPU)""")
+    parser.add_argument('-t', '--time', type=float, default=60,
+                        metavar='SECONDS',
+                        help="""give up after SECONDS (default: 60)""")
+    parser.add_argument('--unique', action='store_true',
+                        help="""check whether there's exactly one fill""")
+
+    args = parser.parse_args(argv)
+
+    try:
+        puzzle = formats.read(args.filename)
+    except Exception:
+        sys.exit("Unable to parse {} as a puzzle file.".format(args.filename))
+    if puzzle.has_rebus():
+        sys.exit("Puzzles with rebus squares can't be filled automatically.")
+
+    start = time.time()
+    try:
+        status, solutions, nodes = autofill(
+            puzzle, args.wordlist, jobs=args.jobs, budget=args.time,
+            max_solutions=2 if args.unique else 1)
+    except (OSError, ValueError) as err:
+        sys.exit("Unable to read {} as a word list: {}".format(
+            args.wordlist, err))
+    elapsed = time.time() - start
+
+    if solutions:
+        fill = solutions[0]
+        for row in range(puzzle.height):
+            print(' '.join(fill[row * puzzle.width:(row + 1) * puzzle.width]))
+        print()
+
+    if args.unique and len(solutions) > 1:
+        print("The grid can be filled in more than one way.")
+    elif args.unique and status == 'done' and solutions:
+        print("The grid has exactly one fill.")
+    elif solutions:
+        print("The grid can be filled.")
+    elif status == 'timeout':
+        print("Gave up after {:g} seconds.".format(args.time))
+    else:
+        print("The grid can't be filled from this word list.")
+
+    print("Searched {} nodes in {:.2f}s ({:.0f} nodes/s).".format(
+        nodes, elapsed, nodes / elapsed if elapsed else 0))
+
+    if solutions and args.output:
+        puzzle.solution = puzzle.fill = solutions[0]
+        if puzzle.is_solution_locked():
+            puzzle.solution_state = puz.SolutionState.Unlocked
+            puzzle.scrambled_cksum = 0
+        puz.Puzzle.save(puzzle, args.output)
+
+    return 0 if solutions else 1
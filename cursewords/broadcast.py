@@ -0,0 +1,328 @@
+"""Spectator mode: viewers watching a solving session live.
+
+A session started with --broadcast runs a small asyncio hub on its own
+thread. The input loop publishes each change once, as the same 8-byte
+records the journal uses, and the hub writes that one buffer to every
+viewer. Viewers started with `cursewords watch` get the puzzle and a
+keyframe of the whole grid when they connect, then the stream of changes.
+
+A viewer that can't keep up stops receiving changes. Once it has drained
+what it was already sent, it gets a fresh keyframe instead of everything
+it missed, so a slow viewer costs the hub a bounded amount of memory.
+"""
+
+import argparse
+import asyncio
+import collections
+import select
+import struct
+import sys
+import textwrap
+import threading
+
+from blessed import Terminal
+
+from . import coop
+from . import cursewords
+from . import journal
+from . import puz
+
+PUZZLE = 32
+KEYFRAME = 33
+
+# once this much is queued for a viewer, it's dropped to the next keyframe
+MAX_BACKLOG = 256 * 1024
+
+
+class Broadcaster(threading.Thread):
+    def __init__(self, address, grid, tick=0.5):
+        self.address = address
+        self.tick = tick
+        self.timer = None
+        self.puzzle = grid.puzfile.tobytes()
+
+        # The hub's own copy of the latest record for every cell, kept up
+        # to date from the published records, is all a keyframe needs.
+        self.cells = {}
+        for index, pos in enumerate(grid.cells):
+            cell = grid.cells[pos]
+            if cell.is_letter:
+                self.cells[index] = journal.pack_cells([(index, cell)],
+                                                       journal.ENTRY)
+        self.cursor = b''
+        self.clock = b''
+        self.keyframe = None
+
+        self.viewers = {}
+        self.sent_cursor = None
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.error = None
+
+        super().__init__(daemon=True)
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_until_complete(self.serve())
+
+    async def serve(self):
+        try:
+            server = await coop.start_server(self.handle, self.address)
+        except OSError as err:
+            self.error = err
+            self.ready.set()
+            return
+        self.ready.set()
+
+        clock = asyncio.ensure_future(self.publish_time())
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            clock.cancel()
+
+    def listen(self):
+        """Start the hub, raising OSError if it can't listen on address."""
+        self.start()
+        self.ready.wait()
+        if self.error:
+            raise self.error
+
+    def close(self):
+        coop.remove_socket(self.address)
+
+    # Called from the input loop.
+
+    def publish(self, data):
+        self.loop.call_soon_threadsafe(self.fan_out, data)
+
+    def publish_cursor(self, cursor):
+        x, y = cursor.position
+        state = (y * cursor.grid.column_count + x,
+                 int(cursor.direction == 'down'))
+        if state != self.sent_cursor:
+            self.sent_cursor = state
+            self.publish(coop.pack(coop.CURSOR, state[0], 0, state[1]))
+
+    # Everything below runs on the hub's event loop.
+
+    async def publish_time(self):
+        while True:
+            await asyncio.sleep(self.tick)
+            if self.timer:
+                clock = coop.pack(journal.TIMER, int(self.timer.time_passed),
+                                  0, int(self.timer.is_running))
+                if clock != self.clock:
+                    self.fan_out(clock)
+
+    def fan_out(self, data):
+        for offset in range(0, len(data), journal.RECORD_SIZE):
+            record = data[offset:offset + journal.RECORD_SIZE]
+            op, index = record[0], struct.unpack_from('<I', record, 1)[0]
+            if op in coop.CELL_OPS:
+                self.cells[index] = record
+            elif op == coop.CURSOR:
+                self.cursor = record
+            elif op == journal.TIMER:
+                self.clock = record
+        self.keyframe = None
+
+        for writer, live in list(self.viewers.items()):
+            if not live:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                self.viewers[writer] = False
+                asyncio.ensure_future(self.resync(writer))
+            else:
+                writer.write(data)
+
+    def current_keyframe(self):
+        # built at most once per change, however many viewers need it
+        if self.keyframe is None:
+            self.keyframe = b''.join(
+                [coop.pack(KEYFRAME)] + list(self.cells.values()) +
+                [self.cursor, self.clock])
+        return self.keyframe
+
+    async def resync(self, writer):
+        try:
+            await writer.drain()
+        except ConnectionError:
+            return
+        if writer in self.viewers:
+            writer.write(self.current_keyframe())
+            self.viewers[writer] = True
+
+    async def handle(self, reader, writer):
+        coop.set_nodelay(writer)
+        writer.write(coop.pack(PUZZLE, len(self.puzzle)) + self.puzzle +
+                     self.current_keyframe())
+        self.viewers[writer] = True
+        try:
+            # viewers don't send anything; this just waits for them to go
+            while await reader.read(4096):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self.viewers.pop(writer, None)
+            writer.close()
+
+
+class Viewer:
+    def __init__(self, term, sock):
+        self.term = term
+        self.sock = sock
+        self.buffered = b''
+        self.grid = None
+        self.cursor = None
+        self.word = []
+        self.clue_y = 0
+        self.complete = False
+
+    def watch(self):
+        with self.term.fullscreen(), self.term.raw(), \
+                self.term.hidden_cursor():
+            cursewords.echo(self.term.clear())
+            while True:
+                readable, _, _ = select.select([self.sock], [], [], 0.05)
+                if readable:
+                    data = self.sock.recv(65536)
+                    if not data:
+                        break
+                    self.feed(data)
+                if self.term.inkey(timeout=0) in ('q', chr(17)):
+                    break
+
+    def feed(self, data):
+        data = self.buffered + data
+        records, offset, keyframe = [], 0, False
+        while len(data) - offset >= journal.RECORD_SIZE:
+            record = struct.unpack_from(journal.RECORD_FORMAT, data, offset)
+            if record[0] == PUZZLE:
+                end = offset + journal.RECORD_SIZE + record[1]
+                if len(data) < end:
+                    break
+                self.load(data[offset + journal.RECORD_SIZE:end])
+                offset = end
+                continue
+            if record[0] == KEYFRAME:
+                keyframe = True
+            else:
+                records.append(record)
+            offset += journal.RECORD_SIZE
+        self.buffered = data[offset:]
+
+        if self.grid:
+            self.apply(records, keyframe)
+
+    def load(self, data):
+        term = self.term
+        grid = cursewords.Grid(2, 4, term)
+        grid.load(puz.load(data))
+        grid.view_columns = min(grid.column_count, (term.width - 4) // 4)
+        grid.view_rows = min(grid.row_count, (term.height - 13) // 2)
+        self.grid = grid
+        self.cursor = cursewords.Cursor(grid.words['across'][0][0], 'across',
+                                        grid)
+        self.clue_y = grid.grid_y + 2 * grid.view_rows + 2
+
+        headline = ' {} - {} (watching) '.format(grid.title, grid.author)
+        cursewords.echo(term.move(0, 0) + term.dim +
+                        term.reverse(headline[:term.width].ljust(term.width)) +
+                        term.normal)
+
+    def apply(self, records, keyframe):
+        grid, cursor = self.grid, self.cursor
+        changed = set()
+        edited = collections.defaultdict(list)
+        for op, index, entry, markup in records:
+            pos = (index % grid.column_count, index // grid.column_count)
+            if op in coop.CELL_OPS:
+                cell = grid.cells.get(pos)
+                if cell is not None and cell.is_letter:
+                    cell.entry = chr(entry)
+                    cell.apply_markup(markup)
+                    changed.add(pos)
+                    edited[op].append(pos)
+            elif op == coop.CURSOR and pos in grid.cells:
+                changed.add(cursor.position)
+                cursor.position = pos
+                cursor.direction = 'down' if markup else 'across'
+            elif op == journal.TIMER:
+                self.show_time(index)
+
+        # so that the completion check keeps up
+        for op, positions in edited.items():
+            grid.cells_changed(positions, op, remote=True)
+
+        if grid.scroll_to(cursor.position) or keyframe:
+            grid.unfinished_cells = None
+            grid.draw()
+            self.word = []
+
+        word = cursor.current_word()
+        if word is not self.word:
+            changed.update(self.word)
+            changed.update(word)
+            self.word = word
+            self.show_clue()
+
+        for pos in changed:
+            if pos == cursor.position:
+                grid.draw_cursor_cell(pos)
+            elif pos in word:
+                grid.draw_highlighted_cell(pos)
+            else:
+                grid.draw_cell(pos)
+
+        if grid.is_complete and not self.complete:
+            self.complete = True
+            cursewords.echo(self.term.move(2, grid.grid_x) +
+                            self.term.reverse(
+                                "The puzzle has been completed! 🎉"))
+
+    def show_clue(self):
+        grid, cursor = self.grid, self.cursor
+        lines = []
+        index = grid.word_at[cursor.direction].get(cursor.position)
+        if index is not None:
+            entry = grid.clues[cursor.direction][index]
+            lines = textwrap.wrap(
+                '{} {}: {}'.format(entry['num'], cursor.direction.upper(),
+                                   entry['clue']),
+                width=self.term.width - 2 - grid.grid_x, max_lines=3,
+                subsequent_indent=grid.grid_x * ' ')
+        lines += [''] * (3 - len(lines))
+        cursewords.echo(self.term.move(self.clue_y, grid.grid_x) +
+                        '\r\n'.join(line + self.term.clear_eol
+                                    for line in lines))
+
+    def show_time(self, seconds):
+        m, s = divmod(seconds, 60)
+        h, m = divmod(m, 60)
+        time_string = '{}{:02d}:{:02d}'.format(
+            '{:02d}:'.format(h) if h else '   ', m, s)
+        cursewords.echo(self.term.move(2, self.grid.grid_x +
+                                       self.grid.view_columns * 4 - 7) +
+                        time_string)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords watch',
+        description="""Watch a session started with cursewords --broadcast
+        ADDRESS. Press q to stop watching.""")
+    parser.add_argument('address', metavar='ADDRESS',
+                        help="""path of the session's Unix socket, or
+                        HOST:PORT for TCP""")
+
+    args = parser.parse_args(argv)
+
+    try:
+        sock = coop.connect(args.address)
+    except OSError as err:
+        sys.exit("Unable to connect to {}: {}".format(args.address, err))
+
+    Viewer(Terminal(), sock).watch()
+    return 0
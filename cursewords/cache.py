@@ -0,0 +1,473 @@
+"""Puzzle cache: parse each puzzle once for every session on a host.
+
+`cursewords cache ADDRESS` runs a daemon that sessions started with --cache
+ADDRESS ask for their puzzle. A session sends a digest of the parts of its
+file that every copy of the puzzle shares: the header, solution and
+strings, but not the fill or the extensions, which hold its own progress,
+markup and timer. The first time the daemon sees a digest it's sent the
+file itself, which it parses, validates and numbers once, writing the
+result to a read-only segment in shared memory (/dev/shm where there is
+one). Every session solving the same puzzle then maps that segment instead
+of parsing the puzzle itself, however far along it is.
+
+A segment holds the original file bytes followed by indexes into them: the
+span of every string, the clue numbering, and the offset of every
+extension. A session decodes the solution from it and reads clue text
+straight from the mapped pages when it's shown, so the text of a puzzle is
+held once per host rather than once per session. The fill and extensions
+it takes from its own file.
+"""
+
+import argparse
+import asyncio
+import collections
+import collections.abc
+import hashlib
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+
+from . import coop
+from . import journal
+from . import puz
+
+MAGIC = b'CWC1'
+DIGEST_SIZE = 16
+
+# magic, digest, file offset, file size, preamble size, postscript offset,
+# string count, string index offset, across count, down count, numbering
+# offset, extension count, extension index offset
+HEADER_FORMAT = '<4s 16s I I I I I I I I I I I'
+SPAN_FORMAT = '<I I'
+ENTRY_FORMAT = '<H H I H'
+EXTENSION_FORMAT = '<4s I I'
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+SPAN_SIZE = struct.calcsize(SPAN_FORMAT)
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+EXTENSION_SIZE = struct.calcsize(EXTENSION_FORMAT)
+
+LOOKUP = 64
+FOUND = 65
+MISSING = 66
+PUBLISH = 67
+FAILED = 68
+
+# no real puzzle file comes anywhere near this
+MAX_PUZZLE = 1 << 20
+
+# the header fields before this offset are the checksums, which cover the
+# fill and so differ from one copy of a puzzle to the next
+SHARED_HEADER_OFFSET = struct.calcsize('<H 11s xH Q')
+
+
+class CacheError(coop.CoopError):
+    pass
+
+
+def split(data):
+    """
+    (header offset, cell count, end of the strings) in .puz file data.
+    throws PuzzleFormatError if the data isn't laid out like a puzzle.
+    """
+    header_offset = data.find(puz.ACROSSDOWN) - 2
+    if (header_offset < 0 or
+            len(data) < header_offset + struct.calcsize(puz.HEADER_FORMAT)):
+        raise puz.PuzzleFormatError('not a puzzle')
+    fields = struct.unpack_from(puz.HEADER_FORMAT, data, header_offset)
+    cells, numclues = fields[8] * fields[9], fields[10]
+    end = header_offset + struct.calcsize(puz.HEADER_FORMAT) + 2 * cells
+    try:
+        for _ in range(numclues + 4):
+            end = data.index(b'\0', end) + 1
+    except ValueError:
+        raise puz.PuzzleFormatError('strings are truncated')
+    return header_offset, cells, end
+
+
+def digest(data):
+    """A digest of what every copy of the puzzle in .puz file data shares."""
+    header_offset, cells, end = split(data)
+    fill_offset = header_offset + struct.calcsize(puz.HEADER_FORMAT) + cells
+    shared = hashlib.blake2b(digest_size=DIGEST_SIZE)
+    shared.update(data[header_offset + SHARED_HEADER_OFFSET:fill_offset])
+    shared.update(data[fill_offset + cells:end])
+    return shared.digest()
+
+
+def build(data):
+    """
+    The segment for .puz file data, as bytes. throws PuzzleFormatError if
+    the data isn't a valid puzzle.
+    """
+    puzzle = puz.load(data)
+    preamble = len(puzzle.preamble)
+
+    # the same walk over the strings that Puzzle.load makes
+    s = puz.PuzzleBuffer(data)
+    s.pos = (preamble + struct.calcsize(puz.HEADER_FORMAT) +
+             2 * puzzle.width * puzzle.height)
+    spans = []
+    for _ in range(len(puzzle.strings())):
+        start = s.pos
+        s.read_string()
+        spans.append((start, s.pos - 1))
+
+    numbering = puzzle.clue_numbering()
+    extensions = puzzle._layout['extensions']
+
+    spans_offset = HEADER_SIZE + len(data)
+    entries_offset = spans_offset + SPAN_SIZE * len(spans)
+    extensions_offset = entries_offset + ENTRY_SIZE * (
+        len(numbering.across) + len(numbering.down))
+    header = struct.pack(
+        HEADER_FORMAT, MAGIC, digest(data), HEADER_SIZE, len(data), preamble,
+        len(data) - len(puzzle.postscript), len(spans), spans_offset,
+        len(numbering.across), len(numbering.down), entries_offset,
+        len(extensions), extensions_offset)
+
+    return b''.join(
+        [header, data] +
+        [struct.pack(SPAN_FORMAT, HEADER_SIZE + start, HEADER_SIZE + end)
+         for start, end in spans] +
+        [struct.pack(ENTRY_FORMAT, entry['num'], entry['clue_index'],
+                     entry['cell'], entry['len'])
+         for entry in numbering.across + numbering.down] +
+        [struct.pack(EXTENSION_FORMAT, code, offset, len(ext))
+         for code, offset, ext in extensions])
+
+
+class Strings(collections.abc.Sequence):
+    """Strings read from a segment as they're asked for."""
+    def __init__(self, segment, encoding, start, count):
+        self.segment = segment
+        self.encoding = encoding
+        self.start = start
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[n] for n in range(*i.indices(self.count))]
+        if i < 0:
+            i += self.count
+        if not 0 <= i < self.count:
+            raise IndexError(i)
+        start, end = struct.unpack_from(SPAN_FORMAT, self.segment,
+                                        self.start + i * SPAN_SIZE)
+        return str(self.segment[start:end], self.encoding)
+
+
+class Entry(collections.abc.Mapping):
+    """A clue numbering entry, whose clue text stays in the segment."""
+    __slots__ = ('clues', 'num', 'clue_index', 'cell', 'len')
+    KEYS = ('num', 'clue', 'clue_index', 'cell', 'len')
+
+    def __init__(self, clues, num, clue_index, cell, length):
+        self.clues = clues
+        self.num = num
+        self.clue_index = clue_index
+        self.cell = cell
+        self.len = length
+
+    def __getitem__(self, key):
+        if key == 'clue':
+            return self.clues[self.clue_index]
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+
+class SharedNumbering(puz.DefaultClueNumbering):
+    # The numbering was worked out by the daemon; this only reads it back.
+    def __init__(self, grid, clues, width, height, across, down):
+        self.grid = grid
+        self.clues = clues
+        self.width = width
+        self.height = height
+        self.across = across
+        self.down = down
+
+
+class SharedPuzzle(puz.Puzzle):
+    """A puz.Puzzle backed by a mapped segment. Saving works as usual; the
+    strings are only compared with the segment's, never copied out of it,
+    unless something changes them."""
+    def __init__(self, segment):
+        super().__init__()
+        (magic, self.digest, offset, size, preamble, postscript,
+         string_count, spans_offset, across_count, down_count,
+         entries_offset, extension_count,
+         extensions_offset) = struct.unpack_from(HEADER_FORMAT, segment)
+        if magic != MAGIC:
+            raise CacheError('not a cursewords cache segment')
+        self.segment = segment
+
+        header_offset = offset + preamble
+        self.preamble = bytes(segment[offset:header_offset])
+        self.postscript = bytes(segment[offset + postscript:offset + size])
+        (_, _, _, _, self.fileversion, self.unk1, self.scrambled_cksum,
+         self.unk2, self.width, self.height, _, self.puzzletype,
+         self.solution_state) = struct.unpack_from(puz.HEADER_FORMAT, segment,
+                                                   header_offset)
+        self.version = self.fileversion[:3]
+        self.encoding = (puz.ENCODING if self.version_tuple()[0] < 2
+                         else puz.ENCODING_UTF8)
+
+        cells = self.width * self.height
+        solution_offset = header_offset + struct.calcsize(puz.HEADER_FORMAT)
+        self.solution = str(segment[solution_offset:solution_offset + cells],
+                            self.encoding)
+        self.fill = str(segment[solution_offset + cells:
+                                solution_offset + 2 * cells], self.encoding)
+
+        self.shared_strings = Strings(segment, self.encoding, spans_offset,
+                                      string_count)
+        self.title = self.shared_strings[0]
+        self.author = self.shared_strings[1]
+        self.copyright = self.shared_strings[2]
+        self.notes = self.shared_strings[string_count - 1]
+        self.clues = self.shared_clues = Strings(
+            segment, self.encoding, spans_offset + 3 * SPAN_SIZE,
+            string_count - 4)
+        self.shared_text = (self.title, self.author, self.copyright,
+                            self.notes)
+
+        layout_extensions = []
+        for n in range(extension_count):
+            code, ext_offset, length = struct.unpack_from(
+                EXTENSION_FORMAT, segment,
+                extensions_offset + n * EXTENSION_SIZE)
+            start = (offset + ext_offset +
+                     struct.calcsize(puz.EXTENSION_HEADER_FORMAT))
+            self.extensions[code] = bytes(segment[start:start + length])
+            self._extensions_order.append(code)
+            layout_extensions.append((code, ext_offset, self.extensions[code]))
+        self._layout = self.layout(layout_extensions)
+
+        entries = [Entry(self.clues, *struct.unpack_from(
+                       ENTRY_FORMAT, segment, entries_offset + n * ENTRY_SIZE))
+                   for n in range(across_count + down_count)]
+        self.helpers['clues'] = SharedNumbering(
+            self.fill, self.clues, self.width, self.height,
+            entries[:across_count], entries[across_count:])
+
+    def take_state(self, data):
+        """
+        Take the fill and extensions, and whatever surrounds the puzzle,
+        from this session's own .puz file data rather than from the copy
+        that was cached.
+        """
+        header_offset, cells, end = split(data)
+        fill_offset = (header_offset + struct.calcsize(puz.HEADER_FORMAT) +
+                       cells)
+        self.preamble = data[:header_offset]
+        self.fill = str(data[fill_offset:fill_offset + cells], self.encoding)
+
+        s = puz.PuzzleBuffer(data)
+        s.pos = end
+        self.extensions, self._extensions_order = {}, []
+        layout_extensions = []
+        while s.can_unpack(puz.EXTENSION_HEADER_FORMAT):
+            offset = s.pos
+            code, length, cksum = s.unpack(puz.EXTENSION_HEADER_FORMAT)
+            ext = s.read(length)
+            s.read(1)
+            if cksum != puz.data_cksum(ext):
+                raise CacheError('extension checksum does not match')
+            self.extensions[code] = ext
+            self._extensions_order.append(code)
+            layout_extensions.append((code, offset, ext))
+        self.postscript = s.read_to_end()
+        self._layout = self.layout(layout_extensions)
+        self.helpers['clues'].grid = self.fill
+
+    def strings(self):
+        if (self.clues is self.shared_clues and
+                (self.title, self.author, self.copyright,
+                 self.notes) == self.shared_text):
+            return self.shared_strings
+        return super().strings()
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise CacheError('connection closed by the cache daemon')
+        data += chunk
+    return data
+
+
+def recv_record(sock):
+    return struct.unpack(journal.RECORD_FORMAT,
+                         recv_exactly(sock, journal.RECORD_SIZE))
+
+
+def read(address, filename):
+    """
+    Read a .puz file through the cache daemon at address, returning a
+    SharedPuzzle. throws OSError or CacheError if the daemon can't be
+    reached or can't parse the file.
+    """
+    puz.recover(filename)
+    with open(filename, 'rb') as f:
+        data = f.read()
+        stat = os.fstat(f.fileno())
+    try:
+        key = digest(data)
+    except puz.PuzzleFormatError as err:
+        raise CacheError(str(err))
+
+    with coop.connect(address) as sock:
+        sock.settimeout(10)
+        sock.sendall(coop.pack(LOOKUP, 0, len(key)) + key)
+        op, size, _, _ = recv_record(sock)
+        if op == MISSING:
+            if len(data) > MAX_PUZZLE:
+                raise CacheError('puzzle file too large to cache')
+            sock.sendall(coop.pack(PUBLISH, len(data)) + data)
+            op, size, _, _ = recv_record(sock)
+        if op != FOUND:
+            raise CacheError('the cache daemon could not parse the puzzle')
+        path = recv_exactly(sock, size)
+
+    # A damaged reply or segment is the daemon's problem; the session
+    # falls back on reading the file itself.
+    try:
+        with open(path.decode('utf-8'), 'rb') as f:
+            segment = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        puzzle = SharedPuzzle(segment)
+        if puzzle.digest != key:
+            raise CacheError('the cache daemon sent the wrong puzzle')
+        puzzle.take_state(data)
+    except (struct.error, ValueError, IndexError,
+            puz.PuzzleFormatError) as err:
+        raise CacheError('unusable cache segment: {}'.format(err))
+    puzzle.remember_file(filename, stat)
+    return puzzle
+
+
+def default_directory():
+    return '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+
+
+class CacheServer:
+    def __init__(self, directory=None, max_puzzles=100):
+        # world-readable, since sessions run as whoever is solving
+        self.directory = tempfile.mkdtemp(prefix='cursewords-cache-',
+                                          dir=directory or default_directory())
+        os.chmod(self.directory, 0o755)
+        self.max_puzzles = max_puzzles
+        self.segments = collections.OrderedDict()
+
+    async def handle(self, reader, writer):
+        coop.set_nodelay(writer)
+        try:
+            op, _, size, _ = await self.read_record(reader)
+            if op != LOOKUP or size != DIGEST_SIZE:
+                return
+            key = await reader.readexactly(size)
+
+            if key not in self.segments:
+                writer.write(coop.pack(MISSING))
+                await writer.drain()
+                op, size, _, _ = await self.read_record(reader)
+                if op != PUBLISH or size > MAX_PUZZLE:
+                    return
+                data = await reader.readexactly(size)
+                if key not in self.segments:
+                    if not self.publish(key, data):
+                        writer.write(coop.pack(FAILED))
+                        return
+
+            self.segments.move_to_end(key)
+            path = self.segments[key].encode('utf-8')
+            writer.write(coop.pack(FOUND, len(path)) + path)
+            await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError,
+                ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+    async def read_record(self, reader):
+        return struct.unpack(journal.RECORD_FORMAT,
+                             await reader.readexactly(journal.RECORD_SIZE))
+
+    def publish(self, key, data):
+        try:
+            if digest(data) != key:
+                return False
+            segment = build(data)
+        except Exception:
+            # anything a session sends that can't be parsed, it reads itself
+            return False
+
+        path = os.path.join(self.directory, key.hex())
+        puz.atomic_write(path, segment)
+        os.chmod(path, 0o644)
+        self.segments[key] = path
+
+        # Sessions that still have an evicted segment mapped keep reading
+        # it; the pages go once the last of them exits.
+        while len(self.segments) > self.max_puzzles:
+            _, old = self.segments.popitem(last=False)
+            try:
+                os.unlink(old)
+            except OSError:
+                pass
+        return True
+
+    async def serve_forever(self, address):
+        server = await coop.start_server(self.handle, address)
+        if not isinstance(coop.parse_address(address), tuple):
+            os.chmod(address, 0o666)
+        print('Caching puzzles for {} in {}'.format(address, self.directory),
+              flush=True)
+        await coop.serve_until_stopped(server)
+
+    def serve(self, address):
+        try:
+            asyncio.run(self.serve_forever(address))
+        finally:
+            coop.remove_socket(address)
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords cache',
+        description="""Run a puzzle cache for the sessions on this host.
+        Sessions started with cursewords --cache ADDRESS (or with
+        CURSEWORDS_CACHE=ADDRESS in the environment) share one parsed copy
+        of each .puz file.""")
+    parser.add_argument('address', metavar='ADDRESS',
+                        help="""path of the Unix socket to listen on""")
+    parser.add_argument('--dir', metavar='DIR',
+                        help="""directory to keep parsed puzzles in
+                        (default: {})""".format(default_directory()))
+    parser.add_argument('--max-puzzles', type=int, default=100, metavar='N',
+                        help="""number of puzzles to keep (default: 100)""")
+
+    args = parser.parse_args(argv)
+
+    try:
+        server = CacheServer(args.dir, args.max_puzzles)
+    except OSError as err:
+        sys.exit("Unable to create the cache directory: {}".format(err))
+
+    server.serve(args.address)
+    return 0
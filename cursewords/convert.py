@@ -0,0 +1,232 @@
+"""cursewords convert: bulk export of .puz files to ipuz, JSON or text.
+
+Inputs can be .puz files, directories (searched recursively) or .zip and
+.tar archives of .puz files. Each puzzle is converted in a worker process
+that reads its own input and streams its own output, so the parent never
+holds more than a list of names. A manifest in the output directory
+records a hash of every input, and puzzles that haven't changed since the
+last run are skipped.
+"""
+
+import argparse
+import concurrent.futures
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import tarfile
+import zipfile
+
+from blessed import Terminal
+
+from . import formats
+from . import puz
+from .printer import printer_output
+
+MANIFEST = '.cursewords-convert.json'
+
+EXTENSIONS = {'ipuz': '.ipuz', 'json': '.json', 'text': '.txt'}
+
+
+def find_jobs(paths):
+    """Yield (source, member, output) for every .puz file under paths.
+    member is the name inside an archive, or None for plain files."""
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if name.lower().endswith('.puz'):
+                        source = os.path.join(root, name)
+                        yield (source, None,
+                               os.path.relpath(source, path))
+        elif zipfile.is_zipfile(path):
+            with zipfile.ZipFile(path) as archive:
+                for name in archive.namelist():
+                    if name.lower().endswith('.puz'):
+                        yield (path, name, archive_output(path, name))
+        elif tarfile.is_tarfile(path):
+            with tarfile.open(path) as archive:
+                for member in archive:
+                    if member.isfile() and member.name.lower().endswith('.puz'):
+                        yield (path, member.name,
+                               archive_output(path, member.name))
+        else:
+            yield (path, None, os.path.basename(path))
+
+
+def archive_output(archive, name):
+    """Where a member of an archive is converted to, relative to the output
+    directory, or None if its name would lead out of it."""
+    name = os.path.normpath(name.replace('\\', '/'))
+    if (os.path.isabs(name) or os.path.splitdrive(name)[0] or
+            os.pardir in name.split(os.sep)):
+        return None
+    stem = os.path.basename(archive).split('.')[0]
+    return os.path.join(stem, name)
+
+
+def is_inside(path, directory):
+    directory = os.path.realpath(directory)
+    return os.path.commonpath(
+        [directory, os.path.realpath(path)]) == directory
+
+
+def read_source(source, member):
+    if member is None:
+        with open(source, 'rb') as f:
+            return f.read()
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            return archive.read(member)
+    with tarfile.open(source) as archive:
+        return archive.extractfile(member).read()
+
+
+def convert_one(source, member, output, output_format, known_hash):
+    """Worker: convert a single puzzle. Returns (output, hash, status)."""
+    data = read_source(source, member)
+    digest = hashlib.sha256(data).hexdigest()
+    if digest == known_hash and os.path.exists(output):
+        return output, digest, 'skipped'
+
+    puzzle = puz.load(data)
+
+    def write(binary):
+        f = io.TextIOWrapper(binary, encoding='utf-8')
+        if output_format == 'ipuz':
+            json.dump(formats.ipuz_data(puzzle), f)
+        elif output_format == 'json':
+            json.dump(json_data(puzzle), f)
+        else:
+            write_text(puzzle, f)
+        f.flush()
+        f.detach()
+
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    puz.atomic_write(output, write)
+
+    return output, digest, 'converted'
+
+
+def json_data(puzzle):
+    numbering = puzzle.clue_numbering()
+    rebus = puzzle.rebus()
+    width = puzzle.width
+
+    def answer(entry, step):
+        cells = range(entry['cell'], entry['cell'] + entry['len'] * step, step)
+        return ''.join(rebus.get_rebus_solution(i)
+                       if rebus.has_rebus() and rebus.is_rebus_square(i)
+                       else puzzle.solution[i] for i in cells)
+
+    return {
+        'title': puzzle.title,
+        'author': puzzle.author,
+        'copyright': puzzle.copyright,
+        'notes': puzzle.notes,
+        'width': puzzle.width,
+        'height': puzzle.height,
+        'solution': puzzle.solution,
+        'fill': puzzle.fill,
+        'locked': puzzle.is_solution_locked(),
+        'markup': list(puzzle.markup().markup) if puzzle.has_markup() else None,
+        'rebus': (dict((i, rebus.get_rebus_solution(i))
+                       for i in rebus.get_rebus_squares())
+                  if rebus.has_rebus() else None),
+        'across': [dict(entry, answer=answer(entry, 1))
+                   for entry in numbering.across],
+        'down': [dict(entry, answer=answer(entry, width))
+                 for entry in numbering.down],
+    }
+
+
+def write_text(puzzle, f):
+    # Print mode already knows how to lay out a puzzle as plain text. The
+    # import is deferred because cursewords itself imports this module.
+    from .cursewords import Grid
+
+    grid = Grid(0, 0, Terminal(force_styling=None))
+    grid.load(puzzle)
+    with contextlib.redirect_stdout(f):
+        printer_output(grid, style='blank',
+                       width=max(92, 4 * puzzle.width + 1))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords convert',
+        description="""Convert .puz files, directories of them, or .zip
+        and .tar archives of them to ipuz, JSON or plain text.""")
+    parser.add_argument('paths', metavar='PATH', nargs='+',
+                        help="""a .puz file, directory or archive""")
+    parser.add_argument('-o', '--output', metavar='DIR', default='.',
+                        help="""directory to write converted files to
+                        (default: the current directory)""")
+    parser.add_argument('-t', '--to', dest='output_format',
+                        choices=sorted(EXTENSIONS), default='ipuz',
+                        help="""output format (default: ipuz)""")
+    parser.add_argument('-j', '--jobs', type=int, default=None,
+                        help="""number of worker processes
+                        (default: one per CPU)""")
+    parser.add_argument('--force', action='store_true',
+                        help="""convert every puzzle, even unchanged ones""")
+
+    args = parser.parse_args(argv)
+
+    manifest_path = os.path.join(args.output, MANIFEST)
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {}
+    if args.force:
+        manifest = {}
+
+    extension = EXTENSIONS[args.output_format]
+    counts = {'converted': 0, 'skipped': 0, 'failed': 0}
+
+    with concurrent.futures.ProcessPoolExecutor(args.jobs) as pool:
+        futures = {}
+        outputs = {}
+        for source, member, output in find_jobs(args.paths):
+            name = member or source
+            if output is not None:
+                output = os.path.join(args.output,
+                                      os.path.splitext(output)[0] + extension)
+            if output is None or not is_inside(output, args.output):
+                counts['failed'] += 1
+                print("Unable to convert {}: its name leads out of {}".format(
+                    name, args.output), file=sys.stderr)
+                continue
+            key = os.path.relpath(output, args.output)
+            if key in outputs:
+                counts['failed'] += 1
+                print("Unable to convert {}: {} was converted to {} "
+                      "already".format(name, outputs[key], key),
+                      file=sys.stderr)
+                continue
+            outputs[key] = name
+            future = pool.submit(convert_one, source, member, output,
+                                 args.output_format, manifest.get(key))
+            futures[future] = (key, name)
+
+        for future in concurrent.futures.as_completed(futures):
+            key, name = futures.pop(future)
+            try:
+                _, digest, status = future.result()
+            except Exception as err:
+                counts['failed'] += 1
+                print("Unable to convert {}: {}".format(name, err),
+                      file=sys.stderr)
+                continue
+            manifest[key] = digest
+            counts[status] += 1
+
+    os.makedirs(args.output, exist_ok=True)
+    puz.atomic_write(manifest_path, json.dumps(manifest).encode('utf-8'))
+
+    print("{converted} converted, {skipped} unchanged, {failed} failed.".format(
+        **counts))
+    return 1 if counts['failed'] else 0
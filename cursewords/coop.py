@@ -0,0 +1,432 @@
+"""Co-op solving: several cursewords sessions sharing one puzzle.
+
+A server started with `cursewords serve` owns the authoritative copy of the
+puzzle. Clients started with --coop send it the new state of every cell
+they change, and of their cursor, as 8-byte journal records. The server
+applies cell records in the order they arrive and passes each batch on to
+every client, the sender included, so that everyone converges on the same
+grid even when two people type into the same square at once.
+"""
+
+import argparse
+import asyncio
+import collections
+import heapq
+import os
+import signal
+import socket
+import struct
+import sys
+
+from blessed import Terminal
+
+from . import formats
+from . import journal
+
+HELLO = 16
+SYNCED = 17
+CURSOR = 18
+
+CELL_OPS = (journal.ENTRY, journal.CLEAR, journal.CHECK,
+            journal.REVEAL, journal.RESET)
+
+# a cursor record at this index means the partner has left
+NOWHERE = 0xFFFFFFFF
+
+# clients that fall this far behind are disconnected rather than buffered
+MAX_BACKLOG = 1 << 20
+
+# client ids go out in the 16-bit entry field of cursor records
+MAX_CLIENT_ID = 0xFFFF
+
+
+class CoopError(Exception):
+    pass
+
+
+def pack(op, index=0, entry=0, markup=0):
+    return struct.pack(journal.RECORD_FORMAT, op, index, entry, markup)
+
+
+def parse_address(address):
+    """A host:port pair for localhost TCP, or else a Unix socket path."""
+    host, _, port = address.rpartition(':')
+    if host and port.isdigit():
+        return host, int(port)
+    return address
+
+
+def connect(address):
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        sock = socket.create_connection(address)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    else:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    return sock
+
+
+async def start_server(handler, address):
+    address = parse_address(address)
+    if isinstance(address, tuple):
+        return await asyncio.start_server(handler, *address)
+    return await asyncio.start_unix_server(handler, address)
+
+
+async def serve_until_stopped(server):
+    """Serve until SIGINT or SIGTERM, then close the server cleanly."""
+    loop = asyncio.get_running_loop()
+    stopped = loop.create_future()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(
+            signum, lambda: stopped.done() or stopped.set_result(None))
+    async with server:
+        await stopped
+
+
+def set_nodelay(writer):
+    sock = writer.get_extra_info('socket')
+    if sock is not None and sock.family in (socket.AF_INET, socket.AF_INET6):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+
+def remove_socket(address):
+    if not isinstance(parse_address(address), tuple):
+        try:
+            os.unlink(address)
+        except OSError:
+            pass
+
+
+class CoopServer:
+    def __init__(self, filename, save_interval=5):
+        # deferred, since cursewords imports this module for --coop
+        from .cursewords import Grid
+
+        self.filename = filename
+        self.save_interval = save_interval
+
+        self.grid = Grid(0, 0, Terminal(force_styling=None))
+        self.grid.load(formats.read(filename))
+        self.positions = list(self.grid.cells)
+        self.header = journal.puzzle_header(self.grid)
+
+        self.clients = {}
+        self.cursors = {}
+        self.next_id = 1
+        self.free_ids = []
+        self.dirty = False
+
+    def snapshot(self, client_id):
+        letters = [(index, self.grid.cells[pos])
+                   for index, pos in enumerate(self.positions)
+                   if self.grid.cells[pos].is_letter]
+        return b''.join([self.header,
+                         pack(HELLO, client_id),
+                         journal.pack_cells(letters, journal.ENTRY)] +
+                        list(self.cursors.values()) +
+                        [pack(SYNCED)])
+
+    async def handle(self, reader, writer):
+        set_nodelay(writer)
+
+        client_id = self.allocate_id()
+        if client_id is None:
+            writer.close()
+            return
+        writer.write(self.snapshot(client_id))
+        self.clients[client_id] = writer
+
+        buffered = b''
+        try:
+            while True:
+                data = await reader.read(65536)
+                # once dropped, its id may already belong to someone else
+                if not data or self.clients.get(client_id) is not writer:
+                    break
+                data = buffered + data
+                end = len(data) - len(data) % journal.RECORD_SIZE
+                buffered = data[end:]
+                self.receive(client_id, data[:end])
+        except (asyncio.CancelledError, ConnectionError):
+            # cancelled when the server shuts down
+            pass
+        finally:
+            if self.clients.get(client_id) is writer:
+                self.drop(client_id)
+            writer.close()
+
+    def allocate_id(self):
+        """An id for a new client, reusing those of clients that have left,
+        or None if every id is taken."""
+        if self.free_ids:
+            return heapq.heappop(self.free_ids)
+        if self.next_id > MAX_CLIENT_ID:
+            return None
+        self.next_id += 1
+        return self.next_id - 1
+
+    def receive(self, client_id, data):
+        cells, cursor = [], None
+        for op, index, entry, markup in struct.iter_unpack(
+                journal.RECORD_FORMAT, data):
+            if op == CURSOR:
+                cursor = pack(CURSOR, index, client_id)
+            elif op in CELL_OPS and index < len(self.positions):
+                cell = self.grid.cells[self.positions[index]]
+                if not cell.is_letter or not self.is_entry(entry):
+                    continue
+                cell.entry = chr(entry)
+                cell.apply_markup(markup)
+                cells.append(pack(op, index, entry, markup))
+
+        # Everything that arrived in one read goes out as one write, and
+        # only the last cursor position in it matters.
+        if cells:
+            self.dirty = True
+            self.broadcast(b''.join(cells))
+        if cursor:
+            self.cursors[client_id] = cursor
+            self.broadcast(cursor, skip=client_id)
+
+    def is_entry(self, code):
+        """Whether code is something a square can hold: blank, or a capital
+        letter or digit that the puzzle file can store."""
+        entry = chr(code)
+        if entry == '-':
+            return True
+        if not entry.isalnum() or entry != entry.upper():
+            return False
+        try:
+            self.grid.puzfile.encode(entry)
+        except UnicodeEncodeError:
+            return False
+        return True
+
+    def broadcast(self, data, skip=None):
+        for client_id, writer in list(self.clients.items()):
+            if client_id == skip:
+                continue
+            if writer.transport.get_write_buffer_size() > MAX_BACKLOG:
+                self.drop(client_id)
+                writer.close()
+                continue
+            writer.write(data)
+
+    def drop(self, client_id):
+        if self.clients.pop(client_id, None) is None:
+            return
+        heapq.heappush(self.free_ids, client_id)
+        if self.cursors.pop(client_id, None):
+            self.broadcast(pack(CURSOR, NOWHERE, client_id))
+
+    def save(self):
+        self.dirty = False
+        self.grid.write_puzzle(self.filename)
+
+    async def autosave(self):
+        # The cells are read here, on the loop, where they're edited, and
+        # only the file is written on the executor.
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.save_interval)
+            if self.dirty:
+                self.dirty = False
+                state = self.grid.save_state()
+                await loop.run_in_executor(None, self.grid.write_state,
+                                           self.filename, state)
+
+    async def serve_forever(self, address):
+        server = await start_server(self.handle, address)
+        saver = asyncio.ensure_future(self.autosave())
+        try:
+            await serve_until_stopped(server)
+        finally:
+            saver.cancel()
+
+    def serve(self, address):
+        try:
+            asyncio.run(self.serve_forever(address))
+        finally:
+            if self.dirty:
+                self.save()
+            remove_socket(address)
+
+
+class CoopClient:
+    """Connection to a co-op server from an interactive session.
+
+    Everything happens on the input loop's thread: records are read off the
+    socket while waiting for a key, once it can be read from, and applied
+    to the grid between keystrokes, so drawing never races."""
+
+    def __init__(self, address):
+        self.sock = connect(address)
+        self.grid = None
+        self.client_id = None
+        self.partners = {}
+        self.sent_cursor = None
+        self.buffered = b''
+        self.edited = False
+        self.connected = True
+
+    def recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise CoopError('connection closed by the server')
+            data += chunk
+        return data
+
+    def join(self, grid):
+        """Take on the server's copy of the puzzle."""
+        self.grid = grid
+        if self.recv_exactly(journal.HEADER_SIZE) != journal.puzzle_header(grid):
+            raise CoopError('the server is solving a different puzzle')
+
+        records = []
+        while True:
+            record = struct.unpack(journal.RECORD_FORMAT,
+                                   self.recv_exactly(journal.RECORD_SIZE))
+            if record[0] == SYNCED:
+                break
+            records.append(record)
+
+        self.apply(records, draw=False)
+        grid.coop = self
+
+    def receive(self):
+        """Records that have arrived, once the socket can be read from."""
+        try:
+            data = self.sock.recv(65536)
+        except OSError:
+            data = b''
+        if not data:
+            self.connected = False
+            return []
+        data = self.buffered + data
+        end = len(data) - len(data) % journal.RECORD_SIZE
+        self.buffered = data[end:]
+        return list(struct.iter_unpack(journal.RECORD_FORMAT, data[:end]))
+
+    def send(self, data):
+        try:
+            self.sock.sendall(data)
+        except OSError:
+            self.connected = False
+
+    def send_cells(self, cells, op):
+        self.send(journal.pack_cells(cells, op))
+
+    def send_cursor(self, position):
+        if position != self.sent_cursor:
+            self.sent_cursor = position
+            x, y = position
+            self.send(pack(CURSOR, y * self.grid.column_count + x))
+
+    def position(self, index):
+        return index % self.grid.column_count, index // self.grid.column_count
+
+    def apply(self, records, cursor=None, draw=True):
+        grid = self.grid
+        changed = collections.defaultdict(list)
+        moved = set()
+        for op, index, entry, markup in records:
+            if op == HELLO:
+                self.client_id = index
+            elif op == CURSOR:
+                old = self.partners.pop(entry, None)
+                if old:
+                    moved.add(old)
+                if index != NOWHERE and entry != self.client_id:
+                    self.partners[entry] = self.position(index)
+                    moved.add(self.partners[entry])
+            elif op in CELL_OPS:
+                pos = self.position(index)
+                cell = grid.cells.get(pos)
+                if (cell is None or not cell.is_letter or
+                        (cell.entry, cell.markup) == (chr(entry), markup)):
+                    continue
+                cell.entry = chr(entry)
+                cell.apply_markup(markup)
+                changed[op].append(pos)
+
+        for op, positions in changed.items():
+            grid.cells_changed(positions, op, remote=True)
+        if changed:
+            self.edited = True
+
+        if draw:
+            dirty = moved.union(*changed.values())
+            partner_cells = set(self.partners.values())
+            word = cursor.current_word()
+            for pos in dirty:
+                if pos == cursor.position:
+                    grid.draw_cursor_cell(pos)
+                elif pos in partner_cells:
+                    grid.draw_partner_cursor_cell(pos)
+                elif pos in word:
+                    grid.draw_highlighted_cell(pos)
+                else:
+                    grid.draw_cell(pos)
+
+        return bool(changed or moved)
+
+    def take_edited(self):
+        """Whether partners have changed any cells since the last call."""
+        edited, self.edited = self.edited, False
+        return edited
+
+    def wait_for_key(self, term, cursor, inkey, paused=False):
+        """Wait for a key with inkey(timeout, wake), applying partners'
+        edits as they arrive. Returns an empty keystroke after applying
+        any, so that the input loop can redraw and check for completion,
+        and a named keystroke with no text (such as KEY_RESIZE) from inkey
+        ends the wait too."""
+        self.send_cursor(cursor.position)
+        if not paused:
+            for pos in self.partners.values():
+                if pos != cursor.position:
+                    self.grid.draw_partner_cursor_cell(pos)
+
+        while True:
+            keypress = inkey(wake=[self.sock])
+            if keypress or keypress.name:
+                return keypress
+
+            records = self.receive()
+            if records and self.apply(records, cursor, draw=not paused):
+                return keypress
+
+            if not self.connected:
+                self.grid.coop = None
+                self.grid.send_notification("Lost connection to co-op server.")
+                return keypress
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords serve',
+        description="""Host a puzzle for co-op solving. Players join with
+        cursewords --coop ADDRESS PUZfile, using their own copy of the same
+        puzzle. Progress is saved to PUZfile as it's made.""")
+    parser.add_argument('filename', metavar='PUZfile',
+                        help="""path of puzzle file in the \
+                        AcrossLite .puz, .ipuz or .jpz format""")
+    parser.add_argument('address', metavar='ADDRESS',
+                        help="""path of a Unix socket to listen on, or
+                        HOST:PORT for TCP""")
+
+    args = parser.parse_args(argv)
+
+    try:
+        server = CoopServer(args.filename)
+    except Exception:
+        sys.exit("Unable to parse {} as a puzzle file.".format(args.filename))
+
+    print("Serving {} on {}. Press Ctrl-C to stop.".format(
+        args.filename, args.address))
+    server.serve(args.address)
+    return 0
@@ -13,20 +13,37 @@
 #! /usr/bin/env python3
 
 import argparse
-import functools
+import contextlib
+import io
 import os
+import select
+import signal
+import sqlite3
 import sys
 import time
 import textwrap
 import threading
 
 from blessed import Terminal
+from blessed.keyboard import Keystroke
 
 from . import characters
+from . import formats
+from . import journal
 from . import puz
+from . import stats
+from . import undo
 from .printer import printer_output
 
-echo = functools.partial(print, end='', flush=True)
+# The other modes and options are imported when they're asked for, so that
+# starting a session doesn't pay for asyncio, multiprocessing and the rest.
+
+# where echo writes on each thread: stdout, unless it's in batched_output
+output = threading.local()
+
+
+def echo(*args):
+    print(*args, end='', flush=True, file=getattr(output, 'batch', None))
 
 class Cell:
     def __init__(self, solution, entry=None):
@@ -47,6 +64,25 @@ class Cell:
             self.marked_wrong = False
             self.corrected = True
 
+    @property
+    def markup(self):
+        md = 0
+        if self.corrected:
+            md += 16
+        if self.marked_wrong:
+            md += 32
+        if self.revealed:
+            md += 64
+        if self.circled:
+            md += 128
+        return md
+
+    def apply_markup(self, md):
+        self.circled = bool(md & 128)
+        self.revealed = bool(md & 64)
+        self.marked_wrong = bool(md & 32)
+        self.corrected = bool(md & 16)
+
     @property
     def is_block(self):
         return self.solution == "."
@@ -79,16 +115,36 @@ class Grid:
         self.row_count = 0
         self.column_count = 0
 
+        # The viewport is the window of cells actually drawn on screen. It
+        # covers the whole puzzle unless the terminal is too small for it.
+        self.view_x = 0
+        self.view_y = 0
+        self.view_columns = 0
+        self.view_rows = 0
+
         self.title = ''
         self.author = ''
 
         self.words = dict()
+        self.word_at = dict()
         self.clues = dict()
         self.spaces = dict()
 
         self.start_time = 0
         self.timer_active = False
         self.notification_timer = None
+        self.save_lock = threading.Lock()
+        self.edit_lock = threading.RLock()
+        self.journal = None
+        self.coop = None
+        self.broadcast = None
+        self.tournament = None
+        self.history = None
+        self.undo_log = None
+
+        self.locked = False
+        self.unfinished_cells = None
+        self.answer_cksum = None
 
         self.notification_area = (term.height-2, self.grid_x)
 
@@ -97,9 +153,15 @@ class Grid:
         self.cells = {}
         self.row_count = puzfile.height
         self.column_count = puzfile.width
+        self.view_x = self.view_y = 0
+        self.view_columns = self.column_count
+        self.view_rows = self.row_count
 
         self.title = puzfile.title
         self.author = puzfile.author.strip()
+        self.locked = puzfile.is_solution_locked()
+        self.unfinished_cells = None
+        self.answer_cksum = None
 
         for i in range(self.row_count):
             for j in range(self.column_count):
@@ -107,42 +169,25 @@ class Grid:
                 entry = self.puzfile.fill[idx]
                 self.cells[(j, i)] = Cell(self.puzfile.solution[idx], entry)
 
-        self.words['across'] = []
-        for i in range(self.row_count):
-            current_word = []
-            for j in range(self.column_count):
-                if self.cells[(j, i)].is_letter:
-                    current_word.append((j, i))
-                elif len(current_word) > 1:
-                    self.words['across'].append(current_word)
-                    current_word = []
-                elif current_word:
-                    current_word = []
-            if len(current_word) > 1:
-                self.words['across'].append(current_word)
-
-        self.words['down'] = []
-        for j in range(self.column_count):
-            current_word = []
-            for i in range(self.row_count):
-                if self.cells[(j, i)].is_letter:
-                    current_word.append((j, i))
-                elif len(current_word) > 1:
-                    self.words['down'].append(current_word)
-                    current_word = []
-                elif current_word:
-                    current_word = []
-            if len(current_word) > 1:
-                self.words['down'].append(current_word)
-
-        self.words['down'].sort(key=lambda word: (word[0][1], word[0][0]))
+        # Word spans, numbers and clues all come from the one pass over the
+        # grid that the clue numbering already makes.
+        num = self.puzfile.clue_numbering()
+        positions = list(self.cells)
+        self.words['across'] = [[positions[i] for i in num.across_cells(entry)]
+                                for entry in num.across]
+        self.words['down'] = [[positions[i] for i in num.down_cells(entry)]
+                              for entry in num.down]
 
-        self.number()
+        # the word each square is part of, in each direction
+        for direction, words in self.words.items():
+            self.word_at[direction] = dict(
+                (pos, i) for i, word in enumerate(words) for pos in word)
 
-        num = self.puzfile.clue_numbering()
         self.clues['across'] = num.across
         self.clues['down'] = num.down
 
+        self.number()
+
         self.spaces['across'] = [(j, i) for i in range(self.row_count)
                                  for j in range(self.column_count)
                                  if self.cells[(j, i)].is_letter]
@@ -155,18 +200,7 @@ class Grid:
             markup = self.puzfile.markup().markup
 
             for md, pos in zip(markup, self.cells):
-                cell = self.cells.get(pos)
-                if md >= 128:
-                    cell.circled = True
-                    md -= 128
-                if md >= 64:
-                    cell.revealed = True
-                    md -= 64
-                if md >= 32:
-                    cell.marked_wrong = True
-                    md -= 32
-                if md == 16:
-                    cell.corrected = True
+                self.cells.get(pos).apply_markup(md)
 
         timer_bytes = self.puzfile.extensions.get(puz.Extensions.Timer, None)
         if timer_bytes:
@@ -174,61 +208,19 @@ class Grid:
         else:
             self.start_time, self.timer_active = 0, 1
 
-    def render_grid(self, empty=False, blank=False, solution=False):
-        grid_rows = []
-        for i in range(self.row_count):
-            rows = [self.term.dim, self.term.dim]
-            for j in range(self.column_count):
-                pos = (j, i)
-                cell = self.cells.get(pos)
-                if i == 0 and j == 0:
-                    rows[0] += characters.ulcorner
-                elif j == 0:
-                    rows[0] += characters.ltee
-                elif i == 0:
-                    rows[0] += characters.ttee
-                else:
-                    rows[0] += characters.bigplus
-
-                rows[1] += characters.vline
+    def render_grid(self, empty=False, blank=False, solution=False,
+                    rows=None, columns=None):
+        rows = rows or range(self.row_count)
+        columns = columns or range(self.column_count)
 
-                if cell.number and not empty:
-                    small = str(cell.number).translate(characters.small_nums)
-                else:
-                    small = ''
-
-                # This is the right way to do it but as long as I'm doing
-                # the weird term.dim dance I have to write it a little uglier
-                # rows[0] += f'{small:{characters.hline}<3.3}'
-                rows[0] += (self.term.normal +
-                            small +
-                            self.term.dim +
-                            characters.hline * (3 - len(small)))
-
-                if empty:
-                    rows[1] += '   '
-                elif cell.is_block:
-                    rows[1] += characters.squareblock
-                elif blank or solution:
-                    value = ' ' if blank else cell.solution
-                    value = value.translate(characters.encircle) if cell.circled else value
-                    rows[1] += ' '.join([self.term.normal, value, self.term.dim])
-                else:
-                    value, markup = self.compile_cell(pos)
-                    value += markup
-                    rows[1] += self.term.normal + ' ' + value + self.term.dim
-
-                if j == self.column_count - 1:
-                    if i == 0:
-                        rows[0] += characters.urcorner
-                    else:
-                        rows[0] += characters.rtee
-                    rows[1] += characters.vline + self.term.normal
-                    rows[0] += self.term.normal
-            grid_rows.extend(rows)
+        grid_rows = []
+        for i in rows:
+            grid_rows.extend(self.render_row(i, columns, top=(i == rows[0]),
+                                             empty=empty, blank=blank,
+                                             solution=solution))
 
         bottom_row = self.term.dim + characters.llcorner
-        for col in range(1, self.column_count * 4):
+        for col in range(1, len(columns) * 4):
             bottom_row += characters.btee if col % 4 == 0 else characters.hline
         bottom_row += characters.lrcorner + self.term.normal
 
@@ -236,21 +228,137 @@ class Grid:
 
         return grid_rows
 
+    def render_row(self, i, columns, top=False,
+                   empty=False, blank=False, solution=False):
+        rows = [self.term.dim, self.term.dim]
+        for j in columns:
+            pos = (j, i)
+            cell = self.cells.get(pos)
+            if top and j == columns[0]:
+                rows[0] += characters.ulcorner
+            elif j == columns[0]:
+                rows[0] += characters.ltee
+            elif top:
+                rows[0] += characters.ttee
+            else:
+                rows[0] += characters.bigplus
+
+            rows[1] += characters.vline
+
+            if cell.number and not empty:
+                small = str(cell.number).translate(characters.small_nums)
+            else:
+                small = ''
+
+            # This is the right way to do it but as long as I'm doing
+            # the weird term.dim dance I have to write it a little uglier
+            # rows[0] += f'{small:{characters.hline}<3.3}'
+            rows[0] += (self.term.normal +
+                        small +
+                        self.term.dim +
+                        characters.hline * (3 - len(small)))
+
+            if empty:
+                rows[1] += '   '
+            elif cell.is_block:
+                rows[1] += characters.squareblock
+            elif blank or solution:
+                value = ' ' if blank else cell.solution
+                value = value.translate(characters.encircle) if cell.circled else value
+                rows[1] += ' '.join([self.term.normal, value, self.term.dim])
+            else:
+                value, markup = self.compile_cell(pos)
+                value += markup
+                rows[1] += self.term.normal + ' ' + value + self.term.dim
+
+            if j == columns[-1]:
+                if top:
+                    rows[0] += characters.urcorner
+                else:
+                    rows[0] += characters.rtee
+                rows[1] += characters.vline + self.term.normal
+                rows[0] += self.term.normal
+
+        return rows
+
+    @property
+    def visible_rows(self):
+        return range(self.view_y, self.view_y + self.view_rows)
+
+    @property
+    def visible_columns(self):
+        return range(self.view_x, self.view_x + self.view_columns)
+
+    def is_visible(self, position):
+        point_x, point_y = position
+        return (self.view_x <= point_x < self.view_x + self.view_columns and
+                self.view_y <= point_y < self.view_y + self.view_rows)
+
     def draw(self, empty=False):
-        grid_rows = self.render_grid(empty=empty)
+        grid_rows = self.render_grid(empty=empty, rows=self.visible_rows,
+                                     columns=self.visible_columns)
         for index, row in enumerate(grid_rows):
             echo(self.term.move(self.grid_y + index, self.grid_x) + row)
 
-    def number(self):
-        numbered_squares = []
-        for word in self.words['across'] + self.words['down']:
-            if word[0] not in numbered_squares:
-                numbered_squares.append(word[0])
+    def draw_rows(self, rows):
+        for i in rows:
+            lines = self.render_row(i, self.visible_columns,
+                                    top=(i == self.view_y))
+            index = 2 * (i - self.view_y)
+            echo(self.term.move(self.grid_y + index, self.grid_x) + lines[0] +
+                 self.term.move(self.grid_y + index + 1, self.grid_x) + lines[1])
+
+    def scroll_to(self, position):
+        """Move the viewport just far enough to show position. Returns True
+        if anything had to be redrawn."""
+        point_x, point_y = position
+        view_x = min(max(self.view_x, point_x - self.view_columns + 1), point_x)
+        view_y = min(max(self.view_y, point_y - self.view_rows + 1), point_y)
+        if (view_x, view_y) == (self.view_x, self.view_y):
+            return False
+
+        shift = view_y - self.view_y
+        horizontal = view_x != self.view_x
+        self.view_x, self.view_y = view_x, view_y
+
+        if (horizontal or abs(shift) >= self.view_rows or
+                not self.term.csr(0, 1)):
+            self.draw()
+            return True
+
+        # Vertical moves shift the rows already on screen with the
+        # terminal's scroll region, then fill in just the rows that
+        # scrolled into view and the row that now has the top border.
+        top = self.grid_y
+        bottom = self.grid_y + 2 * self.view_rows - 1
+        output = self.term.csr(top, bottom)
+        if shift > 0:
+            output += self.term.move(bottom, 0) + self.term.ind * (2 * shift)
+            new_rows = [self.view_y] + list(
+                range(self.view_y + self.view_rows - shift,
+                      self.view_y + self.view_rows))
+        else:
+            output += self.term.move(top, 0) + self.term.ri * (-2 * shift)
+            new_rows = list(range(self.view_y, self.view_y - shift + 1))
+        output += self.term.csr(0, self.term.height - 1)
+        echo(output)
+        self.draw_rows(new_rows)
+        return True
 
-        numbered_squares.sort(key=lambda x: (x[1], x[0]))
+    def fit_view(self, columns, rows, position):
+        """Resize the viewport, keeping it inside the puzzle and position
+        in view. Draws nothing."""
+        self.view_columns, self.view_rows = columns, rows
+        point_x, point_y = position
+        view_x = min(self.view_x, self.column_count - columns)
+        view_y = min(self.view_y, self.row_count - rows)
+        self.view_x = max(0, min(max(view_x, point_x - columns + 1), point_x))
+        self.view_y = max(0, min(max(view_y, point_y - rows + 1), point_y))
 
-        for number, square in enumerate(numbered_squares, 1):
-            self.cells.get(square).number = number
+    def number(self):
+        for entry in self.clues['across'] + self.clues['down']:
+            y, x = divmod(entry['cell'], self.column_count)
+            self.cells.get((x, y)).number = entry['num']
 
     @property
     def blank_cells_remaining(self):
@@ -278,66 +386,237 @@ class Grid:
                                                    timeout=5)
         return confirmation.lower() == 'y'
 
-    def save(self, filename):
-        fill = ''
-        for pos in self.cells:
-            cell = self.cells[pos]
-            if cell.is_block:
-                entry = "."
-            elif cell.is_blank:
-                entry = "-"
-            else:
-                entry = cell.entry
-            fill += entry
-        self.puzfile.fill = fill
-
-        if (any(self.cells.get(pos).marked_wrong or
-                self.cells.get(pos).corrected
-                for pos in self.cells) or
-                self.puzfile.has_markup()):
-            md = []
+    def save(self, filename, timer=None):
+        self.write_puzzle(filename, timer)
+        self.send_notification("Current puzzle state saved.")
+
+    def submit(self, timer):
+        from . import coop
+        from . import tournament
+
+        letters = [pos for pos in self.cells if self.cells[pos].is_letter]
+        try:
+            accepted, rank, finishers, seconds = self.tournament.submit(
+                self.indexed(letters), timer.time_passed)
+        except (OSError, coop.CoopError):
+            self.send_notification("Unable to reach the tournament server.")
+            return
+        if accepted:
+            self.send_notification(
+                "Solved in {}! You're #{} of {} finishers so far.".format(
+                    tournament.format_time(seconds), rank, finishers))
+        else:
+            self.send_notification("The tournament server rejected this grid.")
+
+    def write_puzzle(self, filename, timer=None):
+        self.write_state(filename, self.save_state(timer))
+
+    def save_state(self, timer=None):
+        """Everything write_state needs from the cells, as of now."""
+        # Saves come from the autosave thread as well as the input loop.
+        # The cells are only read under edit_lock, which the input loop
+        # holds except while it waits for a key, and the file is written
+        # after letting go of it, so keystrokes never wait on the disk.
+        with self.edit_lock:
+            fill = []
             for pos in self.cells:
                 cell = self.cells[pos]
-                cell_md = 0
-                if cell.corrected:
-                    cell_md += 16
-                if cell.marked_wrong:
-                    cell_md += 32
-                if cell.revealed:
-                    cell_md += 64
-                if cell.circled:
-                    cell_md += 128
-                md.append(cell_md)
-            self.puzfile.markup().markup = md
-
-        self.puzfile.save(filename)
-        self.send_notification("Current puzzle state saved.")
+                if cell.is_block:
+                    entry = "."
+                elif cell.is_blank:
+                    entry = "-"
+                else:
+                    entry = cell.entry
+                fill.append(entry)
+
+            return {
+                'journal mark': self.journal.mark() if self.journal else 0,
+                'fill': ''.join(fill),
+                'markup': [self.cells[pos].markup for pos in self.cells],
+                'marked': any(self.cells.get(pos).marked_wrong or
+                              self.cells.get(pos).corrected
+                              for pos in self.cells),
+                'timer': timer.save_format() if timer else None,
+                'history': (self.history.summarize(self, timer)
+                            if self.history else None),
+            }
+
+    def write_state(self, filename, state):
+        with self.save_lock:
+            self.puzfile.fill = state['fill']
+            if state['marked'] or self.puzfile.has_markup():
+                self.puzfile.markup().markup = state['markup']
+            if state['timer']:
+                self.puzfile.extensions[puz.Extensions.Timer] = state['timer']
+
+            self.puzfile.save(filename)
+
+            if self.journal:
+                self.journal.compact(state['journal mark'])
+
+        if state['history']:
+            self.history.write(state['history'], stats.SAVED)
+
+    def cell_changed(self, pos, op):
+        self.cells_changed([pos], op)
+
+    def cells_changed(self, pos_list, op, remote=False):
+        # Every edit to a cell's entry or flags is reported here, so that
+        # the journal, co-op partners, spectators and the completion check
+        # can keep up incrementally. Edits that came from a co-op partner
+        # aren't sent back out.
+        if not pos_list:
+            return
+
+        if self.journal or self.coop or self.broadcast or self.undo_log:
+            indexed = self.indexed(pos_list)
+            if self.undo_log:
+                self.undo_log.record(indexed, undoable=not remote)
+            if self.journal:
+                self.journal.log_cells(indexed, op)
+            if self.coop and not remote:
+                self.coop.send_cells(indexed, op)
+            if self.broadcast:
+                self.broadcast.publish(journal.pack_cells(indexed, op))
+
+        if self.unfinished_cells is not None:
+            for pos in pos_list:
+                if self.is_unfinished(pos):
+                    self.unfinished_cells.add(pos)
+                else:
+                    self.unfinished_cells.discard(pos)
+
+        if self.answer_cksum:
+            for x, y in pos_list:
+                self.answer_cksum.set(y * self.column_count + x,
+                                      self.cells[(x, y)].entry)
+
+    def indexed(self, pos_list):
+        return [(y * self.column_count + x, self.cells[(x, y)])
+                for x, y in pos_list]
+
+    def is_unfinished(self, pos):
+        cell = self.cells[pos]
+        return cell.is_blank if self.locked else not cell.is_correct
+
+    @property
+    def is_complete(self):
+        # Locked puzzles only carry a checksum of the scrambled solution,
+        # so a full grid is checked against that instead of cell by cell.
+        if self.unfinished_cells is None:
+            self.unfinished_cells = set(pos for pos in self.cells
+                                        if self.is_unfinished(pos))
+            if self.locked:
+                fill = ''.join(self.cells[pos].entry for pos in self.cells)
+                self.answer_cksum = puz.ScrambledChecksum(
+                    fill, self.column_count, self.row_count,
+                    ignore_chars=self.puzfile.blacksquare(),
+                    encoding=self.puzfile.encoding)
+
+        if self.unfinished_cells:
+            return False
+        if self.locked:
+            return self.answer_cksum.cksum() == self.puzfile.scrambled_cksum
+        return True
+
+    # The bulk operations below work out which cells they change in one
+    # pass, update them, and then repaint and journal only those cells in
+    # a single write, so a whole-puzzle command costs one flush.
 
     def reveal_cell(self, pos):
-        cell = self.cells.get(pos)
-        if cell.is_blankish or not cell.is_correct:
-            cell.entry = cell.solution
-            cell.revealed = True
-            self.draw_cell(pos)
+        return self.reveal_cells([pos])
 
     def reveal_cells(self, pos_list):
-        for pos in pos_list:
-            self.reveal_cell(pos)
+        cells = self.cells
+        changed = [pos for pos in pos_list
+                   if cells[pos].is_blankish or not cells[pos].is_correct]
+        for pos in changed:
+            cell = cells[pos]
+            cell.entry = cell.solution
+            cell.revealed = True
+        self.cells_changed(changed, journal.REVEAL)
+        self.draw_cells(changed)
+        return changed
 
     def check_cell(self, pos):
-        cell = self.cells.get(pos)
-        if not cell.is_blank and not cell.is_correct:
-            cell.marked_wrong = True
-            self.draw_cell(pos)
+        return self.check_cells([pos])
 
     def check_cells(self, pos_list):
-        for pos in pos_list:
-            self.check_cell(pos)
+        # In a tournament the solution is locked, so the server does the
+        # checking. Returns None if it can't be reached.
+        cells = self.cells
+        if self.tournament:
+            from . import coop
+
+            entered = [pos for pos in pos_list
+                       if cells[pos].is_letter and not cells[pos].is_blank]
+            try:
+                wrong = self.tournament.check(self.indexed(entered))
+            except (OSError, coop.CoopError):
+                return None
+            changed = [pos for pos in entered
+                       if pos[1] * self.column_count + pos[0] in wrong]
+        else:
+            changed = [pos for pos in pos_list
+                       if not cells[pos].is_blank and not cells[pos].is_correct]
+        for pos in changed:
+            cells[pos].marked_wrong = True
+        self.cells_changed(changed, journal.CHECK)
+        self.draw_cells(changed)
+        return changed
+
+    def clear_cells(self):
+        cells = self.cells
+        changed = [pos for pos in cells
+                   if cells[pos].is_letter and
+                   (not cells[pos].is_blank or cells[pos].marked_wrong)]
+        for pos in changed:
+            cells[pos].clear()
+        self.cells_changed(changed, journal.CLEAR)
+        self.draw_cells(changed)
+        return changed
+
+    def reset_cells(self):
+        cells = self.cells
+        changed = [pos for pos in cells
+                   if cells[pos].is_letter and
+                   (not cells[pos].is_blank or cells[pos].marked_wrong or
+                    cells[pos].corrected or cells[pos].revealed)]
+        for pos in changed:
+            cell = cells[pos]
+            cell.clear()
+            cell.corrected = False
+            cell.revealed = False
+        self.cells_changed(changed, journal.RESET)
+        self.draw_cells(changed)
+        return changed
+
+    def undo(self):
+        return self.restore(self.undo_log.undo() if self.undo_log else None)
+
+    def redo(self):
+        return self.restore(self.undo_log.redo() if self.undo_log else None)
+
+    def restore(self, changes):
+        if not changes:
+            return []
+        changed = []
+        for index, entry, markup in changes:
+            pos = (index % self.column_count, index // self.column_count)
+            cell = self.cells[pos]
+            cell.entry = chr(entry)
+            cell.apply_markup(markup)
+            changed.append(pos)
+        # Undone edits are passed on like any other, as the cells' new
+        # state, so the journal and co-op partners keep up.
+        self.cells_changed(changed, journal.ENTRY)
+        self.draw_cells(changed)
+        return changed
 
     def to_term(self, position):
         point_x, point_y = position
-        term_x = self.grid_x + (4 * point_x) + 2
-        term_y = self.grid_y + (2 * point_y) + 1
+        term_x = self.grid_x + (4 * (point_x - self.view_x)) + 2
+        term_y = self.grid_y + (2 * (point_y - self.view_y)) + 1
         return (term_y, term_x)
 
     def compile_cell(self, position):
@@ -362,16 +641,39 @@ class Grid:
         return value, markup
 
     def draw_cell(self, position):
+        if not self.is_visible(position):
+            return
         value, markup = self.compile_cell(position)
         value += markup
         echo(self.term.move(*self.to_term(position)) + value)
 
+    def draw_cells(self, positions):
+        output = []
+        for position in positions:
+            if self.is_visible(position):
+                value, markup = self.compile_cell(position)
+                output.append(self.term.move(*self.to_term(position)) +
+                              value + markup)
+        if output:
+            echo(''.join(output))
+
+    def draw_partner_cursor_cell(self, position):
+        if not self.is_visible(position):
+            return
+        value, markup = self.compile_cell(position)
+        value = self.term.black_on_cyan(self.term.strip_seqs(value)) + markup
+        echo(self.term.move(*self.to_term(position)) + value)
+
     def draw_highlighted_cell(self, position):
+        if not self.is_visible(position):
+            return
         value, markup = self.compile_cell(position)
         value = self.term.underline(value) + markup
         echo(self.term.move(*self.to_term(position)) + value)
 
     def draw_cursor_cell(self, position):
+        if not self.is_visible(position):
+            return
         value, markup = self.compile_cell(position)
         value = self.term.reverse(value) + markup
         echo(self.term.move(*self.to_term(position)) + value)
@@ -597,10 +899,11 @@ class Cursor:
     def current_word(self):
         pos = self.position
 
-        word = next((w for w in self.grid.words[self.direction] if pos in w),
-                    [pos])
+        index = self.grid.word_at[self.direction].get(pos)
+        if index is None:
+            return [pos]
 
-        return word
+        return self.grid.words[self.direction][index]
 
     def go_to_numbered_square(self):
         num = self.grid.get_notification_input("Enter square number:",
@@ -625,6 +928,8 @@ class Timer(threading.Thread):
         self.active = active
         self.time_passed = 0
         self.start_time = 0
+        # set while the terminal is too small to show the grid
+        self.hidden = False
 
         super().__init__(daemon=True)
 
@@ -645,8 +950,10 @@ class Timer(threading.Thread):
             time.sleep(0.5)
 
     def show_time(self):
+        if self.hidden:
+            return
         y_coord = 2
-        x_coord = self.grid.grid_x + self.grid.column_count * 4 - 7
+        x_coord = self.grid.grid_x + self.grid.view_columns * 4 - 7
 
         echo(self.grid.term.move(y_coord, x_coord) +
              self.display_format())
@@ -681,7 +988,505 @@ class Timer(threading.Thread):
         self.is_running = True
 
 
+class Autosaver(threading.Thread):
+    """Writes the puzzle in the background once the solver has been idle
+    for idle_seconds, or after max_edits edits, whichever comes first.
+
+    The input loop only bumps a counter, so keystrokes never wait on
+    disk I/O; the cells are read while the input loop waits for a key."""
+
+    def __init__(self, grid, timer, filename, idle_seconds=5, max_edits=25):
+        self.grid = grid
+        self.timer = timer
+        self.filename = filename
+        self.idle_seconds = idle_seconds
+        self.max_edits = max_edits
+
+        # edits is only written by the input thread and saved_edits only by
+        # whichever thread last saved, so neither needs a lock.
+        self.edits = 0
+        self.saved_edits = 0
+        self.last_edit = 0
+        self.error = None
+        self.unreported = None
+        self.active = True
+        self.wakeup = threading.Event()
+
+        super().__init__(daemon=True)
+
+    @property
+    def pending(self):
+        return self.edits - self.saved_edits
+
+    def note_edit(self):
+        self.edits += 1
+        self.last_edit = time.time()
+        self.wakeup.set()
+
+    def mark_saved(self):
+        self.saved_edits = self.edits
+
+    def run(self):
+        while self.active:
+            if not self.pending:
+                self.wakeup.wait()
+                self.wakeup.clear()
+                continue
+
+            idle = time.time() - self.last_edit
+            if ((self.pending >= self.max_edits and not self.error) or
+                    idle >= self.idle_seconds):
+                self.save()
+            else:
+                self.wakeup.wait(self.idle_seconds - idle)
+                self.wakeup.clear()
+
+    def save(self):
+        edits = self.edits
+        try:
+            self.grid.write_puzzle(self.filename, self.timer)
+        except OSError as err:
+            # Retry after the next idle period rather than spinning.
+            self.error = self.unreported = err
+            self.last_edit = time.time()
+            return
+        self.error = None
+        self.saved_edits = edits
+
+    def take_error(self):
+        """The error a save failed with since the last call, if any. The
+        input loop reports it, so that only that thread draws."""
+        error, self.unreported = self.unreported, None
+        return error
+
+    def flush(self):
+        if self.pending:
+            self.save()
+        return not self.pending
+
+
+class ResizeWatcher:
+    """
+    Notices the terminal being resized. The SIGWINCH handler only notes the
+    resize and writes a byte to a pipe; inkey waits on that pipe as well as
+    the keyboard, so a resize ends a wait for a key with a KEY_RESIZE
+    keystroke without ever interrupting blessed part way through reading
+    one. A resize that arrives at any other time is picked up the next time
+    through the input loop.
+    """
+    def __init__(self, term, lock=None):
+        self.term = term
+        self.lock = lock
+        self.pending = False
+        self.wakeup = None
+        # Without SIGWINCH (on Windows) there's nothing to watch, and
+        # select() there only works on sockets anyway.
+        if hasattr(signal, 'SIGWINCH') and self.keyboard() is not None:
+            self.wakeup = os.pipe()
+            for fd in self.wakeup:
+                os.set_blocking(fd, False)
+            signal.signal(signal.SIGWINCH, self.handle)
+
+    def keyboard(self):
+        return getattr(self.term, '_keyboard_fd', None)
+
+    def handle(self, signum, frame):
+        self.pending = True
+        try:
+            os.write(self.wakeup[1], b'\0')
+        except OSError:
+            # the pipe is full, so a wakeup is already on its way
+            pass
+
+    def inkey(self, timeout=None, wake=()):
+        """The next keystroke, KEY_RESIZE if the terminal is resized first,
+        or an empty keystroke once timeout runs out or any of the sockets in
+        wake can be read from. lock, if given, is let go of while waiting,
+        so that other threads can get at what it guards."""
+        if self.lock:
+            self.lock.release()
+        try:
+            if self.wakeup is None:
+                return self.poll(timeout, wake)
+            return self.wait(timeout, wake)
+        finally:
+            if self.lock:
+                self.lock.acquire()
+
+    def wait(self, timeout, wake):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.pending:
+            # keys blessed has already read but not yet handed over
+            keypress = self.term.inkey(timeout=0)
+            if keypress:
+                return keypress
+            left = None if deadline is None else max(0, deadline - time.time())
+            ready, _, _ = select.select(
+                [self.keyboard(), self.wakeup[0]] + list(wake), [], [], left)
+            if not ready:
+                return keypress
+            if self.wakeup[0] in ready:
+                try:
+                    os.read(self.wakeup[0], 4096)
+                except OSError:
+                    pass
+            if any(f in ready for f in wake):
+                return self.term.inkey(timeout=0)
+        return Keystroke('', name='KEY_RESIZE')
+
+    def poll(self, timeout, wake, interval=0.05):
+        if not wake:
+            return self.term.inkey(timeout=timeout)
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            left = interval if deadline is None else min(
+                interval, max(0, deadline - time.time()))
+            keypress = self.term.inkey(timeout=left)
+            if (keypress or select.select(wake, [], [], 0)[0] or
+                    (deadline is not None and time.time() >= deadline)):
+                return keypress
+
+    def take(self, settle=0.05):
+        """True if the terminal has been resized since the last call.
+        Dragging a window edge sends a burst of resizes, so wait for them
+        to stop and lay the screen out once."""
+        if not self.pending:
+            return False
+        while self.pending:
+            self.pending = False
+            time.sleep(settle)
+        return True
+
+
+class Layout:
+    """Where everything goes on a terminal of the current size."""
+    # Puzzles too big for the terminal are shown through a viewport that
+    # follows the cursor, so only a handful of rows and columns must fit.
+    min_view = 5
+
+    min_clue_list_width = 24
+    max_clue_list_width = 60
+
+    commands = [("^Q", "quit"),
+                ("^S", "save"),
+                ("^P", "pause"),
+                ("^C", "check"),
+                ("^R", "reveal"),
+                ("^G", "go to"),
+                ("^X", "clear"),
+                ("^Z", "reset"),]
+
+    def __init__(self, term, grid, software_info):
+        grid_x = grid.grid_x
+
+        chrome_width = (grid_x
+                        + 2) # a little breathing room
+
+        chrome_height = (grid.grid_y # includes the top bar + timer
+                         + 2 # padding above clues
+                         + 3 # clue area
+                         + 2 # toolbar
+                         + 2) # again, just some breathing room
+
+        self.view_columns = max(0, min(grid.column_count,
+                                       (term.width - chrome_width) // 4))
+        self.view_rows = max(0, min(grid.row_count,
+                                    (term.height - chrome_height) // 2))
+
+        puzzle_width = max(4 * self.view_columns, 40)
+
+        min_width = (max(4 * min(grid.column_count, self.min_view), 40) +
+                     chrome_width)
+        min_height = 2 * min(grid.row_count, self.min_view) + chrome_height
+
+        self.necessary_resize = []
+        if term.width < min_width:
+            self.necessary_resize.append("wider")
+        if term.height < min_height:
+            self.necessary_resize.append("taller")
+
+        puzzle_info = '{grid.title} - {grid.author}'.format(grid=grid)
+        padding = 2
+        sw_width = len(software_info) + 5
+        pz_width = term.width - sw_width - padding
+        if len(puzzle_info) > pz_width:
+            puzzle_info = "{}…".format(puzzle_info[:pz_width - 1])
+
+        self.headline = " {:<{pz_w}}{:>{sw_w}} ".format(
+            puzzle_info, software_info,
+            pz_w=pz_width, sw_w=sw_width)
+
+        self.toolbar = ''
+        if term.width >= 15 * len(self.commands):
+            for shortcut, action in self.commands:
+                shortcut = term.reverse(shortcut)
+                self.toolbar += "{:<25}".format(' '.join([shortcut, action]))
+            self.toolbar_location = {'x': grid_x, 'y': term.height}
+            self.notification_area = (term.height - 2, grid_x)
+        else:
+            command_split = int(len(self.commands)/2) - 1
+            for idx, (shortcut, action) in enumerate(self.commands):
+                shortcut = term.reverse(shortcut)
+                self.toolbar += "{:<25}".format(' '.join([shortcut, action]))
+
+                if idx == command_split:
+                    self.toolbar += '\r\n' + grid_x * ' '
+            self.toolbar_location = {'x': grid_x, 'y': term.height - 2}
+            self.notification_area = (term.height - 3, grid_x)
+
+        clue_width = min(int(1.3 * (puzzle_width) - grid_x),
+                         term.width - 2 - grid_x)
+
+        self.clue_wrapper = textwrap.TextWrapper(
+            width=max(clue_width, 1),
+            max_lines=3,
+            subsequent_indent=grid_x * ' ')
+
+        self.info_location = {'x': grid_x,
+                              'y': grid.grid_y + 2 * self.view_rows + 2}
+
+        # The full clue lists go beside the grid, if there's room for them.
+        clue_list_x = grid_x + 4 * self.view_columns + 4
+        clue_list_width = min(term.width - clue_list_x - 2,
+                              self.max_clue_list_width)
+        clue_list_height = 2 * self.view_rows + 1
+        if (clue_list_width >= self.min_clue_list_width and
+                clue_list_height >= 7):
+            self.clue_list_area = (clue_list_x, grid.grid_y,
+                                   clue_list_width, clue_list_height)
+        else:
+            self.clue_list_area = None
+
+        # wrapped clues, ready to write, by (direction, word index)
+        self.clues = {}
+
+    def clue_text(self, grid, cursor, downs_only=False):
+        direction = cursor.direction
+        index = grid.word_at[direction].get(cursor.position)
+        key = (direction, index)
+        if key in self.clues:
+            return self.clues[key]
+
+        if index is not None:
+            clue = grid.clues[direction][index]['clue']
+            if direction == 'across' and downs_only:
+                clue = "—"
+        else:
+            clue = ""
+
+        num = (str(grid.cells.get(grid.words[direction][index][0]).number)
+               if clue else "")
+
+        compiled_clue = (num + " " + direction.upper() +
+                         ": " + clue) if num else ""
+        wrapped_clue = self.clue_wrapper.wrap(compiled_clue)
+        wrapped_clue += [''] * (3 - len(wrapped_clue))
+        wrapped_clue = [line + grid.term.clear_eol for line in wrapped_clue]
+
+        # This is fun: since we're in raw mode, \n isn't sufficient to
+        # return the printing location to the first column. If you
+        # don't also have \r,
+        # it
+        #    prints
+        #           like
+        #                this after each newline
+        self.clues[key] = (grid.term.move(self.info_location['y'],
+                                          self.info_location['x']) +
+                           '\r\n'.join(wrapped_clue))
+        return self.clues[key]
+
+    def make_clue_list(self, grid, downs_only=False, show=True):
+        if not show or not self.clue_list_area:
+            return None
+        return ClueList(grid, self.clue_list_area, downs_only)
+
+    @property
+    def too_small(self):
+        return bool(self.necessary_resize)
+
+    def apply(self, grid, position):
+        grid.notification_area = self.notification_area
+        grid.fit_view(self.view_columns, self.view_rows, position)
+
+    def draw_chrome(self, term):
+        # moves go through echo, so that they stay in order with what's
+        # drawn when the output is batched
+        echo(term.move(0, 0) + term.dim + term.reverse(self.headline) +
+             term.normal)
+        echo(term.move(self.toolbar_location['y'],
+                       self.toolbar_location['x']) + self.toolbar)
+
+
+class ClueSection:
+    """One direction's clues, shown a window at a time. Clues are wrapped
+    the first time they're shown, and only the clues in the window are
+    ever drawn."""
+    def __init__(self, grid, direction, x, y, width, height):
+        self.grid = grid
+        self.term = grid.term
+        self.direction = direction
+        self.clues = grid.clues[direction]
+        self.x, self.y = x, y
+        self.width = width
+        self.rows = height - 1  # below the heading
+
+        self.top = 0
+        self.lines = {}
+        self.shown = {}
+        self.styles = {}
+        self.wrapper = textwrap.TextWrapper(width=width,
+                                            subsequent_indent=4 * ' ')
+
+    def wrap(self, index):
+        if index not in self.lines:
+            entry = self.clues[index]
+            self.lines[index] = [
+                '{:<{w}}'.format(line, w=self.width) for line in
+                self.wrapper.wrap('{:>3} {}'.format(entry['num'],
+                                                    entry['clue']))] or ['']
+        return self.lines[index]
+
+    def render(self, index):
+        row, count = self.shown[index]
+        style = self.styles.get(index)
+        return ''.join(self.term.move(self.y + 1 + row + k, self.x) +
+                       (style(line) if style else line)
+                       for k, line in enumerate(self.wrap(index)[:count]))
+
+    def draw(self):
+        output = self.term.move(self.y, self.x) + self.term.bold(
+            '{:<{w}}'.format(self.direction.upper(), w=self.width))
+        self.shown = {}
+        row, index = 0, self.top
+        while row < self.rows and index < len(self.clues):
+            count = min(len(self.wrap(index)), self.rows - row)
+            self.shown[index] = (row, count)
+            output += self.render(index)
+            row += count
+            index += 1
+        for row in range(row, self.rows):
+            output += (self.term.move(self.y + 1 + row, self.x) +
+                       ' ' * self.width)
+        echo(output)
+
+    def is_shown(self, index):
+        return (index in self.shown and
+                self.shown[index][1] == len(self.wrap(index)))
+
+    def fits(self, start, end):
+        lines = 0
+        for index in range(start, end):
+            lines += len(self.wrap(index))
+            if lines > self.rows:
+                return False
+        return True
+
+    def scroll_to(self, index):
+        # Keep a couple of clues above the one being scrolled to, but
+        # don't leave the window half empty at the end of the list.
+        self.top = max(0, index - 2)
+        while self.top < index and not self.fits(self.top, index + 1):
+            self.top += 1
+        while self.top > 0 and self.fits(self.top - 1, len(self.clues)):
+            self.top -= 1
+
+    def highlight(self, styles):
+        """Restyle the clues in styles ({index: style}), and restore any
+        that are no longer highlighted. Only those clues are redrawn,
+        unless one of them has to be scrolled into view."""
+        old, self.styles = self.styles, styles
+        missing = [index for index in styles if not self.is_shown(index)]
+        if missing:
+            self.scroll_to(missing[0])
+            self.draw()
+            return
+        changed = [index for index in set(old) | set(styles)
+                   if old.get(index) != styles.get(index) and
+                   index in self.shown]
+        if changed:
+            echo(''.join(self.render(index) for index in changed))
+
+    def clear(self):
+        echo(''.join(self.term.move(self.y + row, self.x) + ' ' * self.width
+                     for row in range(self.rows + 1)))
+
+
+class ClueList:
+    """The full across and down clue lists beside the grid, with the
+    cursor's clue and the clue crossing it highlighted."""
+    def __init__(self, grid, area, downs_only=False):
+        x, y, width, height = area
+        self.grid = grid
+        if downs_only:
+            self.sections = [ClueSection(grid, 'down', x, y, width, height)]
+        else:
+            across_height = (height + 1) // 2
+            self.sections = [
+                ClueSection(grid, 'across', x, y, width, across_height - 1),
+                ClueSection(grid, 'down', x, y + across_height, width,
+                            height - across_height)]
+
+    def draw(self):
+        for section in self.sections:
+            section.draw()
+
+    def clear(self):
+        for section in self.sections:
+            section.styles = {}
+            section.clear()
+
+    def follow(self, cursor):
+        for section in self.sections:
+            styles = {}
+            index = self.grid.word_at[section.direction].get(cursor.position)
+            if index is not None:
+                styles[index] = (self.grid.term.reverse
+                                 if section.direction == cursor.direction
+                                 else self.grid.term.underline)
+            section.highlight(styles)
+
+
+@contextlib.contextmanager
+def batched_output():
+    """Collect everything this thread echoes inside the block and write it
+    out at once, so that a repaint reaches the terminal in a single write.
+    The timer and other threads keep writing straight to the terminal."""
+    batch = output.batch = io.StringIO()
+    try:
+        yield
+    finally:
+        output.batch = None
+        echo(batch.getvalue())
+
+
 def main():
+    if sys.argv[1:2] == ['convert']:
+        from . import convert
+        sys.exit(convert.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['serve']:
+        from . import coop
+        sys.exit(coop.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['watch']:
+        from . import broadcast
+        sys.exit(broadcast.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['tournament']:
+        from . import tournament
+        sys.exit(tournament.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['stats']:
+        sys.exit(stats.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['autofill']:
+        from . import autofill
+        sys.exit(autofill.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['cache']:
+        from . import cache
+        sys.exit(cache.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['prefork']:
+        from . import prefork
+        sys.exit(prefork.main(sys.argv[2:]))
+    if sys.argv[1:2] == ['memstats']:
+        from . import memstats
+        sys.exit(memstats.main(sys.argv[2:]))
+
     version_dir = os.path.abspath(os.path.dirname((__file__)))
     version_file = os.path.join(version_dir, 'version')
     with open(version_file) as f:
@@ -691,17 +1496,61 @@ def main():
         prog='cursewords',
         description="""cursewords is a terminal-based crossword puzzle
         solving interface. Use it to open, solve, and save puzzles in the
-        standard AcrossLite .puz format. Arrow keys and tab navigate,
+        standard AcrossLite .puz format, or in .ipuz or .jpz. Arrow keys and tab navigate,
         and space bar switches the cursor direction.""",
         usage=textwrap.dedent("""\
-            cursewords [-h] [--downs-only] [--version] PUZfile
-            print mode: cursewords [--print] [--blank | --solution] [--width INT] PUZfile"""))
+            cursewords [-h] [--downs-only] [--autosave SECONDS] [--coop ADDRESS] [--broadcast ADDRESS]
+                       [--tournament ADDRESS [--name NAME]] [--no-history]
+                       [--no-clue-list] [--memstats] [--wordlist FILE] [--cache ADDRESS] [--version] PUZfile
+            print mode: cursewords [--print] [--blank | --solution] [--width INT] PUZfile
+            convert mode: cursewords convert [-o DIR] [-t {ipuz,json,text}] PATH [PATH ...]
+            co-op server: cursewords serve PUZfile ADDRESS
+            spectator mode: cursewords watch ADDRESS
+            tournament server: cursewords tournament [--key KEY] PUZfile ADDRESS
+            solve history: cursewords stats [--db PATH] [--limit N]
+            autofill: cursewords autofill -w FILE [-o FILE] [-j N] [-t SECONDS] [--unique] PUZfile
+            puzzle cache: cursewords cache [--dir DIR] [--max-puzzles N] ADDRESS
+            pre-forking launcher: cursewords prefork [--preload PUZfile ...] [ADDRESS]
+            memory benchmark: cursewords memstats [--sizes N ...] [PUZfile ...]"""))
 
     parser.add_argument('filename', metavar='PUZfile',
                         help="""path of puzzle file in the \
-                        AcrossLite .puz format""")
+                        AcrossLite .puz, .ipuz or .jpz format""")
     parser.add_argument('--downs-only', action='store_true',
                         help="""displays only the down clues""")
+    parser.add_argument('--autosave', metavar='SECONDS', type=int,
+                        help="""save progress automatically after SECONDS
+                        without input, or after every 25 edits""")
+    parser.add_argument('--coop', metavar='ADDRESS',
+                        help="""solve together with others through the
+                        co-op server at ADDRESS (a Unix socket path or
+                        HOST:PORT)""")
+    parser.add_argument('--broadcast', metavar='ADDRESS',
+                        help="""let others watch this session with
+                        cursewords watch ADDRESS (a Unix socket path or
+                        HOST:PORT)""")
+    parser.add_argument('--tournament', metavar='ADDRESS',
+                        help="""join the tournament server at ADDRESS,
+                        saving the puzzle it hands out as PUZfile""")
+    parser.add_argument('--name', help="""name to enter a tournament
+                        under (default: your user name)""")
+    parser.add_argument('--wordlist', metavar='FILE',
+                        help="""word list to suggest fill from with ^W,
+                        one word per line, optionally as WORD;SCORE""")
+    parser.add_argument('--no-history', action='store_true',
+                        help="""don't record this session in the solve
+                        history used by cursewords stats""")
+    parser.add_argument('--cache', metavar='ADDRESS',
+                        default=os.environ.get('CURSEWORDS_CACHE'),
+                        help="""open .puz files through the puzzle cache
+                        at ADDRESS, shared with other sessions on this host
+                        (default: $CURSEWORDS_CACHE)""")
+    parser.add_argument('--memstats', action='store_true',
+                        help="""when the session ends, report the memory
+                        held by each part of it to stderr""")
+    parser.add_argument('--no-clue-list', action='store_true',
+                        help="""don't show the full clue lists beside the
+                        grid, even when there's room for them""")
 
     print_group = parser.add_argument_group('print mode', description="""\
         If the --print flag is explicitly provided, or if cursewords
@@ -725,6 +1574,10 @@ def main():
 
     args = parser.parse_args()
     filename = args.filename
+    memory = None
+    if args.memstats:
+        from . import memstats
+        memory = memstats.MemStats()
     downs_only = args.downs_only
     print_mode = args.print or not sys.stdout.isatty()
     print_style = ('solution' if args.solution
@@ -732,10 +1585,46 @@ def main():
                    else None)
     print_width = args.width
 
-    try:
-        puzfile = puz.read(filename)
-    except:
-        sys.exit("Unable to parse {} as a .puz file.".format(filename))
+    if args.tournament:
+        from . import coop
+        from . import tournament
+        try:
+            entry = tournament.TournamentClient(args.tournament)
+            handout = entry.join(args.name)
+        except (OSError, coop.CoopError) as err:
+            sys.exit("Unable to join tournament at {}: {}".format(
+                args.tournament, err))
+        # An existing copy holds progress from an earlier session.
+        if not os.path.exists(filename):
+            puz.atomic_write(filename, handout)
+        else:
+            try:
+                existing = puz.read(filename)
+            except puz.PuzzleFormatError:
+                sys.exit("Unable to parse {} as a puzzle file.".format(
+                    filename))
+            if not tournament.same_puzzle(existing, puz.load(handout)):
+                sys.exit("{} already exists and holds a different "
+                         "puzzle.".format(filename))
+
+    # Only a session forked by `cursewords prefork` can have its puzzle
+    # preloaded, and the parent imported prefork to fork it.
+    prefork = sys.modules.get(__package__ + '.prefork')
+    puzfile = prefork.take_preloaded(filename) if prefork else None
+    if puzfile is None and args.cache and filename.lower().endswith('.puz'):
+        from . import cache
+        from . import coop
+        try:
+            puzfile = cache.read(args.cache, filename)
+        except (OSError, coop.CoopError):
+            # the cache only saves time; the file can still be read here
+            pass
+
+    if puzfile is None:
+        try:
+            puzfile = formats.read(filename)
+        except:
+            sys.exit("Unable to parse {} as a puzzle file.".format(filename))
 
     term = Terminal()
 
@@ -744,39 +1633,29 @@ def main():
 
     grid = Grid(grid_x, grid_y, term)
     grid.load(puzfile)
+    if args.tournament:
+        grid.tournament = entry
 
     if print_mode:
+        if memory:
+            memory.take('after load', grid)
         printer_output(grid, style=print_style, width=print_width,
                        downs_only=downs_only)
+        if memory:
+            memory.report()
         sys.exit()
 
-    puzzle_width = max(4 * grid.column_count, 40)
-    puzzle_height = 2 * grid.row_count
-
-    min_width = (puzzle_width
-                 + grid_x
-                 + 2) # a little breathing room
-
-    min_height = (puzzle_height
-                  + grid_y # includes the top bar + timer
-                  + 2 # padding above clues
-                  + 3 # clue area
-                  + 2 # toolbar
-                  + 2) # again, just some breathing room
-
-    necessary_resize = []
-    if term.width < min_width:
-        necessary_resize.append("wider")
-    if term.height < min_height:
-        necessary_resize.append("taller")
+    software_info = 'cursewords v{}'.format(version)
+    layout = Layout(term, grid, software_info)
+    layout.apply(grid, grid.words['across'][0][0])
 
-    if necessary_resize:
+    if layout.too_small:
         exit_text = textwrap.dedent("""\
         This puzzle is {} columns wide and {} rows tall.
         The terminal window must be {} to properly display 
         it.""".format(
             grid.column_count, grid.row_count,
-            ' and '.join(necessary_resize)))
+            ' and '.join(layout.necessary_resize)))
         sys.exit(' '.join(exit_text.splitlines()))
 
     if grid.puzfile.has_rebus():
@@ -785,64 +1664,50 @@ def main():
         by cursewords. Sorry about that!""")
         sys.exit(' '.join(exit_text.splitlines()))
 
-    echo(term.enter_fullscreen())
-    echo(term.clear())
-
-    software_info = 'cursewords v{}'.format(version)
-    puzzle_info = '{grid.title} - {grid.author}'.format(grid=grid)
-    padding = 2
-    sw_width = len(software_info) + 5
-    pz_width = term.width - sw_width - padding
-    if len(puzzle_info) > pz_width:
-        puzzle_info = "{}…".format(puzzle_info[:pz_width - 1])
-
-    headline = " {:<{pz_w}}{:>{sw_w}} ".format(
-        puzzle_info, software_info,
-        pz_w=pz_width, sw_w=sw_width)
-
-    with term.location(x=0, y=0):
-        echo(term.dim + term.reverse(headline) + term.normal)
-
-    grid.draw()
-
-
-    toolbar = ''
-    commands = [("^Q", "quit"),
-                ("^S", "save"),
-                ("^P", "pause"),
-                ("^C", "check"),
-                ("^R", "reveal"),
-                ("^G", "go to"),
-                ("^X", "clear"),
-                ("^Z", "reset"),]
+    words = None
+    if args.wordlist:
+        from . import wordlist
+        try:
+            words = wordlist.load(args.wordlist)
+        except (OSError, ValueError):
+            sys.exit("Unable to read {} as a word list.".format(args.wordlist))
 
-    if term.width >= 15 * len(commands):
-        for shortcut, action in commands:
-            shortcut = term.reverse(shortcut)
-            toolbar += "{:<25}".format(' '.join([shortcut, action]))
+    if not args.no_history:
+        try:
+            grid.history = stats.History()
+        except (OSError, sqlite3.Error):
+            pass
 
-        with term.location(x=grid_x, y=term.height):
-            echo(toolbar)
-    else:
-        grid.notification_area = (grid.notification_area[0] - 1, grid_x)
-        command_split = int(len(commands)/2) - 1
-        for idx, (shortcut, action) in enumerate(commands):
-            shortcut = term.reverse(shortcut)
-            toolbar += "{:<25}".format(' '.join([shortcut, action]))
+    grid.journal = journal.Journal(filename, grid)
+    recovered_edits = grid.journal.replay()
 
-            if idx == command_split:
-                toolbar += '\n' + grid_x * ' '
+    if args.coop:
+        from . import coop
+        try:
+            coop.CoopClient(args.coop).join(grid)
+        except (OSError, coop.CoopError) as err:
+            sys.exit("Unable to join co-op server at {}: {}".format(
+                args.coop, err))
+
+    if args.broadcast:
+        from . import broadcast
+        grid.broadcast = broadcast.Broadcaster(args.broadcast, grid)
+        try:
+            grid.broadcast.listen()
+        except OSError as err:
+            sys.exit("Unable to broadcast on {}: {}".format(
+                args.broadcast, err))
 
-        with term.location(x=grid_x, y=term.height - 2):
-            echo(toolbar)
+    echo(term.enter_fullscreen())
+    echo(term.clear())
 
-    clue_width = min(int(1.3 * (puzzle_width) - grid_x),
-                     term.width - 2 - grid_x)
+    layout.draw_chrome(term)
+    grid.draw()
 
-    clue_wrapper = textwrap.TextWrapper(
-        width=clue_width,
-        max_lines=3,
-        subsequent_indent=grid_x * ' ')
+    show_clue_list = not args.no_clue_list
+    clue_list = layout.make_clue_list(grid, downs_only, show_clue_list)
+    if clue_list:
+        clue_list.draw()
 
     start_pos = grid.words['across'][0][0]
     cursor = Cursor(start_pos, "across", grid)
@@ -852,17 +1717,97 @@ def main():
     keypress = ''
     puzzle_paused = False
     puzzle_complete = False
-    modified_since_save = False
+    modified_since_save = bool(recovered_edits)
     to_quit = not sys.stdout.isatty()
 
     timer = Timer(grid, starting_seconds=int(grid.start_time),
                   is_running=True, active=bool(int(grid.timer_active)))
     timer.start()
 
-    info_location = {'x': grid_x, 'y': grid_y + 2 * grid.row_count + 2}
+    autosaver = Autosaver(grid, timer, filename, idle_seconds=args.autosave)
+    if args.autosave:
+        autosaver.start()
+
+    grid.journal.timer = timer
+    grid.journal.start()
+
+    grid.undo_log = undo.UndoLog(grid.cells.values())
+
+    if grid.broadcast:
+        grid.broadcast.timer = timer
+
+    if recovered_edits:
+        autosaver.note_edit()
+        grid.send_notification(
+            "Recovered {} unsaved edits.".format(recovered_edits))
+
+    # The input loop holds edit_lock while it handles keys, so the
+    # autosave thread only reads the cells between edits.
+    grid.edit_lock.acquire()
+    resize = ResizeWatcher(term, grid.edit_lock)
+
+    if memory:
+        memory.take('after load', grid, layout, clue_list)
 
     with term.raw(), term.hidden_cursor():
         while not to_quit:
+            # After a resize, lay everything out again for the new size and
+            # repaint the screen in one go. The grid itself is left alone.
+            if resize.take():
+                layout = Layout(term, grid, software_info)
+                layout.apply(grid, cursor.position)
+                clue_list = layout.make_clue_list(grid, downs_only,
+                                                  show_clue_list)
+                timer.hidden = layout.too_small
+                with batched_output():
+                    echo(term.clear())
+                    if layout.too_small:
+                        echo(term.move(0, 0) +
+                             "Make the terminal {} to keep solving.".format(
+                                 ' and '.join(layout.necessary_resize)))
+                    else:
+                        layout.draw_chrome(term)
+                        grid.draw(empty=puzzle_paused)
+                        if clue_list and not puzzle_paused:
+                            clue_list.draw()
+                        timer.show_time()
+                        if puzzle_complete:
+                            echo(term.move(2, grid_x) + term.reverse(
+                                "You've completed the puzzle! 🎉"))
+                        if puzzle_paused:
+                            echo(term.move(layout.info_location['y'],
+                                           layout.info_location['x']) +
+                                 'PUZZLE PAUSED')
+                if not puzzle_paused:
+                    old_word = []
+
+            error = autosaver.take_error()
+            if error:
+                grid.send_notification(
+                    "Autosave failed: {}".format(error.strerror))
+
+            # Nothing fits on screen until the terminal is made bigger
+            # again, but the puzzle can still be quit.
+            if layout.too_small:
+                keypress = resize.inkey()
+                if keypress == chr(17):
+                    if autosaver.is_alive():
+                        modified_since_save = not autosaver.flush()
+                    to_quit = grid.confirm_quit(modified_since_save)
+                    if to_quit:
+                        grid.journal.discard()
+                continue
+
+            # If the cursor has left the visible part of the grid, scroll
+            # it back into view and repaint the word highlighting.
+            if grid.scroll_to(cursor.position):
+                for pos in old_word:
+                    grid.draw_cell(pos)
+                old_word = []
+                # scrolling the grid scrolls whole lines of the screen
+                if clue_list:
+                    clue_list.draw()
+
             # First up we draw all the necessary stuff. If the current word
             # is different from the word the last time through the loop:
             if cursor.current_word() is not old_word:
@@ -873,33 +1818,7 @@ def main():
                     grid.draw_highlighted_cell(pos)
 
                 # Draw the clue for the new word:
-                if cursor.current_word() in grid.words[cursor.direction]:
-                    num_index = grid.words[cursor.direction].index(
-                        cursor.current_word())
-                    clue = grid.clues[cursor.direction][num_index]['clue']
-                    if cursor.direction == 'across' and downs_only:
-                        clue = "—"
-                else:
-                    clue = ""
-
-                num = (str(grid.cells.get(cursor.current_word()[0]).number)
-                       if clue else "")
-
-                compiled_clue = (num + " " + cursor.direction.upper() +
-                                 ": " + clue) if num else ""
-                wrapped_clue = clue_wrapper.wrap(compiled_clue)
-                wrapped_clue += [''] * (3 - len(wrapped_clue))
-                wrapped_clue = [line + term.clear_eol for line in wrapped_clue]
-
-                # This is fun: since we're in raw mode, \n isn't sufficient to
-                # return the printing location to the first column. If you
-                # don't also have \r,
-                # it
-                #    prints
-                #           like
-                #                this after each newline
-                echo(term.move(info_location['y'], info_location['x']) +
-                     '\r\n'.join(wrapped_clue))
+                echo(layout.clue_text(grid, cursor, downs_only))
 
             # Otherwise, just draw the old square now that it's not under
             # the cursor
@@ -909,41 +1828,70 @@ def main():
             current_cell = grid.cells.get(cursor.position)
             grid.draw_cursor_cell(cursor.position)
 
+            if clue_list and not puzzle_paused:
+                clue_list.follow(cursor)
+
             # Check if the puzzle is complete!
-            if not puzzle_complete and all(grid.cells.get(pos).is_correct
-                                           for pos in grid.cells):
+            if not puzzle_complete and grid.is_complete:
                 puzzle_complete = True
                 with term.location(x=grid_x, y=2):
                     echo(term.reverse("You've completed the puzzle! 🎉"),
                          term.clear_eol)
                 timer.show_time()
                 timer.active = False
+                if grid.tournament:
+                    grid.submit(timer)
+                if grid.history:
+                    grid.history.record(grid, timer, stats.SOLVED)
+
+            if grid.broadcast:
+                grid.broadcast.publish_cursor(cursor)
 
             # Where the magic happens: get key input
-            keypress = term.inkey()
+            if grid.coop:
+                partners = grid.coop
+                keypress = partners.wait_for_key(term, cursor, resize.inkey,
+                                                 paused=puzzle_paused)
+                # partners' edits are saved like the solver's own
+                if partners.take_edited():
+                    modified_since_save = True
+                    autosaver.note_edit()
+            else:
+                keypress = resize.inkey()
 
             old_position = cursor.position
             old_word = cursor.current_word()
 
             # ctrl-q
             if keypress == chr(17):
+                if autosaver.is_alive():
+                    modified_since_save = not autosaver.flush()
                 to_quit = grid.confirm_quit(modified_since_save)
-                if not to_quit:
+                if to_quit:
+                    grid.journal.discard()
+                else:
                     grid.send_notification("Quit command canceled.")
 
             # ctrl-s
             elif keypress == chr(19):
-                grid.puzfile.extensions[puz.Extensions.Timer] = timer.save_format()
-                grid.save(filename)
-                modified_since_save = False
+                try:
+                    grid.save(filename, timer)
+                except OSError as err:
+                    grid.send_notification(
+                        "Unable to save: {}".format(err.strerror))
+                else:
+                    autosaver.mark_saved()
+                    modified_since_save = False
 
             # ctrl-p
             elif keypress == chr(16) and not puzzle_complete:
                 if timer.is_running:
                     timer.pause()
                     grid.draw(empty=True)
+                    if clue_list:
+                        clue_list.clear()
 
-                    with term.location(**info_location):
+                    with term.location(**layout.info_location):
                         echo('\r\n'.join(['PUZZLE PAUSED' + term.clear_eol,
                                           term.clear_eol,
                                           term.clear_eol]))
@@ -953,6 +1901,8 @@ def main():
                 else:
                     timer.unpause()
                     grid.draw()
+                    if clue_list:
+                        clue_list.draw()
                     old_word = []
 
                     puzzle_paused = False
@@ -962,17 +1912,13 @@ def main():
                 confirm = grid.confirm_reset()
                 if confirm:
                     grid.send_notification("Puzzle reset.")
-                    for pos in grid.cells:
-                        cell = grid.cells.get(pos)
-                        if cell.is_letter:
-                            cell.clear()
-                            cell.corrected = False
-                            cell.revealed = False
-                            grid.draw_cell(pos)
+                    grid.reset_cells()
                     timer.starting_seconds = timer.time_passed = 0
                     timer.start_time = time.time()
                     timer.show_time()
+                    grid.journal.log_timer()
                     modified_since_save = True
+                    autosaver.note_edit()
                     if not puzzle_paused:
                         old_word = []
                 else:
@@ -983,24 +1929,35 @@ def main():
                 continue
 
             # ctrl-c
+            elif keypress == chr(3) and grid.locked and not grid.tournament:
+                grid.send_notification(
+                    "This puzzle's solution is locked and can't be checked.")
+
             elif keypress == chr(3):
                 group = grid.get_notification_input(
                     "Check (l)etter, (w)ord, or (p)uzzle?",
                     char_limit=1)
                 scope = ''
+                checked = []
                 if group.lower() == 'l':
                     scope = 'letter'
-                    grid.check_cell(cursor.position)
+                    checked = grid.check_cell(cursor.position)
                 elif group.lower() == 'w':
                     scope = 'word'
-                    grid.check_cells(cursor.current_word())
+                    checked = grid.check_cells(cursor.current_word())
                 elif group.lower() == 'p':
                     scope = 'puzzle'
-                    grid.check_cells(grid.cells)
+                    checked = grid.check_cells(grid.cells)
+                if checked is None:
+                    scope = None
 
                 if scope:
+                    autosaver.note_edit()
                     grid.send_notification("Checked {scope} for errors.".
                                            format(scope=scope))
+                elif scope is None:
+                    grid.send_notification(
+                        "Unable to reach the tournament server.")
                 else:
                     grid.send_notification("No valid input entered.")
 
@@ -1010,23 +1967,57 @@ def main():
             elif keypress == chr(7):
                 cursor.go_to_numbered_square()
 
+            # ctrl-w
+            elif keypress == chr(23) and not words:
+                grid.send_notification(
+                    "No word list loaded. Use --wordlist to load one.")
+
+            elif keypress == chr(23):
+                pattern = ''.join('?' if grid.cells[pos].is_blankish
+                                  else grid.cells[pos].entry
+                                  for pos in cursor.current_word())
+                fits = words.match(pattern, limit=term.width // 3)
+                if fits:
+                    message = "{}: {}".format(pattern, ', '.join(fits))
+                    room = term.width - grid_x - 2
+                    if len(message) > room:
+                        message = message[:room - 1].rsplit(',', 1)[0] + '…'
+                else:
+                    message = "Nothing in the word list fits {}.".format(
+                        pattern)
+                grid.send_notification(message, timeout=10)
+
             # ctrl-x
             elif keypress == chr(24):
                 confirm = grid.confirm_clear()
                 if confirm:
                     grid.send_notification("Puzzle cleared.")
-                    for pos in grid.cells:
-                        cell = grid.cells.get(pos)
-                        if cell.is_letter:
-                            cell.clear()
-                            grid.draw_cell(pos)
+                    grid.clear_cells()
                     old_word = []
                     modified_since_save = True
+                    autosaver.note_edit()
                 else:
                     grid.send_notification("Clear command canceled.")
 
+            # ctrl-u and ctrl-y
+            elif keypress in (chr(21), chr(25)) and not puzzle_complete:
+                undoing = keypress == chr(21)
+                changed = grid.undo() if undoing else grid.redo()
+                if changed:
+                    if len(changed) == 1:
+                        cursor.position = changed[0]
+                    old_word = []
+                    modified_since_save = True
+                    autosaver.note_edit()
+                else:
+                    grid.send_notification("Nothing to {}.".format(
+                        "undo" if undoing else "redo"))
 
             # ctrl-r
+            elif keypress == chr(18) and grid.locked:
+                grid.send_notification(
+                    "This puzzle's solution is locked and can't be revealed.")
+
             elif keypress == chr(18):
                 group = grid.get_notification_input(
                     "Reveal (l)etter, (w)ord, or (p)uzzle?",
@@ -1043,6 +2034,7 @@ def main():
                     grid.reveal_cells(grid.cells)
 
                 if scope:
+                    autosaver.note_edit()
                     grid.send_notification("Revealed answers for {scope}.".
                                            format(scope=scope))
                 else:
@@ -1051,7 +2043,8 @@ def main():
                 old_word = []
 
             # Letter entry
-            elif not puzzle_complete and keypress.isalnum():
+            elif (not puzzle_complete and keypress.isalnum() and
+                  journal.is_recordable(keypress.upper())):
                 if not current_cell.is_blankish:
                     overwrite_mode = True
                 current_cell.entry = keypress.upper()
@@ -1059,15 +2052,19 @@ def main():
                 if current_cell.marked_wrong:
                     current_cell.marked_wrong = False
                     current_cell.corrected = True
+                grid.cell_changed(cursor.position, journal.ENTRY)
                 modified_since_save = True
+                autosaver.note_edit()
                 cursor.advance_within_word(overwrite_mode, wrap_mode=True)
 
             # Deletion keys
             elif (not puzzle_complete and
                   keypress.name in ['KEY_BACKSPACE', 'KEY_DELETE']):
                 current_cell.clear()
+                grid.cell_changed(cursor.position, journal.CLEAR)
                 overwrite_mode = True
                 modified_since_save = True
+                autosaver.note_edit()
                 if keypress.name == 'KEY_BACKSPACE':
                     cursor.retreat_within_word(end_placement=True)
                 elif keypress.name == 'KEY_DELETE':
@@ -1143,8 +2140,17 @@ def main():
                     while not grid.cells.get(cursor.position).is_blankish:
                         cursor.retreat_perpendicular()
 
+    grid.edit_lock.release()
+
+    if grid.broadcast:
+        grid.broadcast.close()
+
     echo(term.exit_fullscreen())
 
+    if memory:
+        memory.take('at exit', grid, layout, clue_list)
+        memory.report()
+
 
 if __name__ == '__main__':
     main()
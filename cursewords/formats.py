@@ -0,0 +1,508 @@
+"""Readers for puzzle formats other than .puz.
+
+Each reader builds a puz.Puzzle, which is the model the rest of cursewords
+works with, and returns a subclass whose save() writes the solver's
+progress back into the original format.
+"""
+
+import io
+import json
+import os
+import xml.sax.handler
+
+from . import puz
+
+# ElementTree, zipfile and xml.sax.saxutils (which brings in urllib) are
+# imported by the JPZ code that uses them, so that opening a .puz file
+# doesn't pay for them.
+
+
+def read(filename):
+    """
+    Read a puzzle in any supported format, going by the file extension.
+    throws PuzzleFormatError if there's any problem with the file format.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension == '.ipuz':
+        return read_ipuz(filename)
+    if extension == '.jpz':
+        return read_jpz(filename)
+    return puz.read(filename)
+
+
+def build_puzzle(puzzle, width, height, solution, fill, markup, clues):
+    """
+    Fill in puzzle from a grid given as row-major lists, one string per
+    square ('.' for blocks), and clues as {'across': {num: text}, 'down':
+    {num: text}}. Clues are put into .puz order, so that the usual clue
+    numbering lines them up with the grid again.
+    """
+    if any(len(square) != 1 for square in solution):
+        raise puz.PuzzleFormatError('rebus squares are not supported')
+
+    puzzle.width = width
+    puzzle.height = height
+    puzzle.solution = ''.join(solution)
+    puzzle.fill = ''.join(fill)
+
+    numbering = puz.DefaultClueNumbering(puzzle.fill, [''] * (width * height),
+                                         width, height)
+    ordered = sorted([(entry['clue_index'], clues['across'].get(entry['num'], ''))
+                      for entry in numbering.across] +
+                     [(entry['clue_index'], clues['down'].get(entry['num'], ''))
+                      for entry in numbering.down])
+    puzzle.clues = [clue for _, clue in ordered]
+
+    if any(markup):
+        puzzle.markup().markup = markup
+
+    try:
+        for text in puzzle.strings() + (puzzle.solution,):
+            puzzle.encode(text)
+    except UnicodeEncodeError:
+        puzzle.version = b'2.0'
+        puzzle.fileversion = b'2.0\0'
+        puzzle.encoding = puz.ENCODING_UTF8
+
+    return puzzle
+
+
+# Solve state that a format has no field of its own for: the flags a cell
+# gets from checking and revealing, and the timer, kept as they are in a
+# .puz file's GEXT and LTIM sections. Circles belong to the puzzle rather
+# than the solve, so they're left to each format's own markup.
+SOLVE_MARKUP = (puz.GridMarkup.PreviouslyIncorrect |
+                puz.GridMarkup.Incorrect | puz.GridMarkup.Revealed)
+
+
+def solve_markup(puzzle):
+    if not puzzle.has_markup():
+        return [0] * (puzzle.width * puzzle.height)
+    return [md & SOLVE_MARKUP for md in puzzle.markup().markup]
+
+
+def timer_state(puzzle):
+    """The timer as (seconds, running) strings, or None."""
+    timer = puzzle.extensions.get(puz.Extensions.Timer)
+    if not timer:
+        return None
+    seconds, _, running = timer.decode(puz.ENCODING).partition(',')
+    return seconds, running or '1'
+
+
+def set_timer_state(puzzle, seconds, running):
+    if seconds and seconds.isdigit():
+        puzzle.extensions[puz.Extensions.Timer] = '{},{}'.format(
+            seconds, running if running in ('0', '1') else '1').encode(
+                puz.ENCODING)
+
+
+#
+# ipuz (JSON)
+#
+
+# ipuz extension fields, which other readers ignore
+IPUZ_MARKUP = 'com.github.thisisparker.cursewords:markup'
+IPUZ_TIMER = 'com.github.thisisparker.cursewords:timer'
+
+def read_ipuz(filename):
+    with open(filename, 'rb') as f:
+        data = json.loads(f.read().decode('utf-8'))
+    puzzle = IpuzPuzzle(data)
+    puzzle.parse()
+    return puzzle
+
+
+class IpuzPuzzle(puz.Puzzle):
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+
+    def parse(self):
+        data = self.data
+        if not any('crossword' in kind.lower() for kind in data.get('kind', [])):
+            raise puz.PuzzleFormatError('not an ipuz crossword')
+
+        block = data.get('block', '#')
+        empty = data.get('empty', 0)
+        width = data['dimensions']['width']
+        height = data['dimensions']['height']
+
+        self.title = data.get('title', '')
+        self.author = data.get('author', '')
+        self.copyright = data.get('copyright', '')
+        self.notes = data.get('notes', '') or data.get('intro', '')
+
+        layout = data['puzzle']
+        answers = data.get('solution') or [[None] * width] * height
+        saved = data.get('saved') or [[None] * width] * height
+
+        solution, fill, markup = [], [], []
+        for row in range(height):
+            for col in range(width):
+                cell = layout[row][col]
+                style = {}
+                if isinstance(cell, dict):
+                    style = cell.get('style') or {}
+                    cell = cell.get('cell', empty)
+
+                if cell is None or cell == block:
+                    solution.append('.')
+                    fill.append('.')
+                    markup.append(0)
+                    continue
+
+                answer = ipuz_value(answers[row][col])
+                entry = ipuz_value(saved[row][col])
+                solution.append(answer.upper() if answer else 'X')
+                fill.append(entry.upper() if entry and entry != empty else '-')
+                markup.append((puz.GridMarkup.Circled
+                               if style.get('shapebg') == 'circle' else 0) |
+                              ipuz_markup(saved[row][col]))
+
+        clues = {'across': {}, 'down': {}}
+        for direction, entries in data.get('clues', {}).items():
+            key = direction.split(':')[0].strip().lower()
+            if key not in clues:
+                continue
+            for entry in entries:
+                if isinstance(entry, dict):
+                    number, text = entry.get('number'), entry.get('clue', '')
+                elif isinstance(entry, list):
+                    number, text = entry[0], entry[1]
+                else:
+                    continue
+                try:
+                    clues[key][int(number)] = text
+                except (TypeError, ValueError):
+                    pass
+
+        build_puzzle(self, width, height, solution, fill, markup, clues)
+
+        timer = data.get(IPUZ_TIMER)
+        if isinstance(timer, dict):
+            set_timer_state(self, str(timer.get('seconds', '')),
+                            str(int(bool(timer.get('running', True)))))
+
+    def save(self, filename):
+        markup = solve_markup(self)
+        saved = []
+        for row in range(self.height):
+            line = []
+            for col in range(self.width):
+                index = row * self.width + col
+                square = self.fill[index]
+                line.append(self.data.get('block', '#') if square == '.'
+                            else ipuz_saved(square, markup[index]))
+            saved.append(line)
+        self.data['saved'] = saved
+
+        timer = timer_state(self)
+        if timer:
+            self.data[IPUZ_TIMER] = ipuz_timer(*timer)
+        puz.atomic_write(filename, json.dumps(self.data).encode('utf-8'))
+
+
+def ipuz_data(puzzle):
+    """
+    Represent any puz.Puzzle as an ipuz document, including rebus answers,
+    circled squares and the solver's saved progress.
+    """
+    width, height = puzzle.width, puzzle.height
+    numbering = puzzle.clue_numbering()
+    rebus = puzzle.rebus()
+    has_rebus = rebus.has_rebus()
+    markup = puzzle.markup().markup if puzzle.has_markup() else []
+    flags = solve_markup(puzzle)
+
+    numbers = {}
+    for entry in numbering.across + numbering.down:
+        numbers[entry['cell']] = entry['num']
+
+    layout, solution, saved = [], [], []
+    for row in range(height):
+        layout_row, solution_row, saved_row = [], [], []
+        for col in range(width):
+            index = row * width + col
+            answer = puzzle.solution[index]
+            if puz.is_blacksquare(answer):
+                layout_row.append('#')
+                solution_row.append('#')
+                saved_row.append('#')
+                continue
+
+            cell = numbers.get(index, 0)
+            if markup and markup[index] & puz.GridMarkup.Circled:
+                cell = {'cell': cell, 'style': {'shapebg': 'circle'}}
+            layout_row.append(cell)
+
+            if has_rebus and rebus.is_rebus_square(index):
+                answer = rebus.get_rebus_solution(index)
+            solution_row.append(answer)
+
+            saved_row.append(ipuz_saved(puzzle.fill[index], flags[index]))
+        layout.append(layout_row)
+        solution.append(solution_row)
+        saved.append(saved_row)
+
+    data = {
+        'version': 'http://ipuz.org/v2',
+        'kind': ['http://ipuz.org/crossword#1'],
+        'title': puzzle.title,
+        'author': puzzle.author,
+        'copyright': puzzle.copyright,
+        'notes': puzzle.notes,
+        'dimensions': {'width': width, 'height': height},
+        'block': '#',
+        'empty': 0,
+        'puzzle': layout,
+        'solution': solution,
+        'saved': saved,
+        'clues': {
+            'Across': [[entry['num'], entry['clue']]
+                       for entry in numbering.across],
+            'Down': [[entry['num'], entry['clue']]
+                     for entry in numbering.down],
+        },
+    }
+    timer = timer_state(puzzle)
+    if timer:
+        data[IPUZ_TIMER] = ipuz_timer(*timer)
+    return data
+
+
+def ipuz_value(value):
+    if isinstance(value, dict):
+        value = value.get('value')
+    return value if isinstance(value, str) else None
+
+
+def ipuz_markup(value):
+    if isinstance(value, dict) and isinstance(value.get(IPUZ_MARKUP), int):
+        return value[IPUZ_MARKUP] & SOLVE_MARKUP
+    return 0
+
+
+def ipuz_saved(entry, markup):
+    """A square of an ipuz 'saved' grid: the entry, as a value with the
+    square's flags if it has any."""
+    value = '' if entry == '-' else entry
+    if markup:
+        return {'value': value, IPUZ_MARKUP: markup}
+    return value
+
+
+def ipuz_timer(seconds, running):
+    return {'seconds': int(seconds), 'running': running == '1'}
+
+
+#
+# JPZ (Crossword Compiler XML, sometimes zipped)
+#
+
+def read_jpz(filename):
+    puzzle = JpzPuzzle()
+    with open_jpz(filename) as f:
+        puzzle.parse(f)
+    return puzzle
+
+
+def open_jpz(filename):
+    import zipfile
+
+    if zipfile.is_zipfile(filename):
+        archive = zipfile.ZipFile(filename)
+        return archive.open(archive.namelist()[0])
+    return open(filename, 'rb')
+
+
+def local_name(tag):
+    return tag.rsplit('}', 1)[-1]
+
+
+# a cell's flags as words in its solve-status attribute
+JPZ_STATUS = [('revealed', puz.GridMarkup.Revealed),
+              ('incorrect', puz.GridMarkup.Incorrect),
+              ('corrected', puz.GridMarkup.PreviouslyIncorrect)]
+
+
+def jpz_markup(status):
+    words = (status or '').split()
+    return sum(flag for word, flag in JPZ_STATUS if word in words)
+
+
+def jpz_status(markup):
+    return ' '.join(word for word, flag in JPZ_STATUS if markup & flag)
+
+
+class JpzPuzzle(puz.Puzzle):
+    def parse(self, f):
+        # iterparse hands over each element as it is completed; cells,
+        # words and clues are detached from the tree as soon as they're
+        # read, so memory stays flat no matter how large the file is.
+        import xml.etree.ElementTree as ElementTree
+
+        width = height = 0
+        cells = {}
+        clues = {'across': {}, 'down': {}}
+        direction = None
+        in_clues = False
+        metadata = {}
+        parents = []
+        timer = None
+
+        for event, elem in ElementTree.iterparse(f, events=('start', 'end')):
+            tag = local_name(elem.tag)
+            if event == 'start':
+                if tag == 'grid':
+                    width = int(elem.get('width'))
+                    height = int(elem.get('height'))
+                elif tag == 'clues':
+                    in_clues, direction = True, None
+                parents.append(elem)
+                continue
+
+            parents.pop()
+            if tag == 'cell' and elem.get('x'):
+                x, y = int(elem.get('x')) - 1, int(elem.get('y')) - 1
+                cells[(x, y)] = (elem.get('type'), elem.get('solution'),
+                                 elem.get('solve-state'),
+                                 elem.get('background-shape'),
+                                 elem.get('solve-status'))
+            elif tag == 'timer' and elem.get('seconds') is not None:
+                timer = (elem.get('seconds'), elem.get('running'))
+            elif tag == 'title' and in_clues:
+                # titles inside <clues> name the direction, not the puzzle
+                text = ''.join(elem.itertext()).lower()
+                direction = 'down' if 'down' in text else 'across'
+            elif tag == 'clue':
+                try:
+                    clues[direction or 'across'][int(elem.get('number'))] = \
+                        ''.join(elem.itertext()).strip()
+                except (TypeError, ValueError):
+                    pass
+            elif tag == 'clues':
+                in_clues = False
+            elif tag in ('title', 'creator', 'copyright', 'description'):
+                metadata.setdefault(tag, ''.join(elem.itertext()).strip())
+
+            if tag in ('cell', 'clue', 'word') and parents:
+                parents[-1].remove(elem)
+
+        if not width or not height:
+            raise puz.PuzzleFormatError('no grid found in JPZ file')
+
+        self.title = metadata.get('title', '')
+        self.author = metadata.get('creator', '')
+        self.copyright = metadata.get('copyright', '')
+        self.notes = metadata.get('description', '')
+
+        solution, fill, markup = [], [], []
+        for y in range(height):
+            for x in range(width):
+                kind, answer, entry, shape, status = cells.get(
+                    (x, y), ('block',) + (None,) * 4)
+                if kind in ('block', 'void'):
+                    solution.append('.')
+                    fill.append('.')
+                    markup.append(0)
+                    continue
+                solution.append(answer.upper() if answer else 'X')
+                fill.append(entry.upper() if entry else '-')
+                markup.append((puz.GridMarkup.Circled
+                               if shape == 'circle' else 0) |
+                              jpz_markup(status))
+
+        build_puzzle(self, width, height, solution, fill, markup, clues)
+        if timer:
+            set_timer_state(self, *timer)
+
+    def save(self, filename):
+        # Stream the original file back out, changing only the solve state
+        # of each cell and the timer, so nothing we didn't parse is lost.
+        import zipfile
+
+        out = io.BytesIO()
+        with open_jpz(filename) as f:
+            xml.sax.parse(f, JpzSolveStateWriter(out, self))
+        data = out.getvalue()
+
+        if zipfile.is_zipfile(filename):
+            with zipfile.ZipFile(filename) as archive:
+                member = archive.namelist()[0]
+            packed = io.BytesIO()
+            with zipfile.ZipFile(packed, 'w', zipfile.ZIP_DEFLATED) as archive:
+                archive.writestr(member, data)
+            data = packed.getvalue()
+
+        puz.atomic_write(filename, data)
+
+
+class JpzSolveStateWriter(xml.sax.handler.ContentHandler):
+    # Passes everything on to an XMLGenerator writing to out, with the solve
+    # state changed on the way. The timer is written as <timer seconds="..."
+    # running="..."/> at the end of the <rectangular-puzzle>, in place of
+    # any from an earlier save.
+    def __init__(self, out, puzzle):
+        from xml.sax.saxutils import XMLGenerator
+
+        super().__init__()
+        self.out = XMLGenerator(out, encoding='utf-8',
+                                short_empty_elements=True)
+        self.puzzle = puzzle
+        self.markup = solve_markup(puzzle)
+        self.timer = timer_state(puzzle)
+        self.skipping = 0
+
+    def startDocument(self):
+        self.out.startDocument()
+
+    def endDocument(self):
+        self.out.endDocument()
+
+    def startElement(self, name, attrs):
+        if self.skipping:
+            self.skipping += 1
+            return
+        tag = name.split(':')[-1]
+        if tag == 'timer' and 'seconds' in attrs:
+            self.skipping = 1
+            return
+        if tag == 'cell' and 'x' in attrs:
+            x, y = int(attrs['x']) - 1, int(attrs['y']) - 1
+            index = y * self.puzzle.width + x
+            square = self.puzzle.fill[index]
+            attrs = dict(attrs)
+            if square in '.-':
+                attrs.pop('solve-state', None)
+            else:
+                attrs['solve-state'] = square
+            status = jpz_status(self.markup[index])
+            if status:
+                attrs['solve-status'] = status
+            else:
+                attrs.pop('solve-status', None)
+        self.out.startElement(name, attrs)
+
+    def endElement(self, name):
+        if self.skipping:
+            self.skipping -= 1
+            return
+        if name.split(':')[-1] == 'rectangular-puzzle' and self.timer:
+            timer = name[:-len('rectangular-puzzle')] + 'timer'
+            seconds, running = self.timer
+            self.out.startElement(timer, {'seconds': seconds,
+                                          'running': running})
+            self.out.endElement(timer)
+        self.out.endElement(name)
+
+    def characters(self, content):
+        if not self.skipping:
+            self.out.characters(content)
+
+    def ignorableWhitespace(self, content):
+        if not self.skipping:
+            self.out.ignorableWhitespace(content)
+
+    def processingInstruction(self, target, data):
+        self.out.processingInstruction(target, data)
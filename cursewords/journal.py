@@ -0,0 +1,183 @@
+import os
+import struct
+import threading
+import time
+import zlib
+
+from . import puz
+
+# A journal is a short header identifying the puzzle, followed by
+# fixed-size records. Cell records hold the cell's complete state after the
+# change rather than the change itself, so replaying a record twice (say,
+# after a crash between a save and the compaction that follows it) is
+# harmless.
+MAGIC = b'CWJ1'
+HEADER_FORMAT = '<4s HH I'
+RECORD_FORMAT = '<B I H B'
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+
+ENTRY = 1
+CLEAR = 2
+CHECK = 3
+REVEAL = 4
+RESET = 5
+TIMER = 6
+
+
+def is_recordable(entry):
+    return len(entry) == 1 and ord(entry) <= 0xFFFF
+
+
+def entry_code(entry):
+    """A cell's entry as records hold it, in 16 bits. Puzzles with rebus
+    squares aren't opened for solving, and keys are only taken if they
+    enter a single such character, so every entry has one."""
+    if not is_recordable(entry):
+        raise ValueError('entry {!r} is not a single character'.format(entry))
+    return ord(entry)
+
+
+def pack_cells(cells, op):
+    """Records for (index, Cell) pairs, each giving the cell's current state."""
+    return b''.join(struct.pack(RECORD_FORMAT, op, index,
+                                entry_code(cell.entry), cell.markup)
+                    for index, cell in cells)
+
+
+def puzzle_header(grid):
+    return struct.pack(
+        HEADER_FORMAT, MAGIC, grid.column_count, grid.row_count,
+        zlib.crc32(grid.puzfile.solution.encode(grid.puzfile.encoding)))
+
+
+def journal_path(filename):
+    dirname, basename = os.path.split(os.path.realpath(filename))
+    return os.path.join(dirname, '.{}.journal'.format(basename))
+
+
+class Journal(threading.Thread):
+    """Append-only log of unsaved edits, written next to the puzzle file.
+
+    Records are handed to the OS as they happen, so they survive the
+    process dying; fsync is batched onto this thread so that keystrokes
+    never wait on the disk."""
+
+    def __init__(self, filename, grid, sync_interval=1):
+        self.path = journal_path(filename)
+        self.grid = grid
+        self.timer = None
+        self.sync_interval = sync_interval
+
+        self.header = puzzle_header(grid)
+
+        # records written since the last full save, kept so that compaction
+        # can carry over anything logged while the save was in progress
+        self.records = bytearray()
+        self.fd = None
+        self.dirty = False
+        self.active = True
+        self.lock = threading.Lock()
+
+        super().__init__(daemon=True)
+
+    def replay(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return 0
+
+        if data[:HEADER_SIZE] != self.header:
+            # left over from a different version of the puzzle
+            self.discard()
+            return 0
+
+        # a partial record at the end is the write a crash interrupted
+        end = len(data) - (len(data) - HEADER_SIZE) % RECORD_SIZE
+        cells = list(self.grid.cells)
+        applied = 0
+        for op, index, entry, markup in struct.iter_unpack(
+                RECORD_FORMAT, data[HEADER_SIZE:end]):
+            if op == TIMER:
+                self.grid.start_time = index
+                self.grid.timer_active = markup
+            elif index < len(cells):
+                cell = self.grid.cells[cells[index]]
+                cell.entry = chr(entry)
+                cell.apply_markup(markup)
+                applied += 1
+
+        if applied:
+            self.records[:] = data[HEADER_SIZE:end]
+        return applied
+
+    def log_cells(self, cells, op):
+        self.append(pack_cells(cells, op))
+
+    def log_timer(self):
+        if self.timer:
+            self.append(struct.pack(RECORD_FORMAT, TIMER,
+                                    int(self.timer.time_passed), 0,
+                                    int(self.timer.active)))
+
+    def append(self, record):
+        if not self.active:
+            return
+        with self.lock:
+            try:
+                if self.fd is None:
+                    self.open()
+                os.write(self.fd, record)
+            except OSError:
+                # journaling is best effort; the puzzle can still be saved
+                self.active = False
+                return
+            self.records += record
+            self.dirty = True
+
+    def open(self):
+        self.fd = os.open(self.path,
+                          os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        if os.fstat(self.fd).st_size == 0:
+            os.write(self.fd, self.header + self.records)
+
+    def mark(self):
+        """The number of records logged so far."""
+        return len(self.records) // RECORD_SIZE
+
+    def compact(self, mark):
+        """Drop the first mark records, which a full save has just made
+        redundant."""
+        with self.lock:
+            self.close()
+            del self.records[:mark * RECORD_SIZE]
+            try:
+                if self.records:
+                    puz.atomic_write(self.path, self.header + self.records)
+                else:
+                    os.unlink(self.path)
+            except OSError:
+                pass
+
+    def discard(self):
+        self.compact(self.mark())
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+            self.dirty = False
+
+    def run(self):
+        while self.active:
+            time.sleep(self.sync_interval)
+            if self.dirty:
+                self.log_timer()
+                with self.lock:
+                    self.dirty = False
+                    try:
+                        os.fsync(self.fd)
+                    except (OSError, TypeError):
+                        pass
@@ -0,0 +1,109 @@
+"""cursewords-launch: start a session in a `cursewords prefork` parent.
+
+This takes the place of `cursewords`, with the same arguments. It passes
+the terminal it's running in (its stdin, stdout and stderr), its
+arguments, working directory and environment to the parent, which forks
+the session off, then waits for it, passing on resizes and signals, and
+exits with its status. It only imports what it needs from the standard
+library, so it starts about as fast as the interpreter does. When no
+parent is listening, it runs the session itself.
+"""
+
+import array
+import os
+import signal
+import socket
+import struct
+import sys
+
+MAGIC = b'CWPF'
+
+# magic, argument count, environment size, size of what follows
+REQUEST_FORMAT = '<4s I I I'
+# magic, op, value
+REPLY_FORMAT = '<4s I i'
+
+REQUEST_SIZE = struct.calcsize(REQUEST_FORMAT)
+REPLY_SIZE = struct.calcsize(REPLY_FORMAT)
+
+STARTED = 1
+EXITED = 2
+
+FORWARDED_SIGNALS = ('SIGWINCH', 'SIGINT', 'SIGTERM', 'SIGHUP', 'SIGQUIT')
+
+
+def default_address():
+    runtime = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime:
+        return os.path.join(runtime, 'cursewords-prefork.sock')
+    return os.path.join(os.environ.get('TMPDIR') or '/tmp',
+                        'cursewords-prefork-{}.sock'.format(os.getuid()))
+
+
+def recv_exactly(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError()
+        data += chunk
+    return data
+
+
+def launch(address, args):
+    """
+    Run a session with args in the parent at address, returning its exit
+    status. throws OSError if there's no parent to run it.
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(address)
+    except OSError:
+        sock.close()
+        raise
+
+    strings = [os.getcwd()] + args + ['{}={}'.format(key, value)
+                                      for key, value in os.environ.items()]
+    payload = b''.join(os.fsencode(s) + b'\0' for s in strings)
+    fds = array.array('i', [0, 1, 2])
+    sock.sendmsg([struct.pack(REQUEST_FORMAT, MAGIC, len(args),
+                              len(os.environ), len(payload))],
+                 [(socket.SOL_SOCKET, socket.SCM_RIGHTS, fds)])
+    sock.sendall(payload)
+
+    try:
+        _, op, pid = struct.unpack(REPLY_FORMAT,
+                                   recv_exactly(sock, REPLY_SIZE))
+        if op != STARTED:
+            return 1
+
+        # The terminal's signals come here, to the foreground process; the
+        # session gets them second hand.
+        def forward(signum, frame):
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
+        for name in FORWARDED_SIGNALS:
+            signal.signal(getattr(signal, name), forward)
+
+        _, op, status = struct.unpack(REPLY_FORMAT,
+                                      recv_exactly(sock, REPLY_SIZE))
+        return status if op == EXITED else 1
+    except EOFError:
+        return 1
+    finally:
+        sock.close()
+
+
+def main():
+    args = sys.argv[1:]
+    try:
+        status = launch(os.environ.get('CURSEWORDS_PREFORK') or
+                        default_address(), args)
+    except OSError:
+        from .cursewords import main
+        sys.argv = ['cursewords'] + args
+        main()
+        return
+    sys.exit(status)
@@ -0,0 +1,287 @@
+"""Memory accounting for cursewords sessions.
+
+`cursewords --memstats PUZfile` traces allocations while the session runs
+and, once it ends, reports what each part of it holds: the puzzle file as
+parsed, the grid's cells, word maps and clue numbering, the rendering
+caches and the undo log and journal. Sizes are measured by walking each
+part's objects after the puzzle is loaded and again at exit, and
+tracemalloc attributes what was allocated to the modules that allocated it.
+
+`cursewords memstats` is a benchmark: it sets up a session, without
+drawing it, for generated puzzles of a range of sizes (or for given puzzle
+files), each in a fresh process, and reports the peak RSS of each.
+"""
+
+import argparse
+import collections
+import concurrent.futures
+import gc
+import io
+import multiprocessing
+import os
+import random
+import string
+import sys
+import tempfile
+import tracemalloc
+import types
+
+try:
+    import resource
+except ImportError:
+    # Windows has no getrusage, so no peak RSS to report
+    resource = None
+
+from . import formats
+from . import puz
+
+# never walked into: shared by everything, or not data at all
+OPAQUE = (type, types.ModuleType, types.FunctionType, types.MethodType,
+          types.BuiltinFunctionType, types.CodeType, types.FrameType)
+
+SIZES = [15, 21, 25, 50, 100, 255]
+
+
+def deep_size(obj, seen):
+    """Bytes held by obj and everything it refers to that isn't in seen
+    yet. Adds what it counts to seen, so that objects shared between the
+    parts of a session are counted once, against the first."""
+    # A level at a time, so that the walk itself is mostly done in C; it
+    # runs with tracemalloc on, which makes every allocation in Python
+    # code costly. gc.get_referents also sees attributes kept inline
+    # without making instances grow a __dict__ just to be measured.
+    size = 0
+    objects = [obj]
+    while objects:
+        level = {id(o): o for o in objects}
+        new = level.keys() - seen
+        seen.update(new)
+        objects = [level[key] for key in new
+                   if not isinstance(level[key], OPAQUE)]
+        size += sum(map(sys.getsizeof, objects))
+        objects = gc.get_referents(*objects)
+    return size
+
+
+def parts(grid, layout=None, clue_list=None):
+    """(name, objects) for each part of a session. Objects shared between
+    parts count against the first of them, so the grid's parts, which are
+    built from the puzzle's strings, come after those."""
+    puzzle = grid.puzfile
+    return [
+        ('file sections', [puzzle.preamble, puzzle.postscript,
+                           puzzle.extensions]),
+        ('puzzle strings', [puzzle.solution, puzzle.fill, puzzle.clues,
+                            puzzle.title, puzzle.author, puzzle.copyright,
+                            puzzle.notes]),
+        ('cells', grid.cells),
+        ('word maps', [grid.words, grid.word_at, grid.spaces]),
+        ('clue numbering', grid.clues),
+        ('completion check', [grid.unfinished_cells, grid.answer_cksum]),
+        ('rendering', [layout, clue_list]),
+        ('undo log', grid.undo_log),
+        ('journal', grid.journal.records if grid.journal else None),
+        ('puzzle, other', puzzle),
+    ]
+
+
+def measure(grid, layout=None, clue_list=None):
+    """{part: bytes} for the session around grid."""
+    # The terminal and the grid itself are reachable from the rendering
+    # objects, but belong to no part.
+    seen = set([id(grid), id(grid.term)])
+    return collections.OrderedDict(
+        (name, deep_size(objects, seen))
+        for name, objects in parts(grid, layout, clue_list))
+
+
+def peak_rss():
+    """Peak resident set size of this process, in bytes, or 0 where it
+    can't be measured."""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes everywhere but macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def kilobytes(size):
+    return '{:.1f} KB'.format(size / 1024)
+
+
+class MemStats:
+    """Measurements of a session at the points it's asked to take them,
+    reported together at the end."""
+    def __init__(self, frames=1):
+        tracemalloc.start(frames)
+        self.measurements = []
+        self.traced_peak = 0
+
+    def take(self, label, grid, layout=None, clue_list=None):
+        # the snapshot comes first, so that walking the session's objects
+        # doesn't count against it
+        snapshot = tracemalloc.take_snapshot()
+        traced, traced_peak = tracemalloc.get_traced_memory()
+        self.traced_peak = max(self.traced_peak, traced_peak)
+        measurement = {
+            'label': label,
+            'traced': traced,
+            'traced peak': self.traced_peak,
+            'peak rss': peak_rss(),
+            'modules': collections.Counter(),
+        }
+        for stat in snapshot.statistics('filename'):
+            measurement['modules'][
+                module_name(stat.traceback[0].filename)] += stat.size
+        del snapshot
+        measurement['parts'] = measure(grid, layout, clue_list)
+        self.measurements.append(measurement)
+        # nor should the measuring show up in the next one's peak
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def report(self, f=None):
+        f = f or sys.stderr
+        if not self.measurements:
+            return
+        labels = [m['label'] for m in self.measurements]
+        line = '{:<28}' + '{:>16}' * len(labels)
+
+        print(line.format('objects held', *labels), file=f)
+        for name in self.measurements[0]['parts']:
+            print(line.format('  ' + name, *(
+                kilobytes(m['parts'][name]) for m in self.measurements)),
+                  file=f)
+        print(line.format('  total', *(
+            kilobytes(sum(m['parts'].values())) for m in self.measurements)),
+              file=f)
+
+        print(line.format('allocated by', *labels), file=f)
+        modules = self.measurements[-1]['modules']
+        for name, _ in modules.most_common(10):
+            print(line.format('  ' + name, *(
+                kilobytes(m['modules'][name]) for m in self.measurements)),
+                  file=f)
+
+        for key in ('traced', 'traced peak', 'peak rss'):
+            print(line.format(key, *(
+                kilobytes(m[key]) for m in self.measurements)), file=f)
+
+
+def module_name(filename):
+    """A short name for the module a traced allocation came from."""
+    parts = filename.split(os.sep)
+    for package in ('cursewords', 'blessed'):
+        if package in parts[:-1]:
+            return '/'.join(parts[len(parts) - 1 - parts[::-1].index(package):])
+    return os.path.basename(filename)
+
+
+def generate(size, seed=0):
+    """A size x size puzzle, about a sixth black squares, with clues of a
+    typical length."""
+    rng = random.Random(seed)
+    solution = ['.' if rng.random() < 1 / 6 else
+                rng.choice(string.ascii_uppercase)
+                for _ in range(size * size)]
+    fill = ['.' if c == '.' else '-' for c in solution]
+    numbering = puz.DefaultClueNumbering(''.join(fill),
+                                         [''] * (size * size), size, size)
+    words = ['hint', 'partner', 'capital', 'old', 'kind', 'of', 'tree',
+             'sound', 'a', 'bit', 'French', 'article', 'pressed', 'for']
+    clues = dict((direction, dict(
+        (entry['num'], ' '.join(rng.choice(words) for _ in range(6)))
+        for entry in getattr(numbering, direction)))
+                 for direction in ('across', 'down'))
+    puzzle = puz.Puzzle()
+    puzzle.title = 'Generated {0}x{0}'.format(size)
+    puzzle.author = 'cursewords memstats'
+    return formats.build_puzzle(puzzle, size, size, solution, fill,
+                                [0] * (size * size), clues)
+
+
+def session_peak(filename):
+    """Worker: set up a session for filename as cursewords would, short of
+    drawing it, show every clue once, and report the peak RSS and what
+    the session holds."""
+    from blessed import Terminal
+    from . import cursewords
+    from . import undo
+
+    baseline = peak_rss()
+    term = Terminal(stream=io.StringIO(), force_styling=True)
+    grid = cursewords.Grid(2, 4, term)
+    grid.load(formats.read(filename))
+    layout = cursewords.Layout(term, grid, 'cursewords')
+    layout.apply(grid, grid.words['across'][0][0])
+    clue_list = layout.make_clue_list(grid)
+    grid.undo_log = undo.UndoLog(grid.cells.values())
+    # the completion check's state is built the first time it's asked for,
+    # as it is once a session starts
+    grid.is_complete
+
+    cursor = cursewords.Cursor(grid.words['across'][0][0], 'across', grid)
+    for direction in ('across', 'down'):
+        cursor.direction = direction
+        for word in grid.words[direction]:
+            cursor.position = word[0]
+            layout.clue_text(grid, cursor)
+            if clue_list:
+                for section in clue_list.sections:
+                    if section.direction == direction:
+                        section.wrap(grid.word_at[direction][word[0]])
+
+    return (grid.column_count, grid.row_count,
+            len(grid.clues['across']) + len(grid.clues['down']),
+            baseline, peak_rss(), sum(measure(grid, layout, clue_list).values()))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords memstats',
+        description="""Report the peak RSS of a session, set up without
+        drawing it, for puzzles of a range of sizes. Each puzzle is loaded
+        in a fresh process.""")
+    parser.add_argument('filenames', metavar='PUZfile', nargs='*',
+                        help="""puzzles to measure (default: generated
+                        puzzles of the sizes given by --sizes)""")
+    parser.add_argument('--sizes', metavar='N', type=int, nargs='+',
+                        default=SIZES,
+                        help="""sizes of the square puzzles to generate
+                        (default: {})""".format(' '.join(map(str, SIZES))))
+
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory() as tempdir:
+        filenames = args.filenames
+        if not filenames:
+            for size in args.sizes:
+                if not 2 <= size <= 255:
+                    sys.exit("Puzzles must be 2 to 255 squares wide.")
+                filename = os.path.join(tempdir, '{}.puz'.format(size))
+                generate(size).save(filename)
+                filenames.append(filename)
+
+        line = '{:<24}{:>9}{:>8}{:>12}{:>14}{:>14}{:>12}'
+        print(line.format('puzzle', 'size', 'clues', 'file', 'peak RSS',
+                          'over imports', 'held'))
+        context = multiprocessing.get_context('spawn')
+        for filename in filenames:
+            with concurrent.futures.ProcessPoolExecutor(
+                    1, mp_context=context) as pool:
+                try:
+                    (width, height, clues, baseline, peak,
+                     held) = pool.submit(session_peak, filename).result()
+                except Exception:
+                    print("Unable to load {} as a puzzle.".format(filename),
+                          file=sys.stderr)
+                    continue
+            name = os.path.basename(filename)
+            print(line.format(
+                name if len(name) <= 22 else name[:21] + '…',
+                '{}x{}'.format(width, height), clues,
+                kilobytes(os.path.getsize(filename)),
+                '{:.1f} MB'.format(peak / 2**20),
+                '{:.1f} MB'.format((peak - baseline) / 2**20),
+                kilobytes(held)))
+    return 0
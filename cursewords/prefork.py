@@ -0,0 +1,217 @@
+"""Pre-forking launcher: sessions forked from a warmed-up parent.
+
+`cursewords prefork` starts a long-lived parent that imports everything a
+session needs and parses any --preload puzzles, then freezes its heap so
+the garbage collector never writes to those pages. Sessions started with
+cursewords-launch (see launch.py) are forked from it, run on the
+launcher's terminal and share the parent's pages copy-on-write, so they
+paint their first frame without importing or parsing anything.
+"""
+
+import argparse
+import array
+import gc
+import os
+import random
+import signal
+import socket
+import struct
+import sys
+import traceback
+
+from . import launch
+
+# puzzles parsed by the parent, by real path, for the session to pick up
+preloaded = {}
+
+
+def take_preloaded(filename):
+    """The parent's parse of filename, if it preloaded the file and it
+    hasn't changed since."""
+    path = os.path.realpath(filename)
+    if path not in preloaded:
+        return None
+    stat, puzzle = preloaded.pop(path)
+    try:
+        current = os.stat(path)
+    except OSError:
+        return None
+    if (current.st_size, current.st_mtime_ns) != stat:
+        return None
+    return puzzle
+
+
+class PreforkServer:
+    def __init__(self, address, preload=()):
+        # Everything a session imports is imported here, once.
+        from . import cursewords
+        from . import formats
+        self.main = cursewords.main
+
+        for filename in preload:
+            stat = os.stat(filename)
+            preloaded[os.path.realpath(filename)] = (
+                (stat.st_size, stat.st_mtime_ns), formats.read(filename))
+
+        self.address = address
+        self.listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.listener.bind(address)
+        os.chmod(address, 0o600)
+        self.listener.listen(64)
+
+        # Nothing allocated so far will be collected, so leave it out of
+        # collections, which would otherwise touch every page of it and
+        # unshare them from the children.
+        gc.collect()
+        if hasattr(gc, 'freeze'):
+            gc.freeze()
+
+    def serve(self):
+        signal.signal(signal.SIGCHLD, self.reap)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit())
+        try:
+            while True:
+                conn, _ = self.listener.accept()
+                try:
+                    self.accept(conn)
+                except (OSError, EOFError, ValueError, struct.error):
+                    pass
+                finally:
+                    conn.close()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.listener.close()
+            try:
+                os.unlink(self.address)
+            except OSError:
+                pass
+
+    def reap(self, signum, frame):
+        try:
+            while os.waitpid(-1, os.WNOHANG)[0]:
+                pass
+        except ChildProcessError:
+            pass
+
+    def accept(self, conn):
+        if hasattr(socket, 'SO_PEERCRED'):
+            _, uid, _ = struct.unpack('3i', conn.getsockopt(
+                socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i')))
+            if uid != os.getuid():
+                return
+
+        fds = array.array('i')
+        data, ancdata, _, _ = conn.recvmsg(
+            launch.REQUEST_SIZE, socket.CMSG_SPACE(3 * fds.itemsize))
+        for level, kind, cmsg_data in ancdata:
+            if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+                fds.frombytes(cmsg_data[:len(cmsg_data) -
+                                        len(cmsg_data) % fds.itemsize])
+        try:
+            magic, argc, envc, size = struct.unpack(launch.REQUEST_FORMAT,
+                                                    data)
+            if magic != launch.MAGIC or len(fds) != 3:
+                return
+            strings = [os.fsdecode(s) for s in
+                       launch.recv_exactly(conn, size).split(b'\0')[:-1]]
+            if len(strings) != 1 + argc + envc:
+                return
+
+            sys.stdout.flush()
+            sys.stderr.flush()
+            # The child waits for this end of the pipe to close before it
+            # reports that it has exited, so that the launcher hears
+            # STARTED first.
+            started, sent = os.pipe()
+            try:
+                pid = os.fork()
+            except OSError:
+                os.close(started)
+                os.close(sent)
+                raise
+            if pid == 0:
+                os.close(sent)
+                self.run_session(conn, list(fds), started, strings[0],
+                                 strings[1:1 + argc], strings[1 + argc:])
+            os.close(started)
+            try:
+                conn.sendall(struct.pack(launch.REPLY_FORMAT, launch.MAGIC,
+                                         launch.STARTED, pid))
+            finally:
+                os.close(sent)
+        finally:
+            for fd in fds:
+                os.close(fd)
+
+    def run_session(self, conn, fds, started, cwd, args, environ):
+        # In the child. Never returns.
+        status = 1
+        try:
+            # a session of its own, so the terminal it was handed is never
+            # mistaken for one it has to wait its turn on
+            os.setsid()
+            for signum in (signal.SIGCHLD, signal.SIGTERM):
+                signal.signal(signum, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            self.listener.close()
+
+            for target, fd in enumerate(fds):
+                os.dup2(fd, target)
+                os.close(fd)
+            os.chdir(cwd)
+            os.environ.clear()
+            os.environ.update(entry.split('=', 1) for entry in environ
+                              if '=' in entry)
+            sys.argv = ['cursewords'] + args
+            random.seed()
+
+            try:
+                self.main()
+                status = 0
+            except SystemExit as exit:
+                if exit.code is None or isinstance(exit.code, int):
+                    status = exit.code or 0
+                else:
+                    print(exit.code, file=sys.stderr)
+            except BaseException:
+                traceback.print_exc()
+        finally:
+            try:
+                sys.stdout.flush()
+                sys.stderr.flush()
+                os.read(started, 1)
+                conn.sendall(struct.pack(launch.REPLY_FORMAT, launch.MAGIC,
+                                         launch.EXITED, status))
+            finally:
+                os._exit(status)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords prefork',
+        description="""Keep a warmed-up cursewords ready to start sessions.
+        Run cursewords-launch instead of cursewords to start sessions from
+        it.""")
+    parser.add_argument('address', metavar='ADDRESS', nargs='?',
+                        default=os.environ.get('CURSEWORDS_PREFORK') or
+                        launch.default_address(),
+                        help="""path of the Unix socket to listen on
+                        (default: $CURSEWORDS_PREFORK, or {})""".format(
+                            launch.default_address()))
+    parser.add_argument('--preload', metavar='PUZfile', nargs='+',
+                        default=[],
+                        help="""puzzles to parse ahead of time, for
+                        sessions that open them""")
+
+    args = parser.parse_args(argv)
+
+    try:
+        server = PreforkServer(args.address, args.preload)
+    except OSError as err:
+        sys.exit("Unable to listen on {}: {}".format(args.address, err))
+    except Exception:
+        sys.exit("Unable to parse the puzzles to preload.")
+
+    server.serve()
+    return 0
@@ -1,8 +1,11 @@
 ﻿# pylint: skip-file
 
 import functools
+import io
 import operator
 import math
+import os
+import re
 import string
 import struct
 import sys
@@ -44,6 +47,14 @@ ENCODING_ERRORS = 'strict'  # raises an exception for bad chars; change to 'repl
 
 ACROSSDOWN = b'ACROSS&DOWN'
 
+# the undo file kept while a save patches a puzzle in place: this, then
+# an offset and length and the bytes that were there for each patch
+UNDO_MAGIC = b'PUZUNDO1'
+UNDO_RECORD_FORMAT = '<I I'
+
+# most systems take at least this many buffers in one writev
+IOV_MAX = 1024
+
 BLACKSQUARE = '.'
 BLACKSQUARE2 = ':'
 
@@ -105,8 +116,11 @@ def read(filename):
     Read a .puz file and return the Puzzle object.
     throws PuzzleFormatError if there's any problem with the file format.
     """
+    recover(filename)
     with open(filename, 'rb') as f:
-        return load(f.read())
+        puz = load(f.read())
+        puz.remember_file(filename, os.fstat(f.fileno()))
+        return puz
 
 
 def load(data):
@@ -119,6 +133,94 @@ def load(data):
     return puz
 
 
+def atomic_write(filename, data):
+    """
+    Write data to filename so that a crash at any point leaves either the
+    old file or the new one on disk, never a truncated mix of the two.
+    data is bytes, or a function that writes to the binary file it's given.
+    """
+    import tempfile
+
+    filename = os.path.realpath(filename)
+    dirname, basename = os.path.split(filename)
+    fd, tmpname = tempfile.mkstemp(prefix='.' + basename + '.',
+                                   suffix='.tmp', dir=dirname)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if callable(data):
+                data(f)
+            else:
+                f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        try:
+            mode = os.stat(filename).st_mode & 0o7777
+        except OSError:
+            # mkstemp makes the file private; a new file gets the mode it
+            # would have had from open()
+            umask = os.umask(0)
+            os.umask(umask)
+            mode = 0o666 & ~umask
+        try:
+            os.chmod(tmpname, mode)
+        except OSError:
+            pass
+        os.replace(tmpname, filename)
+    except BaseException:
+        try:
+            os.unlink(tmpname)
+        except OSError:
+            pass
+        raise
+
+    # make the rename itself durable; not every platform can open a directory
+    try:
+        dir_fd = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(dir_fd)
+    except OSError:
+        pass
+    finally:
+        os.close(dir_fd)
+
+
+def undo_path(filename):
+    dirname, basename = os.path.split(os.path.realpath(filename))
+    return os.path.join(dirname, '.{}.undo'.format(basename))
+
+
+def recover(filename):
+    """
+    Roll filename back to how it was before a save that patched it in place
+    was interrupted, if one was. The bytes each patch overwrote are kept in
+    an undo file until the patched file has been synced, so its presence
+    means the file on disk may be a mix of the two versions.
+    """
+    path = undo_path(filename)
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError:
+        return False
+    # the undo file is written atomically, so it's complete if it's there
+    if data.startswith(UNDO_MAGIC):
+        with open(filename, 'r+b') as f:
+            pos = len(UNDO_MAGIC)
+            while pos < len(data):
+                offset, length = struct.unpack_from(UNDO_RECORD_FORMAT, data,
+                                                    pos)
+                pos += struct.calcsize(UNDO_RECORD_FORMAT)
+                f.seek(offset)
+                f.write(data[pos:pos + length])
+                pos += length
+            f.flush()
+            os.fsync(f.fileno())
+    os.unlink(path)
+    return True
+
+
 class PuzzleFormatError(Exception):
     """
     Indicates a format error in the .puz file. May be thrown due to
@@ -158,6 +260,9 @@ class Puzzle:
         self.puzzletype = PuzzleType.Normal
         self.solution_state = SolutionState.Unlocked
         self.helpers = {}  # add-ons like Rebus and Markup
+        # byte offsets of the sections in the file we were read from, so
+        # that saves can patch just the parts that changed
+        self._layout = None
 
     def load(self, data):
         s = PuzzleBuffer(data)
@@ -196,15 +301,15 @@ class Puzzle:
         self.solution = s.read(self.width * self.height).decode(self.encoding)
         self.fill = s.read(self.width * self.height).decode(self.encoding)
 
-        self.title = s.read_string()
-        self.author = s.read_string()
-        self.copyright = s.read_string()
-
-        self.clues = [s.read_string() for i in range(0, numclues)]
-        self.notes = s.read_string()
+        strings = s.read_strings(numclues + 4)
+        self.title, self.author, self.copyright = strings[:3]
+        self.clues = strings[3:-1]
+        self.notes = strings[-1]
 
+        ext_offsets = []
         ext_cksum = {}
         while s.can_unpack(EXTENSION_HEADER_FORMAT):
+            ext_offsets.append(s.pos)
             code, length, cksum = s.unpack(EXTENSION_HEADER_FORMAT)
             ext_cksum[code] = cksum
             # extension data is represented as a null-terminated string,
@@ -231,66 +336,216 @@ class Puzzle:
                     'extension %s checksum does not match' % code
                 )
 
+        extensions = [(code, offset, self.extensions[code])
+                      for code, offset in zip(self._extensions_order,
+                                              ext_offsets)]
+        self._layout = self.layout(extensions)
+
     def save(self, filename):
-        puzzle_bytes = self.tobytes()
-        with open(filename, 'wb') as f:
-            f.write(puzzle_bytes)
+        """
+        Save the puzzle to filename. If the puzzle was read from that same
+        file and only the fill, checksums or same-sized extensions have
+        changed, just those bytes are rewritten in place, with what they
+        replace kept aside until they're on disk so that read() can roll
+        back a save that was cut short; otherwise the whole file is
+        replaced atomically.
+        """
+        if self.save_in_place(filename):
+            return
+
+        head, extensions, postscript = self.sections()
+        atomic_write(filename, lambda f: write_sections(
+            f, head + [section for _, _, section in extensions] +
+            [postscript]))
+
+        offset = sum(len(section) for section in head)
+        layout_extensions = []
+        for code, ext, section in extensions:
+            layout_extensions.append((code, offset, ext))
+            offset += len(section)
+        self._layout = self.layout(layout_extensions)
+        self.remember_file(filename, os.stat(filename))
+
+    def layout(self, extensions):
+        return {
+            'preamble': self.preamble,
+            'postscript': self.postscript,
+            'size': (self.width, self.height),
+            'strings': self.strings(),
+            'solution': self.solution,
+            'extensions': extensions,
+            'file': None,
+        }
+
+    def remember_file(self, filename, stat):
+        if self._layout:
+            self._layout['file'] = (os.path.realpath(filename),
+                                    stat.st_size, stat.st_mtime_ns)
+
+    def strings(self):
+        return (self.title, self.author, self.copyright) + \
+            tuple(self.clues) + (self.notes,)
+
+    def save_in_place(self, filename):
+        layout = self._layout
+        if not layout or not layout['file']:
+            return False
+        if layout['file'][0] != os.path.realpath(filename):
+            return False
 
-    def tobytes(self):
-        s = PuzzleBuffer(encoding=self.encoding)
-        # commit any changes from helpers
-        for h in self.helpers.values():
-            if 'save' in dir(h):
-                h.save()
+        self.commit_helpers()
 
-        # include any preamble text we might have found on read
-        s.write(self.preamble)
+        if (self.preamble != layout['preamble'] or
+                self.postscript != layout['postscript'] or
+                (self.width, self.height) != layout['size'] or
+                self.strings() != layout['strings']):
+            return False
 
-        s.pack(HEADER_FORMAT,
-               self.global_cksum(), ACROSSDOWN,
-               self.header_cksum(), self.magic_cksum(),
-               self.fileversion, self.unk1, self.scrambled_cksum,
-               self.unk2, self.width, self.height,
-               len(self.clues), self.puzzletype, self.solution_state)
+        extensions = self.ordered_extensions()
+        if ([(code, len(data)) for code, data in extensions] !=
+                [(code, len(data)) for code, _, data in layout['extensions']]):
+            return False
 
-        s.write(self.encode(self.solution))
-        s.write(self.encode(self.fill))
+        cells = self.width * self.height
+        solution = self.encode(self.solution)
+        fill = self.encode(self.fill)
+        if len(solution) != cells or len(fill) != cells:
+            return False
 
-        s.write_string(self.title)
-        s.write_string(self.author)
-        s.write_string(self.copyright)
+        header_offset = len(self.preamble)
+        solution_offset = header_offset + struct.calcsize(HEADER_FORMAT)
+        writes = []
+        if self.solution != layout['solution']:
+            writes.append((solution_offset, solution))
+        writes.append((solution_offset + cells, fill))
+        for (code, data), (_, offset, old) in zip(extensions,
+                                                  layout['extensions']):
+            if data != old:
+                writes.append((offset,
+                               struct.pack(EXTENSION_HEADER_FORMAT, code,
+                                           len(data), data_cksum(data)) +
+                               data))
+        writes.append((header_offset, self.header_bytes()))
 
-        for clue in self.clues:
-            s.write_string(clue)
+        try:
+            with open(filename, 'r+b') as f:
+                stat = os.fstat(f.fileno())
+                if (stat.st_size, stat.st_mtime_ns) != layout['file'][1:]:
+                    # changed on disk since we last read or wrote it
+                    return False
+                # What's about to be overwritten is saved first, so that
+                # recover() can roll back a save that doesn't finish.
+                undo = [UNDO_MAGIC]
+                for offset, data in writes:
+                    f.seek(offset)
+                    undo.append(struct.pack(UNDO_RECORD_FORMAT, offset,
+                                            len(data)) + f.read(len(data)))
+                atomic_write(undo_path(filename), b''.join(undo))
+        except OSError:
+            return False
 
-        s.write_string(self.notes)
+        try:
+            with open(filename, 'r+b') as f:
+                for offset, data in writes:
+                    f.seek(offset)
+                    f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+                stat = os.fstat(f.fileno())
+        except OSError:
+            # put things back before the whole file is written instead,
+            # which the undo file mustn't outlive
+            recover(filename)
+            return False
+        try:
+            os.unlink(undo_path(filename))
+        except OSError:
+            pass
+
+        layout['solution'] = self.solution
+        layout['extensions'] = [
+            (code, offset, data) for (code, data), (_, offset, _) in
+            zip(extensions, layout['extensions'])]
+        self.remember_file(filename, stat)
+        return True
 
+    def commit_helpers(self):
+        for h in self.helpers.values():
+            if 'save' in dir(h):
+                h.save()
+
+    def ordered_extensions(self):
         # do a bit of extra work here to ensure extensions round-trip in the
         # order they were read. this makes verification easier. But allow
         # for the possibility that extensions were added or removed from
         # self.extensions
         ext = dict(self.extensions)
+        ordered = []
         for code in self._extensions_order:
             data = ext.pop(code, None)
             if data:
-                s.pack(EXTENSION_HEADER_FORMAT, code,
-                       len(data), data_cksum(data))
-                s.write(data + b'\0')
+                ordered.append((code, data))
+
+        ordered.extend(ext.items())
+        return ordered
 
-        for code, data in ext.items():
-            s.pack(EXTENSION_HEADER_FORMAT, code, len(data), data_cksum(data))
-            s.write(data + b'\0')
+    def header_bytes(self):
+        return struct.pack(HEADER_FORMAT,
+                           self.global_cksum(), ACROSSDOWN,
+                           self.header_cksum(), self.magic_cksum(),
+                           self.fileversion, self.unk1, self.scrambled_cksum,
+                           self.unk2, self.width, self.height,
+                           len(self.clues), self.puzzletype, self.solution_state)
+
+    def sections(self):
+        """
+        The file as (head, extensions, postscript): head is a list of byte
+        strings for everything up to the extensions, extensions a list of
+        (code, data, section) for each one, and postscript bytes. The
+        checksums in the header are worked out first, then each field is
+        encoded once, and all the strings together.
+        """
+        # commit any changes from helpers
+        self.commit_helpers()
+
+        strings = '\0'.join(s or '' for s in self.strings()) + '\0'
+        head = [
+            # include any preamble text we might have found on read
+            self.preamble,
+            self.header_bytes(),
+            self.encode(self.solution),
+            self.encode(self.fill),
+            self.encode(strings),
+        ]
+
+        extensions = [
+            (code, data, struct.pack(EXTENSION_HEADER_FORMAT, code, len(data),
+                                     data_cksum(data)) + data + b'\0')
+            for code, data in self.ordered_extensions()]
 
         # postscript is initialized, read, and stored as bytes. In case it is
         # overwritten as a string, this try/except converts it back.
         try:
-            postscript_bytes = self.encode(self.postscript)
+            postscript = self.encode(self.postscript)
         except AttributeError:
-            postscript_bytes = self.postscript
+            postscript = self.postscript
+
+        return head, extensions, postscript
 
-        s.write(postscript_bytes)
+    def write(self, f):
+        """
+        Write the puzzle to f, a binary file-like object or a socket,
+        without building the whole file in memory first. Returns the
+        number of bytes written.
+        """
+        head, extensions, postscript = self.sections()
+        return write_sections(
+            f, head + [section for _, _, section in extensions] + [postscript])
 
-        return s.tobytes()
+    def tobytes(self):
+        head, extensions, postscript = self.sections()
+        return b''.join(head + [section for _, _, section in extensions] +
+                        [postscript])
 
     def encode(self, s):
         return s.encode(self.encoding, ENCODING_ERRORS)
@@ -314,8 +569,10 @@ class Puzzle:
         return self.helpers.setdefault('markup', Markup(self))
 
     def clue_numbering(self):
-        numbering = DefaultClueNumbering(self.fill, self.clues, self.width, self.height)
-        return self.helpers.setdefault('clues', numbering)
+        if 'clues' not in self.helpers:
+            self.helpers['clues'] = DefaultClueNumbering(self.fill, self.clues,
+                                                         self.width, self.height)
+        return self.helpers['clues']
 
     def blacksquare(self):
         return BLACKSQUARE2 if self.puzzletype == PuzzleType.Diagramless else BLACKSQUARE
@@ -410,6 +667,44 @@ class Puzzle:
         return cksum_magic
 
 
+def write_sections(f, sections):
+    """
+    Write byte strings to f in order, returning how many bytes that was.
+    Sockets and plain files get them in as few vectored writes as they'll
+    take; anything else, like a compressed stream, gets one write each.
+    """
+    sections = [memoryview(section) for section in sections if section]
+    total = sum(len(section) for section in sections)
+
+    if hasattr(f, 'sendmsg'):
+        # a socket
+        send = f.sendmsg
+    elif (hasattr(os, 'writev') and
+          isinstance(f, (io.FileIO, io.BufferedWriter, io.BufferedRandom))):
+        try:
+            fd = f.fileno()
+        except (OSError, io.UnsupportedOperation):
+            fd = None
+        # anything already buffered has to go out first
+        f.flush()
+        send = functools.partial(os.writev, fd) if fd is not None else None
+    else:
+        send = None
+
+    if send is None:
+        for section in sections:
+            f.write(section)
+        return total
+
+    while sections:
+        written = send(sections[:IOV_MAX])
+        while sections and written >= len(sections[0]):
+            written -= len(sections.pop(0))
+        if written:
+            sections[0] = sections[0][written:]
+    return total
+
+
 class PuzzleBuffer:
     """PuzzleBuffer class
     wraps a data buffer ('' or []) and provides .puz-specific methods for
@@ -439,6 +734,23 @@ class PuzzleBuffer:
     def read_string(self):
         return self.read_until(b'\0')
 
+    def read_strings(self, count):
+        """
+        Read count null-terminated strings in one go: the region holding
+        them is found with a single split and decoded at once, since a NUL
+        byte is a NUL character in both of the encodings .puz files use.
+        Strings missing from a truncated file come back empty.
+        """
+        start = self.pos
+        parts = self.data[start:].split(b'\0', count)
+        if len(parts) > count:
+            end = len(self.data) - len(parts[count]) - 1
+            self.pos = end + 1
+        else:
+            end = self.pos = self.length()
+        strings = str(self.data[start:end], self.encoding).split('\0')
+        return strings + [''] * (count - len(strings))
+
     def read_until(self, c):
         start = self.pos
         self.seek_to(c, 1)  # read past
@@ -491,32 +803,43 @@ class DefaultClueNumbering:
         self.width = width
         self.height = height
 
+        # run lengths of white squares starting at each cell, filled in
+        # back to front so each cell is visited once per direction
+        size = len(grid)
+        white = [not is_blacksquare(c) for c in grid]
+        across_len = [0] * (size + 1)
+        down_len = [0] * (size + width)
+        for i in range(size - 1, -1, -1):
+            if white[i]:
+                across_len[i] = 1 if (i + 1) % width == 0 else across_len[i + 1] + 1
+                down_len[i] = down_len[i + width] + 1
+
         # compute across & down
         a = []
         d = []
         c = 0
         n = 1
-        for i in range(0, len(grid)):
-            if not is_blacksquare(grid[i]):
+        for i in range(0, size):
+            if white[i]:
                 lastc = c
-                is_across = self.col(i) == 0 or is_blacksquare(grid[i - 1])
-                if is_across and self.len_across(i) > 1:
+                is_across = i % width == 0 or not white[i - 1]
+                if is_across and across_len[i] > 1:
                     a.append({
                         'num': n,
                         'clue': clues[c],
                         'clue_index': c,
                         'cell': i,
-                        'len': self.len_across(i)
+                        'len': across_len[i]
                     })
                     c += 1
-                is_down = self.row(i) == 0 or is_blacksquare(grid[i - width])
-                if is_down and self.len_down(i) > 1:
+                is_down = i < width or not white[i - width]
+                if is_down and down_len[i] > 1:
                     d.append({
                         'num': n,
                         'clue': clues[c],
                         'clue_index': c,
                         'cell': i,
-                        'len': self.len_down(i)
+                        'len': down_len[i]
                     })
                     c += 1
                 if c > lastc:
@@ -525,6 +848,13 @@ class DefaultClueNumbering:
         self.across = a
         self.down = d
 
+    def across_cells(self, entry):
+        return range(entry['cell'], entry['cell'] + entry['len'])
+
+    def down_cells(self, entry):
+        return range(entry['cell'], entry['cell'] + entry['len'] * self.width,
+                     self.width)
+
     def col(self, index):
         return index % self.width
 
@@ -570,7 +900,7 @@ class Rebus:
         return bool(self.table[index])
 
     def get_rebus_squares(self):
-        return [i for i, b in enumerate(self.table) if b]
+        return nonzero_indexes(self.table)
 
     def get_rebus_solution(self, index):
         if self.is_rebus_square(index):
@@ -603,20 +933,59 @@ class Markup:
         markup_data = self.puzzle.extensions.get(Extensions.Markup, b'')
         self.markup = parse_bytes(markup_data)
 
+    @property
+    def markup(self):
+        return self._markup
+
+    @markup.setter
+    def markup(self, value):
+        # callers may assign a list of flags; keep it a bytearray
+        self._markup = value if isinstance(value, bytearray) else bytearray(value)
+
     def has_markup(self):
-        return any(bool(b) for b in self.markup)
+        return self.markup.count(0) != len(self.markup)
 
     def get_markup_squares(self):
-        return [i for i, b in enumerate(self.markup) if b]
+        return nonzero_indexes(self.markup)
 
     def is_markup_square(self, index):
-        return bool(self.table[index])
+        return bool(self.markup[index])
 
     def save(self):
         if self.has_markup():
             self.puzzle.extensions[Extensions.Markup] = pack_bytes(self.markup)
 
 
+class ScrambledChecksum:
+    """
+    Running equivalent of scrambled_cksum(fill, ...) for a fill that changes
+    one square at a time. The checksum state after each square is kept, so
+    a change only re-checksums the squares that come after it.
+    """
+    def __init__(self, fill, width, height, ignore_chars=BLACKSQUARE, encoding=ENCODING):
+        self.encoding = encoding
+        # grid indices of the checksummed squares, in column-major order
+        self.order = [r * width + c for c in range(width) for r in range(height)
+                      if fill[r * width + c] not in ignore_chars]
+        self.position = dict((index, k) for k, index in enumerate(self.order))
+        self.chunks = [fill[index].encode(encoding, ENCODING_ERRORS) for index in self.order]
+        self.states = [0] * (len(self.order) + 1)
+        self.dirty = 0
+
+    def set(self, index, c):
+        k = self.position.get(index)
+        if k is not None:
+            self.chunks[k] = c.encode(self.encoding, ENCODING_ERRORS)
+            self.dirty = min(self.dirty, k)
+
+    def cksum(self):
+        states = self.states
+        for k in range(self.dirty, len(self.chunks)):
+            states[k + 1] = data_cksum(self.chunks[k], states[k])
+        self.dirty = len(self.chunks)
+        return states[-1]
+
+
 # helper functions for cksums and scrambling
 def data_cksum(data, cksum=0):
     for b in data:
@@ -751,11 +1120,18 @@ def is_blacksquare(c):
 
 
 def parse_bytes(s):
-    return list(struct.unpack('B' * len(s), s))
+    return bytearray(s)
 
 
 def pack_bytes(a):
-    return struct.pack('B' * len(a), *a)
+    return bytes(a)
+
+
+NONZERO = re.compile(b'[^\\0]')
+
+
+def nonzero_indexes(a):
+    return [m.start() for m in NONZERO.finditer(a)]
 
 
 # dict string format is k1:v1;k2:v2;...;kn:vn;
@@ -0,0 +1,243 @@
+"""Solve history: a local database of solves, and the `cursewords stats`
+report built from it.
+
+Every interactive session records a small event in a sqlite database when
+the puzzle is saved and when it's completed. Solves are kept once per
+puzzle, and the columns the report groups by are indexed, so the report
+stays quick however many puzzles have been solved.
+"""
+
+import argparse
+import datetime
+import os
+import sqlite3
+import sys
+import time
+
+SAVED = 0
+SOLVED = 1
+
+WEEKDAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday',
+            'Saturday', 'Sunday']
+
+# Solves carry everything the report groups by, and each breakdown has a
+# covering index, so no query needs a join or a temporary sort of the rows.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS solves (
+    puzzle INTEGER PRIMARY KEY,
+    at INTEGER NOT NULL,
+    day INTEGER NOT NULL,
+    weekday INTEGER NOT NULL,
+    seconds INTEGER NOT NULL,
+    checks INTEGER NOT NULL,
+    reveals INTEGER NOT NULL,
+    title TEXT,
+    author TEXT,
+    width INTEGER,
+    height INTEGER
+);
+CREATE TABLE IF NOT EXISTS saves (
+    puzzle INTEGER NOT NULL,
+    at INTEGER NOT NULL,
+    seconds INTEGER,
+    filled INTEGER,
+    checks INTEGER,
+    reveals INTEGER
+);
+CREATE INDEX IF NOT EXISTS solves_day ON solves (day);
+CREATE INDEX IF NOT EXISTS solves_weekday ON solves (weekday, seconds);
+CREATE INDEX IF NOT EXISTS solves_author ON solves (author, seconds);
+CREATE INDEX IF NOT EXISTS solves_size ON solves (width, height, seconds);
+CREATE INDEX IF NOT EXISTS saves_puzzle ON saves (puzzle, at);
+"""
+
+
+def database_path():
+    data_home = (os.environ.get('XDG_DATA_HOME') or
+                 os.path.join(os.path.expanduser('~'), '.local', 'share'))
+    return os.path.join(data_home, 'cursewords', 'history.sqlite3')
+
+
+def puzzle_id(puzfile):
+    import hashlib
+
+    # a signed 64-bit hash, so it fits sqlite's INTEGER PRIMARY KEY
+    digest = hashlib.blake2b(
+        '\0'.join([puzfile.title, puzfile.author, puzfile.solution]).encode(
+            'utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big', signed=True)
+
+
+def format_time(seconds):
+    if seconds is None:
+        return '-'
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return '{}:{:02d}:{:02d}'.format(h, m, s) if h else '{}:{:02d}'.format(m, s)
+
+
+class History:
+    def __init__(self, path=None):
+        self.path = path or database_path()
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self.connect() as db:
+            db.execute('PRAGMA journal_mode = WAL')
+            db.executescript(SCHEMA)
+        db.close()
+
+    def connect(self):
+        # A connection per call, since saves come from the autosave thread
+        # as well as the input loop.
+        db = sqlite3.connect(self.path, timeout=5)
+        db.execute('PRAGMA synchronous = NORMAL')
+        return db
+
+    def record(self, grid, timer, kind):
+        """Record a save or solve of the puzzle in grid. Never raises, since
+        losing a history entry shouldn't interrupt solving."""
+        self.write(self.summarize(grid, timer), kind)
+
+    def summarize(self, grid, timer):
+        """What a record of the puzzle in grid holds, as of now. Saves
+        from the autosave thread take this while the cells can't change,
+        and write it afterwards."""
+        letters = [cell for cell in grid.cells.values() if cell.is_letter]
+        return {
+            'puzzle': puzzle_id(grid.puzfile),
+            'now': int(time.time()),
+            'seconds': int(timer.time_passed) if timer else 0,
+            'filled': sum(1 for cell in letters if not cell.is_blank),
+            'checks': sum(1 for cell in letters
+                          if cell.marked_wrong or cell.corrected),
+            'reveals': sum(1 for cell in letters if cell.revealed),
+            'title': grid.title,
+            'author': grid.author,
+            'width': grid.column_count,
+            'height': grid.row_count,
+        }
+
+    def write(self, summary, kind):
+        try:
+            with self.connect() as db:
+                if kind == SOLVED:
+                    # only the first solve of a puzzle counts
+                    today = datetime.date.fromtimestamp(summary['now'])
+                    db.execute(
+                        'INSERT OR IGNORE INTO solves '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (summary['puzzle'], summary['now'],
+                         today.toordinal(), today.weekday(),
+                         summary['seconds'], summary['checks'],
+                         summary['reveals'], summary['title'],
+                         summary['author'], summary['width'],
+                         summary['height']))
+                else:
+                    db.execute(
+                        'INSERT INTO saves VALUES (?, ?, ?, ?, ?, ?)',
+                        (summary['puzzle'], summary['now'],
+                         summary['seconds'], summary['filled'],
+                         summary['checks'], summary['reveals']))
+            db.close()
+        except sqlite3.Error:
+            pass
+
+    def report(self, out=sys.stdout, limit=10):
+        with self.connect() as db:
+            total, average, best, checks, reveals, clean = db.execute(
+                'SELECT count(*), avg(seconds), min(seconds), sum(checks), '
+                'sum(reveals), sum(checks = 0 AND reveals = 0) '
+                'FROM solves').fetchone()
+            started = total + db.execute(
+                'SELECT count(DISTINCT puzzle) FROM saves WHERE puzzle NOT IN '
+                '(SELECT puzzle FROM solves)').fetchone()[0]
+
+            if not total:
+                print("No solves recorded yet ({} puzzles started).".format(
+                    started), file=out)
+                return
+
+            current, longest = self.streaks(db)
+            print(textblock([
+                ('Puzzles solved', '{} of {} started'.format(total, started)),
+                ('Average time', format_time(average)),
+                ('Best time', format_time(best)),
+                ('Clean solves', '{} ({:.0%})'.format(clean, clean / total)),
+                ('Squares checked', checks or 0),
+                ('Squares revealed', reveals or 0),
+                ('Current streak', plural(current, 'day')),
+                ('Longest streak', plural(longest, 'day')),
+            ]), file=out)
+
+            breakdowns = [
+                ('By weekday',
+                 'SELECT weekday, count(*), avg(seconds), min(seconds) '
+                 'FROM solves GROUP BY weekday ORDER BY weekday'),
+                ('By author',
+                 'SELECT author, count(*), avg(seconds), min(seconds) '
+                 'FROM solves GROUP BY author ORDER BY count(*) DESC, author '
+                 'LIMIT {}'.format(int(limit))),
+                ('By size',
+                 "SELECT width || 'x' || height, count(*), avg(seconds), "
+                 'min(seconds) FROM solves GROUP BY width, height '
+                 'ORDER BY count(*) DESC LIMIT {}'.format(int(limit))),
+            ]
+            for heading, query in breakdowns:
+                rows = db.execute(query).fetchall()
+                if heading == 'By weekday':
+                    rows = [(WEEKDAYS[row[0]],) + row[1:] for row in rows]
+                print('\n' + heading, file=out)
+                print(table(rows), file=out)
+        db.close()
+
+    def streaks(self, db):
+        """Current and longest runs of consecutive days with a solve."""
+        longest = run = 0
+        previous = None
+        for day, in db.execute('SELECT DISTINCT day FROM solves ORDER BY day'):
+            run = run + 1 if previous and day - previous == 1 else 1
+            longest = max(longest, run)
+            previous = day
+        current = run if previous and (
+            datetime.date.today().toordinal() - previous) <= 1 else 0
+        return current, longest
+
+
+def plural(count, noun):
+    return '{} {}{}'.format(count, noun, '' if count == 1 else 's')
+
+
+def textblock(pairs):
+    width = max(len(label) for label, _ in pairs)
+    return '\n'.join('{:<{w}}  {}'.format(label, value, w=width)
+                     for label, value in pairs)
+
+
+def table(rows):
+    rows = [(name or 'Unknown', str(count), format_time(average),
+             format_time(best)) for name, count, average, best in rows]
+    rows.insert(0, ('', 'Solves', 'Average', 'Best'))
+    width = max(len(row[0]) for row in rows)
+    return '\n'.join('  {:<{w}}  {:>6}  {:>8}  {:>8}'.format(*row, w=width)
+                     for row in rows)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords stats',
+        description="""Summarize your solving history: times, checks and
+        reveals, streaks, and breakdowns by weekday, author and size.""")
+    parser.add_argument('--db', metavar='PATH',
+                        help="""history database to read (default: {})"""
+                        .format(database_path()))
+    parser.add_argument('--limit', type=int, default=10,
+                        help="""number of authors and sizes to list
+                        (default: 10)""")
+
+    args = parser.parse_args(argv)
+
+    try:
+        History(args.db).report(limit=args.limit)
+    except (OSError, sqlite3.Error) as err:
+        sys.exit("Unable to read solve history: {}".format(err))
+    return 0
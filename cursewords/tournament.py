@@ -0,0 +1,316 @@
+"""Tournament mode: timed competitions with answers checked by a server.
+
+`cursewords tournament PUZfile ADDRESS` holds the unlocked puzzle and hands
+every solver a copy with its solution locked, so the answers never leave
+the server. Solvers join with --tournament. Checking a square, word or
+puzzle asks the server which entries are wrong, and a finished grid is
+submitted along with the solver's Timer value to be verified and ranked.
+Every square checked adds a penalty to the solver's time, so that checking
+can't stand in for solving.
+
+Every request is a single record giving its size, followed by that many
+journal records, so the server never holds more than one puzzle's worth of
+records for any connection.
+"""
+
+import argparse
+import asyncio
+import getpass
+import random
+import struct
+import sys
+import time
+
+from blessed import Terminal
+
+from . import coop
+from . import formats
+from . import journal
+from . import puz
+
+JOIN = 48
+PUZZLE = 49
+CHECK = 50
+CHECKED = 51
+SUBMIT = 52
+RESULT = 53
+SCORED = 54
+
+MAX_NAME = 32
+
+# seconds added to a solver's time for every square checked
+CHECK_PENALTY = 10
+
+
+class TournamentError(coop.CoopError):
+    pass
+
+
+def format_time(seconds):
+    m, s = divmod(int(seconds), 60)
+    h, m = divmod(m, 60)
+    return '{}:{:02d}:{:02d}'.format(h, m, s) if h else '{}:{:02d}'.format(m, s)
+
+
+class Entrant:
+    def __init__(self, name):
+        self.name = name
+        self.joined = time.time()
+        self.connected = True
+        # squares checked, not requests
+        self.checks = 0
+        self.seconds = None
+
+    @property
+    def finished(self):
+        return self.seconds is not None
+
+
+class TournamentServer:
+    def __init__(self, filename, key=None, refresh=1,
+                 check_penalty=CHECK_PENALTY):
+        puzzle = formats.read(filename)
+        if puzzle.is_solution_locked():
+            raise TournamentError('the puzzle must have an unlocked solution')
+
+        self.filename = filename
+        self.refresh = refresh
+        self.check_penalty = check_penalty
+        self.solution = puzzle.solution
+        self.blocks = puzzle.blacksquare()
+        self.letters = sum(1 for c in self.solution if c not in self.blocks)
+        self.check_answers = puzzle.check_answers
+
+        # Every solver gets the same locked copy, built once.
+        handout = puz.load(puzzle.tobytes())
+        handout.fill = ''.join(c if c in self.blocks else '-'
+                               for c in handout.solution)
+        handout.lock_solution(key or random.randint(1000, 9999))
+        self.handout = handout.tobytes()
+
+        self.entrants = {}
+        self.changed = True
+        self.term = Terminal()
+
+    async def handle(self, reader, writer):
+        coop.set_nodelay(writer)
+        entrant = None
+        try:
+            op, _, size, _ = await self.read_record(reader)
+            if op != JOIN or size > MAX_NAME:
+                return
+            name = (await reader.readexactly(size)).decode('utf-8', 'replace')
+            entrant = self.join(name.strip() or 'anonymous')
+
+            writer.write(coop.pack(PUZZLE, len(self.handout)) + self.handout)
+            await writer.drain()
+
+            while True:
+                op, seconds, count, _ = await self.read_record(reader)
+                if op not in (CHECK, SUBMIT) or count > self.letters:
+                    return
+                cells = struct.iter_unpack(
+                    journal.RECORD_FORMAT,
+                    await reader.readexactly(count * journal.RECORD_SIZE))
+                if op == CHECK:
+                    reply = self.check(entrant, cells, count)
+                else:
+                    reply = self.submit(entrant, cells, seconds)
+                writer.write(reply)
+                await writer.drain()
+        except (asyncio.IncompleteReadError, asyncio.CancelledError,
+                ConnectionError):
+            pass
+        finally:
+            if entrant:
+                entrant.connected = False
+                self.changed = True
+            writer.close()
+
+    async def read_record(self, reader):
+        return struct.unpack(journal.RECORD_FORMAT,
+                             await reader.readexactly(journal.RECORD_SIZE))
+
+    def join(self, name):
+        # Rejoining under the same name picks up where the solver left off,
+        # but two solvers can't share a name at once.
+        name = name[:MAX_NAME]
+        base, n = name, 1
+        while name in self.entrants and self.entrants[name].connected:
+            n += 1
+            name = '{} ({})'.format(base, n)
+        entrant = self.entrants.setdefault(name, Entrant(name))
+        entrant.connected = True
+        self.changed = True
+        return entrant
+
+    def check(self, entrant, cells, count):
+        if not entrant.finished:
+            entrant.checks += count
+            self.changed = True
+        reply = [coop.pack(CHECKED, 0, count)]
+        for _, index, entry, _ in cells:
+            wrong = (index >= len(self.solution) or
+                     self.solution[index] != chr(entry))
+            reply.append(coop.pack(journal.CHECK, index, entry,
+                                   32 if wrong else 0))
+        return b''.join(reply)
+
+    def submit(self, entrant, cells, seconds):
+        fill = ['-' if c not in self.blocks else c for c in self.solution]
+        for _, index, entry, _ in cells:
+            if index < len(fill) and fill[index] == '-':
+                fill[index] = chr(entry)
+
+        accepted = self.check_answers(''.join(fill))
+        if accepted and not entrant.finished:
+            # The Timer leaves out time spent paused, but can't claim more
+            # than the time since the solver first joined.
+            seconds = min(seconds, int(time.time() - entrant.joined))
+            entrant.seconds = seconds + self.check_penalty * entrant.checks
+            self.changed = True
+
+        standings = self.standings()
+        finishers = sum(1 for e in standings if e.finished)
+        rank = standings.index(entrant) + 1 if accepted else 0
+        return (coop.pack(RESULT, rank, finishers, int(accepted)) +
+                coop.pack(SCORED, entrant.seconds or 0))
+
+    def standings(self):
+        return sorted(self.entrants.values(),
+                      key=lambda e: (not e.finished, e.seconds or 0,
+                                     e.checks, e.joined))
+
+    def leaderboard(self):
+        lines = ['{:>4}  {:<{w}}  {:>8}  {:>6}  {}'.format(
+            'Rank', 'Name', 'Time', 'Checks', 'Status', w=MAX_NAME)]
+        for rank, entrant in enumerate(self.standings(), 1):
+            status = ('solved' if entrant.finished
+                      else 'solving' if entrant.connected else 'left')
+            lines.append('{:>4}  {:<{w}}  {:>8}  {:>6}  {}'.format(
+                rank if entrant.finished else '',
+                entrant.name,
+                format_time(entrant.seconds) if entrant.finished else '',
+                entrant.checks, status, w=MAX_NAME))
+        return lines
+
+    async def show_leaderboard(self, address):
+        # Redrawn at most once per refresh, however busy the server is.
+        while True:
+            if self.changed:
+                self.changed = False
+                header = '{} on {}: {} solvers'.format(
+                    self.filename, address, len(self.entrants))
+                lines = [header, ''] + self.leaderboard()
+                if self.term.is_a_tty:
+                    lines = lines[:self.term.height - 1]
+                    print(self.term.home + self.term.clear + '\n'.join(lines),
+                          flush=True)
+                else:
+                    print('\n'.join(lines) + '\n', flush=True)
+            await asyncio.sleep(self.refresh)
+
+    async def serve_forever(self, address):
+        server = await coop.start_server(self.handle, address)
+        board = asyncio.ensure_future(self.show_leaderboard(address))
+        try:
+            await coop.serve_until_stopped(server)
+        finally:
+            board.cancel()
+
+    def serve(self, address):
+        try:
+            asyncio.run(self.serve_forever(address))
+        finally:
+            coop.remove_socket(address)
+            print('\n'.join(self.leaderboard()))
+
+
+def same_puzzle(a, b):
+    """Whether two copies of a locked puzzle are of the same puzzle. Each
+    server run locks its handout with its own key, so the scrambled
+    solutions differ; the layout and clues don't."""
+    blocks = a.blacksquare()
+    return ((a.width, a.height, a.clues) == (b.width, b.height, b.clues) and
+            [c in blocks for c in a.solution] ==
+            [c in blocks for c in b.solution])
+
+
+class TournamentClient:
+    def __init__(self, address, timeout=10):
+        self.sock = coop.connect(address)
+        self.sock.settimeout(timeout)
+
+    def recv_exactly(self, size):
+        data = b''
+        while len(data) < size:
+            chunk = self.sock.recv(size - len(data))
+            if not chunk:
+                raise TournamentError('connection closed by the server')
+            data += chunk
+        return data
+
+    def recv_record(self, op):
+        record = struct.unpack(journal.RECORD_FORMAT,
+                               self.recv_exactly(journal.RECORD_SIZE))
+        if record[0] != op:
+            raise TournamentError('unexpected reply from the server')
+        return record
+
+    def join(self, name=None):
+        """Sign in and return the locked puzzle, as .puz bytes."""
+        name = (name or getpass.getuser()).encode('utf-8')[:MAX_NAME]
+        self.sock.sendall(coop.pack(JOIN, 0, len(name)) + name)
+        return self.recv_exactly(self.recv_record(PUZZLE)[1])
+
+    def check(self, cells):
+        """Indexes of the entries in (index, Cell) pairs that are wrong."""
+        self.sock.sendall(coop.pack(CHECK, 0, len(cells)) +
+                          journal.pack_cells(cells, journal.CHECK))
+        count = self.recv_record(CHECKED)[2]
+        data = self.recv_exactly(count * journal.RECORD_SIZE)
+        return set(index for _, index, _, markup
+                   in struct.iter_unpack(journal.RECORD_FORMAT, data)
+                   if markup)
+
+    def submit(self, cells, seconds):
+        """Returns (accepted, rank, number of finishers so far, time with
+        penalties)."""
+        self.sock.sendall(coop.pack(SUBMIT, int(seconds), len(cells)) +
+                          journal.pack_cells(cells, journal.ENTRY))
+        _, rank, finishers, accepted = self.recv_record(RESULT)
+        seconds = self.recv_record(SCORED)[1]
+        return bool(accepted), rank, finishers, seconds
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='cursewords tournament',
+        description="""Host a timed solving competition. Solvers join with
+        cursewords --tournament ADDRESS PUZfile, and are sent a copy of the
+        puzzle with its solution locked, saved as PUZfile.""")
+    parser.add_argument('filename', metavar='PUZfile',
+                        help="""path of puzzle file in the \
+                        AcrossLite .puz, .ipuz or .jpz format""")
+    parser.add_argument('address', metavar='ADDRESS',
+                        help="""path of a Unix socket to listen on, or
+                        HOST:PORT for TCP""")
+    parser.add_argument('--key', type=int, metavar='KEY', help="""four-digit key to lock the
+                        solution with (default: random)""")
+    parser.add_argument('--check-penalty', type=int, default=CHECK_PENALTY,
+                        metavar='SECONDS',
+                        help="""seconds added to a solver's time for every
+                        square checked (default: {})""".format(CHECK_PENALTY))
+
+    args = parser.parse_args(argv)
+
+    try:
+        server = TournamentServer(args.filename, key=args.key,
+                                  check_penalty=args.check_penalty)
+    except TournamentError as err:
+        sys.exit("Unable to host {}: {}.".format(args.filename, err))
+    except Exception:
+        sys.exit("Unable to parse {} as a puzzle file.".format(args.filename))
+
+    server.serve(args.address)
+    return 0
@@ -0,0 +1,85 @@
+import array
+import collections
+import struct
+
+from . import journal
+
+# Rather than snapshots of the grid, the log keeps what each edit changed:
+# for every cell it touched, the cell's index with its entry and markup
+# before and after. Entries are single characters, as in the journal. An
+# edit is one record however many cells it covers, and the oldest records
+# are dropped once the log reaches its limits.
+DELTA_FORMAT = '<I H H B B'
+DELTA = struct.Struct(DELTA_FORMAT)
+
+
+class UndoLog:
+    def __init__(self, cells, max_bytes=2 << 20, max_records=10000):
+        # every cell's state as of the last edit the log saw
+        cells = list(cells)
+        self.entries = array.array('H', (journal.entry_code(cell.entry)
+                                         for cell in cells))
+        self.markups = bytearray(cell.markup for cell in cells)
+
+        self.max_bytes = max_bytes
+        self.max_records = max_records
+        self.undo_records = collections.deque()
+        self.redo_records = []
+        self.size = 0
+
+    def record(self, cells, undoable=True):
+        """Note the current state of (index, Cell) pairs that have just
+        been edited. Edits that aren't undoable, such as a co-op
+        partner's, are only noted so later deltas start from them."""
+        deltas = []
+        entries, markups = self.entries, self.markups
+        for index, cell in cells:
+            entry, markup = journal.entry_code(cell.entry), cell.markup
+            if entries[index] != entry or markups[index] != markup:
+                deltas.append(DELTA.pack(index, entries[index], entry,
+                                         markups[index], markup))
+                entries[index], markups[index] = entry, markup
+
+        if deltas and undoable:
+            self.push(b''.join(deltas))
+            self.redo_records.clear()
+
+    def push(self, record):
+        self.undo_records.append(record)
+        self.size += len(record)
+        while len(self.undo_records) > 1 and (
+                self.size > self.max_bytes or
+                len(self.undo_records) > self.max_records):
+            self.size -= len(self.undo_records.popleft())
+
+    def undo(self):
+        """[(index, entry, markup)] that undo the latest edit, or None."""
+        if not self.undo_records:
+            return None
+        record = self.undo_records.pop()
+        self.size -= len(record)
+        self.redo_records.append(record)
+        return self.restore(record, before=True)
+
+    def redo(self):
+        """[(index, entry, markup)] that redo the latest undone edit, or
+        None."""
+        if not self.redo_records:
+            return None
+        record = self.redo_records.pop()
+        self.push(record)
+        return self.restore(record, before=False)
+
+    def restore(self, record, before):
+        changes = []
+        deltas = list(DELTA.iter_unpack(record))
+        if before:
+            deltas.reverse()
+        for index, old_entry, new_entry, old_markup, new_markup in deltas:
+            if before:
+                entry, markup = old_entry, old_markup
+            else:
+                entry, markup = new_entry, new_markup
+            self.entries[index], self.markups[index] = entry, markup
+            changes.append((index, entry, markup))
+        return changes
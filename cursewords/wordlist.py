@@ -0,0 +1,180 @@
+"""Word lists indexed for pattern queries like A?P?E.
+
+A word list is a text file with one entry per line, optionally followed by
+a score as in "APPLE;50". It's compiled once into an index file alongside
+it, which is memory-mapped, so opening it costs almost nothing and every
+session on the machine shares the same pages.
+
+The index groups words by length. For each length it stores the words as
+fixed-width rows, best score first, then one bitset per (position,
+letter): bit i is set when word i has that letter there. A pattern query
+ANDs together the bitsets for its known letters and reads off the words
+for the bits that remain.
+"""
+
+import mmap
+import os
+import struct
+
+from . import puz
+
+MAGIC = b'CWW1'
+HEADER_FORMAT = '<4s I'
+ENTRY_FORMAT = '<I I Q Q'
+
+HEADER_SIZE = struct.calcsize(HEADER_FORMAT)
+ENTRY_SIZE = struct.calcsize(ENTRY_FORMAT)
+
+SYMBOLS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+SYMBOL_INDEX = dict((c, i) for i, c in enumerate(SYMBOLS))
+
+WILDCARDS = '?-. '
+
+
+def index_path(filename):
+    return filename + '.idx'
+
+
+def read_words(filename):
+    """Words from a list file, normalized and ordered best score first."""
+    scored = {}
+    with open(filename, encoding='utf-8', errors='replace') as f:
+        for line in f:
+            word, _, score = line.partition(';')
+            word = ''.join(c for c in word.upper() if c in SYMBOL_INDEX)
+            if not word:
+                continue
+            try:
+                score = int(score)
+            except ValueError:
+                score = 0
+            scored[word] = max(score, scored.get(word, score))
+    return sorted(scored, key=lambda word: (-scored[word], word))
+
+
+def build(words):
+    """The index file for words, as bytes."""
+    by_length = {}
+    for word in words:
+        by_length.setdefault(len(word), []).append(word)
+
+    lengths = sorted(by_length)
+    offset = HEADER_SIZE + ENTRY_SIZE * len(lengths)
+    directory, sections = [], []
+    for length in lengths:
+        group = by_length[length]
+        stride = (len(group) + 7) // 8
+        bits_data = bytearray(length * len(SYMBOLS) * stride)
+        for i, word in enumerate(group):
+            byte, bit = divmod(i, 8)
+            for position, c in enumerate(word):
+                bits_data[(position * len(SYMBOLS) + SYMBOL_INDEX[c]) *
+                          stride + byte] |= 1 << bit
+
+        words_data = ''.join(group).encode('ascii')
+        directory.append(struct.pack(ENTRY_FORMAT, length, len(group),
+                                     offset, offset + len(words_data)))
+        sections += [words_data, bits_data]
+        offset += len(words_data) + len(bits_data)
+
+    return b''.join([struct.pack(HEADER_FORMAT, MAGIC, len(lengths))] +
+                    directory + sections)
+
+
+def load(filename):
+    """
+    Open the index for a word list, compiling it first if it's missing or
+    older than the list. If the index can't be written next to the list,
+    it's built in memory instead.
+    """
+    path = index_path(filename)
+    try:
+        if os.stat(path).st_mtime >= os.stat(filename).st_mtime:
+            return WordIndex.open(path)
+    except (OSError, ValueError):
+        pass
+
+    data = build(read_words(filename))
+    try:
+        puz.atomic_write(path, data)
+    except OSError:
+        return WordIndex(data)
+    return WordIndex.open(path)
+
+
+class WordIndex:
+    def __init__(self, data):
+        self.data = data
+        try:
+            magic, count = struct.unpack_from(HEADER_FORMAT, data)
+            if magic != MAGIC:
+                raise ValueError('not a cursewords word index')
+
+            self.lengths = {}
+            for n in range(count):
+                length, words, words_offset, bits_offset = struct.unpack_from(
+                    ENTRY_FORMAT, data, HEADER_SIZE + n * ENTRY_SIZE)
+                stride = (words + 7) // 8
+                # a truncated or damaged index is rebuilt, not read past
+                if (words_offset + words * length != bits_offset or
+                        bits_offset + length * len(SYMBOLS) * stride >
+                        len(data)):
+                    raise ValueError('damaged word index')
+                self.lengths[length] = (words, words_offset, bits_offset,
+                                        stride)
+        except struct.error:
+            raise ValueError('truncated word index')
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def __len__(self):
+        return sum(entry[0] for entry in self.lengths.values())
+
+    def word(self, length, i):
+        offset = self.lengths[length][1] + i * length
+        return self.data[offset:offset + length].decode('ascii')
+
+    def bitset(self, length, position, c):
+        _, _, bits_offset, stride = self.lengths[length]
+        offset = bits_offset + (position * len(SYMBOLS) +
+                                SYMBOL_INDEX[c]) * stride
+        return int.from_bytes(self.data[offset:offset + stride], 'little')
+
+    def match(self, pattern, limit=None):
+        """
+        Words fitting pattern, best first, where ?, -, . and space stand for
+        any letter. Stops after limit words if given.
+        """
+        pattern = pattern.upper()
+        length = len(pattern)
+        if length not in self.lengths:
+            return []
+        count = self.lengths[length][0]
+        limit = count if limit is None else limit
+
+        known = [(position, c) for position, c in enumerate(pattern)
+                 if c not in WILDCARDS]
+        if not known:
+            return [self.word(length, i) for i in range(min(limit, count))]
+        if any(c not in SYMBOL_INDEX for _, c in known):
+            return []
+
+        matches = -1
+        for position, c in known:
+            matches &= self.bitset(length, position, c)
+            if not matches:
+                return []
+
+        words = []
+        while matches and len(words) < limit:
+            low = matches & -matches
+            words.append(self.word(length, low.bit_length() - 1))
+            matches ^= low
+        return words
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
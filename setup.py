@@ -36,6 +36,7 @@ setup(
     entry_points={
         'console_scripts': [
             'cursewords=cursewords:main',
+            'cursewords-launch=cursewords.launch:main',
         ],
     },
     keywords='puz crossword crosswords xword xwords puzzle acrosslite'
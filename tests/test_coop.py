@@ -0,0 +1,53 @@
+import os
+import tempfile
+import unittest
+
+from cursewords import coop
+from cursewords import memstats
+
+
+class FakeWriter:
+    def __init__(self):
+        self.data = b''
+        self.transport = self
+
+    def get_write_buffer_size(self):
+        return 0
+
+    def write(self, data):
+        self.data += data
+
+
+class ClientIdTest(unittest.TestCase):
+    def setUp(self):
+        tempdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tempdir.cleanup)
+        filename = os.path.join(tempdir.name, 'test.puz')
+        memstats.generate(5).save(filename)
+        self.server = coop.CoopServer(filename)
+
+    def connect(self):
+        client_id = self.server.allocate_id()
+        if client_id is not None:
+            self.server.clients[client_id] = FakeWriter()
+        return client_id
+
+    def test_ids_are_reused_past_the_field_size(self):
+        for _ in range(coop.MAX_CLIENT_ID + 10):
+            client_id = self.connect()
+            self.server.receive(client_id, coop.pack(coop.CURSOR, 0))
+            self.server.drop(client_id)
+        self.assertEqual(self.connect(), 1)
+
+    def test_ids_run_out(self):
+        for _ in range(coop.MAX_CLIENT_ID):
+            self.assertIsNotNone(self.connect())
+        self.assertIsNone(self.connect())
+
+        self.server.receive(coop.MAX_CLIENT_ID, coop.pack(coop.CURSOR, 0))
+        self.server.drop(coop.MAX_CLIENT_ID)
+        self.assertEqual(self.connect(), coop.MAX_CLIENT_ID)
+
+
+if __name__ == '__main__':
+    unittest.main()